@@ -25,6 +25,9 @@ def telegram_bot_sendtext(message):
     return response.json()
 
 def sendMeasurementReport(tester,testRun,result):
+    if tester.simulation:
+        print('Measurement Report not sent, ' + testRun + ' ran on the simulated hardware')
+        return
     print('Measurement Report sent with ' + tester.testerName + ', ' + testRun + ',  %.2f' % result)
     message=('Measurement result from ' + tester.testerName + '\nWith result: ' + testRun + ' ' + (str(result))) 
     telegram_bot_sendtext(message)
@@ -55,6 +58,10 @@ def sendUnableFillSyringes(tester,slot,testName):
     message=('From: ' + tester + '\nUnable to Fill Syringes by reagent:' + slot + ' For test: ' + testName)
     telegram_bot_sendtext(message)
 
+def sendHomingAlarm(tester,reason):
+    message=('From: ' + tester.testerName + '\nUnable to Home the Syringe Carriage: ' + reason)
+    telegram_bot_sendtext(message)
+
 def sendCannotParkAlarm(tester,testConcern):
     message=('From: ' + tester + '\nParking Failure' + testConcern)
     telegram_bot_sendtext(message)
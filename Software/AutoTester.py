@@ -29,7 +29,15 @@ import schedule    # @UnresolvedImport
 import requests   # @UnresolvedImport
 import os
 import shutil
-from ImageCheck import evaluateColor,evaluateColorBinary
+from ImageCheck import evaluateColor,evaluateColorBinary,getBinaryTransitionProgress,getBinaryTransitionTarget
+from FrameBuffer import FrameRingBuffer,EncodedFrameFanout
+from JobDispatcher import JobDispatcher
+from Titration import titrationStepper,phEndpointPredictor
+from MotionPlanner import Mixerreactor,Cleanreactor,CentimeterToMove,planReagentDraw,planReagentDose,runMotionPlan
+from StepExecutor import StepExecutor,describeReport
+from LogPipeline import logContext
+from PhaseTrace import traced
+from Metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
 from Alarms import sendMeasurementReport,sendReagentAlarm,sendFillAlarm,sendDispenseAlarm,sendEvaluateAlarm,sendUnableFillSyringes,sendUnableToRotateAlarm,sendCannotParkAlarm,sendOutOfLimitsAlarm,sendOutOfLimitsWarning
 import sys
 from skimage.color.rgb_colors import greenyellow
@@ -43,11 +51,8 @@ currentVersion='0.02'
 remoteControlThreadRPYC=None
 tester=None
 letterSequenceCheck={'A':'B','B':'C','C':'D','D':'E','E':'F','F':'G','G':'H','H':'I','I':'J','J':'K','K':'L','L':'A'}
-Mixerreactor='Mixerreactor'
-Cleanreactor='Cleanreactor'
 osmosewater='osmosewater'
 tankwater='tankwater'
-CentimeterToMove={'A':0,'B':3.7,'C':7.3,'D':11,'E':14.9,'F':18.6,'G':22.1,'H':25.7,'I':29.7,'J':33.3,'K':36.9,'L':40.5,'M':44.5,'Cleanreactor':47.9,'Mixerreactor':51.1}
 destinationLetters='ABCDEFGHIJKLM'
 airInSyringe=0.00 #was 0.07
 syringeTolorance=0.03
@@ -114,11 +119,29 @@ class TesterRemoteControl(rpyc.Service):
 			processWebCommand(tester,operation)
 		except:
 			tester.debugLog.exception("Continuing...")
+
+	def exposed_getLatestMeasurement(self):
+		#Sent as a tuple so rpyc passes it by value
+		if tester.latestMeasurement is None:
+			return None
+		return tuple(tester.latestMeasurement.items())
+
+	def exposed_jobQueueChanged(self):
+		try:
+			tester.loadJobQueueFromDB()
+		except:
+			tester.debugLog.exception("Continuing...")
 	
 def startHandler(threadName,operation): 
 	tester.debugMessage('Thread: ' + threadName + ' started')
 	operation.start() 
 	
+def publishFrame(image):
+	if tester.frameBuffer.publishFrame(image):
+		tester.framesGrabbed.inc()
+	else:
+		tester.framesDropped.inc()
+
 def videoGrabber():
 	frameIntervalDelta=datetime.timedelta(milliseconds=1000/tester.framesPerSecond)
 	frameIntervalSecs=frameIntervalDelta.microseconds/1000000
@@ -126,8 +149,16 @@ def videoGrabber():
 	tester.webcamInitialize()
 	time.sleep(.1)
 	nextTime=datetime.datetime.now()
+	statisticsInterval=datetime.timedelta(seconds=60)
+	nextStatisticsTime=nextTime+statisticsInterval
 	while True:
 		try:
+			if datetime.datetime.now()>=nextStatisticsTime:
+				tester.debugMessage('Frame buffer: ' + tester.frameBuffer.statisticsText())
+				tester.frameBuffer.resetStatistics()
+				tester.debugMessage('Stream: ' + tester.streamFanout.statisticsText())
+				tester.streamFanout.resetStatistics()
+				nextStatisticsTime+=statisticsInterval
 			if tester.suppressProcessing:
 				try:
 					imageLo=tester.grabFrame()
@@ -135,12 +166,10 @@ def videoGrabber():
 					tester.debugLog.exception("Continuing...")  
 					imageLo=None                              
 				if imageLo is None:
+					tester.frameGrabFailures.inc()
 					time.sleep(.01)
 				else:
-					tester.videoLowResCaptureLock.acquire()
-					tester.latestLowResImage=imageLo
-					tester.videoLowResCaptureLock.notifyAll()
-					tester.videoLowResCaptureLock.release()                
+					publishFrame(imageLo)
 			else:
 				currTime=datetime.datetime.now()
 				if currTime>=nextTime:
@@ -153,12 +182,10 @@ def videoGrabber():
 						tester.debugLog.exception("Continuing...")  
 						imageLo=None                              
 					if imageLo is None:
+						tester.frameGrabFailures.inc()
 						time.sleep(.01)
 					else:
-						tester.videoLowResCaptureLock.acquire()
-						tester.latestLowResImage=imageLo
-						tester.videoLowResCaptureLock.notifyAll()
-						tester.videoLowResCaptureLock.release()
+						publishFrame(imageLo)
 	#                    tester.debugMessage('Grabbed low res frame')
 	#                i+=1
 					nextTime=nextTime+frameIntervalDelta
@@ -169,64 +196,103 @@ def videoGrabber():
 			tester.debugLog.exception("Continuing...")
 			time.sleep(.1)
 
+def drawStreamOverlay(imageCopy):
+	font = cv2.FONT_HERSHEY_SIMPLEX        
+	cv2.putText(imageCopy,'System Status: ' + tester.systemStatus,(10,25), font, .75,(255,255,255),2,cv2.LINE_AA)
+	cv2.putText(imageCopy,'Last PH: ' + str(PH),(10,630), font, .75,(255,255,255),2,cv2.LINE_AA)
+	x,y,w,h = 350,630,175,75
+	cv2.rectangle(imageCopy, (x, 560), (x + w, y + h), (BGR), -1)
+	if not tester.testStatus is None:
+		try:
+			cv2.putText(imageCopy,"Running Test: " + tester.currentTest,(20,55), font, .75,(255,255,255),2,cv2.LINE_AA)
+			cv2.putText(imageCopy,tester.testStatus,(10,85), font, .75,(255,255,255),2,cv2.LINE_AA)                                
+		except:
+			tester.debugLog.exception("Error displaying test Status")
+
+	if tester.showTraining and not tester.currentFeature is None:
+		insertTrainingGraphic(tester,imageCopy)
+	if tester.seriesRunning:
+				cv2.putText(imageCopy,'Series Running',(200,115), font, .75,(255,255,255),2,cv2.LINE_AA)                                
+	if tester.referenceMarkFound and tester.displayDot:
+		cv2.line(imageCopy,(int(tester.avgCircleLeftMarkerCol),int(tester.avgCircleLeftMarkerRow)),(int(tester.avgCircleRightMarkerCol),int(tester.avgCircleRightMarkerRow)),(255,0,0),4)
+	if tester.colorTable:
+		try:
+			colorTable=tester.colorTable.generateColorTableDisplay(tester,width=tester.colorTable.tableWidth,height=tester.colorTable.tableRowHeight)
+			if not colorTable is None:
+				showTableRows,showTableCols,showTableColors=colorTable.shape
+				imageCopy[tester.colorTable.tableStartPosition:tester.colorTable.tableStartPosition+showTableRows,:showTableCols,:] =  colorTable
+		except:
+			traceback.print_exc()
+
+def videoCompositor():
+	#Draws the overlay and encodes each frame once, no matter how many viewers are connected
+	imageCopy=None
+	frameSequence=None
+	while True:
+		try:
+			if not tester.streamFanout.waitForViewers(timeout=1):
+				continue
+			if tester.suppressProcessing:
+				tester.streamFanout.publishPart(tester.dummyBlackScreen)
+				time.sleep(.1)
+				continue
+			frameSequence,frame,frameSlot=tester.frameBuffer.acquireFrame(frameSequence,timeout=1)
+			if frame is None:
+				continue
+			try:
+				if imageCopy is None or imageCopy.shape!=frame.shape:
+					imageCopy=np.empty_like(frame)
+				np.copyto(imageCopy,frame)
+			finally:
+				tester.frameBuffer.releaseFrame(frameSlot)
+			encodeStart=time.perf_counter()
+			drawStreamOverlay(imageCopy)
+#            r,jpg = cv2.imencode('.jpg',tester.maskGrey)
+			r,jpg = cv2.imencode('.jpg',imageCopy)
+			encodeSecs=time.perf_counter()-encodeStart
+			tester.jpegEncodeSeconds.observe(encodeSecs)
+			tester.streamFanout.publishPart(jpg,encodeSecs)
+		except:
+			tester.debugLog.exception("Continuing...")
+			time.sleep(1)
+
 class TesterViewer(BaseHTTPRequestHandler):
 	
 	def do_GET(self):
-		font = cv2.FONT_HERSHEY_SIMPLEX        
-		if self.path.endswith('.mjpg'):
+		if self.path=='/metrics':
+			body=tester.metrics.render().encode('utf-8')
 			self.send_response(200)
-			self.send_header('Content-type','multipart/x-mixed-replace; boundary=--jpgboundary')
+			self.send_header('Content-type',METRICS_CONTENT_TYPE)
+			self.send_header('Content-length',str(len(body)))
 			self.end_headers()
-			while tester.streamVideo:
-				try:
-					if tester.suppressProcessing:
-						while tester.suppressProcessing:
-							time.sleep(1)
-							return
-					tester.videoLowResCaptureLock.acquire()
-					tester.videoLowResCaptureLock.wait()
-					if tester.suppressProcessing:
-						tester.videoLowResCaptureLock.release()
-						jpg=tester.dummyBlackScreen
-					else:
-						imageCopy=tester.latestLowResImage.copy()
-						tester.videoLowResCaptureLock.release()
-						cv2.putText(imageCopy,'System Status: ' + tester.systemStatus,(10,25), font, .75,(255,255,255),2,cv2.LINE_AA)
-						cv2.putText(imageCopy,'Last PH: ' + str(PH),(10,630), font, .75,(255,255,255),2,cv2.LINE_AA)
-						x,y,w,h = 350,630,175,75
-						cv2.rectangle(imageCopy, (x, 560), (x + w, y + h), (BGR), -1)
-						if not tester.testStatus is None:
-							try:
-								cv2.putText(imageCopy,"Running Test: " + tester.currentTest,(20,55), font, .75,(255,255,255),2,cv2.LINE_AA)
-								cv2.putText(imageCopy,tester.testStatus,(10,85), font, .75,(255,255,255),2,cv2.LINE_AA)                                
-							except:
-								tester.debugLog.exception("Error displaying test Status")
-
-						if tester.showTraining and not tester.currentFeature is None:
-							insertTrainingGraphic(tester,imageCopy)
-						if tester.seriesRunning:
-									cv2.putText(imageCopy,'Series Running',(200,115), font, .75,(255,255,255),2,cv2.LINE_AA)                                
-						if tester.referenceMarkFound and tester.displayDot:
-							cv2.line(imageCopy,(int(tester.avgCircleLeftMarkerCol),int(tester.avgCircleLeftMarkerRow)),(int(tester.avgCircleRightMarkerCol),int(tester.avgCircleRightMarkerRow)),(255,0,0),4)
-						if tester.colorTable:
-							try:
-								colorTable=tester.colorTable.generateColorTableDisplay(tester,width=tester.colorTable.tableWidth,height=tester.colorTable.tableRowHeight)
-								if not colorTable is None:
-									showTableRows,showTableCols,showTableColors=colorTable.shape
-									imageCopy[tester.colorTable.tableStartPosition:tester.colorTable.tableStartPosition+showTableRows,:showTableCols,:] =  colorTable
-							except:
-								traceback.print_exc()
-	#                    r,jpg = cv2.imencode('.jpg',tester.maskGrey)
-						r,jpg = cv2.imencode('.jpg',imageCopy)
-					self.wfile.write(bytearray("--jpgboundary\r\n",'utf-8'))
-					self.send_header('Content-type','image/jpeg')
-					self.send_header('Content-length',str(len(jpg)))
-					self.end_headers()
-					self.wfile.write(bytearray(jpg))
-					self.wfile.write(bytearray('\r\n','utf-8'))
-				except:
-#                    tester.debugLog.exception("Continuing...")
-					break                    
+			self.wfile.write(body)
+			return
+		if self.path.endswith('.mjpg'):
+			if not tester.streamFanout.addViewer():
+				self.send_error(503,'Too many stream viewers')
+				return
+			try:
+				self.send_response(200)
+				self.send_header('Content-type','multipart/x-mixed-replace; boundary=--jpgboundary')
+				self.end_headers()
+				#A viewer that stops reading is dropped rather than left holding a thread forever
+				self.connection.settimeout(tester.streamWriteTimeoutSecs)
+				partSequence=None
+				while tester.streamVideo:
+					try:
+						if tester.suppressProcessing:
+							while tester.suppressProcessing:
+								time.sleep(1)
+								return
+						partSequence,part=tester.streamFanout.waitForPart(partSequence,timeout=5)
+						if part is None:
+							continue
+						self.wfile.write(part)
+					except:
+#                        tester.debugLog.exception("Continuing...")
+						break                    
+			finally:
+				tester.streamFanout.removeViewer()
 			tester.debugMessage('Connection aborted')
 			while not tester.streamVideo:
 				time.sleep(1)
@@ -303,8 +369,8 @@ def orientTester():
 	if tester.LineTester is True:
 		tester.connectArduinoStepper()
 		tester.connectArduinoSensor()
-		tester.homingArduinoStepper()
-		tester.infoMessage('Homing Arduino Stepper done')
+		if tester.homingArduinoStepper():
+			tester.infoMessage('Homing Arduino Stepper done')
 	tester.systemStatus="Idle"
 	tester.infoMessage('Orientation done!')
 
@@ -391,7 +457,7 @@ def cleanSyringe():
 		sendUnableToRotateAlarm(tester,ts.titrationSlot,testName)
 		return False
 
-	time.sleep(2)
+	tester.sleep(2)
 	tester.cleanDrainPumpOff()
 	tester.turnAgitatorOff()
 
@@ -411,23 +477,21 @@ def cleanSyringe():
 		sendUnableFillSyringes(tester,ts.titrationSlot,testName)
 		return False
 	  
-def cleanMixerReactor(tester):
+@traced('clean mixer','cleaning')
+def cleanMixerReactor(tester,doubleCleanCycle):
+	#Only the drain, the main pump and the agitator, the syringe carriage can be elsewhere
 	try:
-		success=tester.UpperSyringes()
-		TargetXas=CentimeterToMove[Mixerreactor]
-		success=tester.XtoTargetReagent(TargetXas)
 		tester.mainDrainPump(8)
 		tester.turnAgitator(0)
 		cleanCycle=0
 
-		doubleCleanCycle=tester.calculateLastTest()
 		if doubleCleanCycle==True:
 			cleanCycle-=tester.mixerCleanCycles
 			tester.infoMessage('Extra Cleaning the Mixer') 
 			tester.testStatus='Extra Cleaning the Mixer'
 
 		while cleanCycle<tester.mixerCleanCycles:
-			time.sleep(.5)
+			tester.sleep(.5)
 			tester.MixerReactorPump(tester.mixerCleanML,tankwater)
 			tester.mainDrainPump(12)
 			cleanCycle+=1
@@ -435,6 +499,7 @@ def cleanMixerReactor(tester):
 	except:
 		tester.debugLog.exception("Failure cleaning Mixer")
 
+@traced('osmose clean mixer','cleaning')
 def osmoseCleanMixerReactor(tester):
 	try:
 		success=tester.UpperSyringes()
@@ -444,7 +509,7 @@ def osmoseCleanMixerReactor(tester):
 		tester.turnAgitator(0)
 		cleanCycle=0
 		while cleanCycle<tester.mixerCleanCycles:
-			time.sleep(.5)
+			tester.sleep(.5)
 			tester.MixerReactorPump(tester.mixerCleanML,osmosewater)
 			tester.mainDrainPump(12)
 			cleanCycle+=1
@@ -460,13 +525,13 @@ def evaluateResults(tester,colorChartToUse,results):
 	return rs
 
 def evaluateResultsBinary(tester,colorChartToUse):
-	tester.videoLowResCaptureLock.acquire()
-	tester.videoLowResCaptureLock.wait()
-	imageCopy=tester.latestLowResImage.copy()
-	tester.videoLowResCaptureLock.release()
+	frameSequence,frame,frameSlot=tester.frameBuffer.acquireFrame()
 	global BGR
-	l,a,b,bgr,Rvalue,Gvalue,Bvalue=tester.measureArduinoSensor()
-	rs=evaluateColorBinary(tester,imageCopy,colorChartToUse,l,a,b)
+	try:
+		l,a,b,bgr,Rvalue,Gvalue,Bvalue=tester.measureArduinoSensor()
+		rs=evaluateColorBinary(tester,frame,colorChartToUse,l,a,b)
+	finally:
+		tester.frameBuffer.releaseFrame(frameSlot)
 	if rs.valueAtSwatch<0:
 		rs.valueAtSwatch=0
 	tester.infoMessage('Result was: ' + str(rs.valueAtSwatch)) 
@@ -491,7 +556,34 @@ def checkTestRange(tester,ts,results):
 			sendOutOfLimitsWarning(tester,ts.testName,results)
 			alarmSent=True        
 
+def prepareMixerReactor(tester,executor,testName,waterVolInML,doubleCleanCycle):
+	with executor.holding('agitator'):
+		tester.infoMessage('Cleaning the Mixer') 
+		tester.testStatus='Cleaning the Mixer'
+		cleanMixerReactor(tester,doubleCleanCycle)
+
+	tester.infoMessage('Filling the Mixing Cylinder') 
+	tester.testStatus='Filling the Mixing Cylinder'
+	fillResult=tester.MixerReactorPump(waterVolInML,tankwater)
+	if not fillResult:
+		tester.debugLog.info("Failure filling cylinder")
+		sendFillAlarm(tester,testName)
+		return False
+
+	tester.calibrateArduinoSensor()
+	return True
+
+def traceStepOperations(tester,testStepNumber,executor):
+	#The operations ran on the executor's threads, so they are added to the trace once the step is over
+	if tester.phaseTrace is None:
+		return
+	for operation in executor.operations:
+		if not operation['startTime'] is None:
+			tester.phaseTrace.record(operation['name'],'test step',operation['startTime'],operation['endTime'],failed=operation['status']=='Failed',thread='Step ' + operation['name'])
+
+@traced('reagent step {0}','test step')
 def runTestStep(tester,testStepNumber,testName,waterVolInML,reagentSlot,agitateReagentSecs,agitateMixerSecs,AgitateSecsBetweenDrips,amountToDispense,thickLiquid,lastStep=False):
+	logContext.set(step=testStepNumber,phase='reagent')
 	try:
 		tester.infoMessage('Check Syringe is up' )
 		tester.testStatus='Check Syringe is up'
@@ -501,152 +593,76 @@ def runTestStep(tester,testStepNumber,testName,waterVolInML,reagentSlot,agitateR
 			sendUnableToRotateAlarm(tester,reagentSlot,testName)
 			return False
 
-		if waterVolInML>0:
-			tester.infoMessage('Move to Mixerreactor') 
-			tester.testStatus='Move to Mixerreactor'
-			TargetXas=CentimeterToMove[Mixerreactor]
-			success=tester.XtoTargetReagent(TargetXas)
+		def showStepStatus(message):
+			tester.infoMessage(message + ' (reagent ' + str(testStepNumber) + ')')
+			tester.testStatus=message + ' (reagent ' + str(testStepNumber) + ')'
 
-			tester.infoMessage('Cleaning the Mixer') 
-			tester.testStatus='Cleaning the Mixer'
-			cleanMixerReactor(tester)
-				
-			tester.infoMessage('Filling the Mixing Cylinder') 
-			tester.testStatus='Filling the Mixing Cylinder'
-			fillResult=tester.MixerReactorPump(waterVolInML,tankwater)
-			if not fillResult:
-				tester.debugLog.info("Failure filling cylinder")
-				sendFillAlarm(tester,testName)
+		def runStepPlan(plan):
+			failedMove=runMotionPlan(tester.grbl,plan,showStepStatus,tester.grbl.moveTimeoutSecs,tester.phaseTrace)
+			if not failedMove is None:
+				tester.debugMessage('Unable to ' + failedMove['description'] + ' for reagent ' + str(testStepNumber))
+				if failedMove['axis']=='Y':
+					sendUnableFillSyringes(tester,reagentSlot,testName)
+				else:
+					sendUnableToRotateAlarm(tester,reagentSlot,testName)
 				return False
+			return True
 
-			tester.calibrateArduinoSensor()
-
-		cleanSyringeBeforeTest=tester.calculateLastTest()
-		if cleanSyringeBeforeTest==True:
-			cleanSyringe()
-
-		tester.infoMessage('Move to Reagent ' + str(testStepNumber)) 
-		tester.testStatus='Move to Reagent ' + str(testStepNumber)
-		TargetXas=CentimeterToMove[reagentSlot]
-		success=tester.XtoTargetReagent(TargetXas)
-		if not success:
-			tester.debugMessage('Unable to move to Reagent ' + str(testStepNumber))
-			sendUnableToRotateAlarm(tester,reagentSlot,testName)
-			return False
-
-		if agitateReagentSecs>0:
-			tester.infoMessage('Agitating the Reagent for ' + str(agitateReagentSecs) + ' secs.') 
-			tester.testStatus='Agitating the Reagent for ' + str(agitateReagentSecs) + ' secs.'
-			tester.turnAgitator(agitateReagentSecs)
-
-		#success=tester.fillSyringes(airInSyringe) Oude voor lucht
-		success=tester.fillSyringes(amountToDispense)
-		tester.infoMessage('Lower the Syringe in the Reagent ' + str(testStepNumber)) 
-		tester.testStatus='Lower the Syringe in the Reagent ' + str(testStepNumber)
-		success=tester.lowerSyringesInReagent()
-		if not success:
-			tester.debugMessage('Unable to lower the Syringe in the reagent ' + str(testStepNumber))
-			sendUnableToRotateAlarm(tester,reagentSlot,testName)
-			return False
-
-		tester.infoMessage('Get Reagent Liquid ' + str(testStepNumber)) 
-		tester.testStatus='Get Reagent Liquid ' + str(testStepNumber)	
-
-
-		success=tester.fillSyringes(airInSyringe) #Tijdelijk voor test om lucht in reagent glaasje te krijgen om vacuum te voorkomen.
-
-		success=tester.fillSyringes(amountToDispense+airInSyringe+syringeTolorance)
-		if not success:
-			tester.debugMessage('Unable to get Reagent Liquid ' + str(testStepNumber))
-			sendUnableFillSyringes(tester,reagentSlot,testName)
-			return False
-
-		if thickLiquid==True:
-			tester.infoMessage('Wait for Thick Reagent ' + str(testStepNumber)) 
-			tester.testStatus='Wait for Thick Reagent ' + str(testStepNumber)
-			time.sleep(60)
-
-		success=tester.fillSyringes(amountToDispense+airInSyringe)
-
-		if thickLiquid==True:
-			tester.infoMessage('Wait for Thick Reagent ' + str(testStepNumber)) 
-			tester.testStatus='Wait for Thick Reagent ' + str(testStepNumber)
-			time.sleep(10)
-
-		tester.infoMessage('Upper the Syringe out of the Reagent ' + str(testStepNumber)) 
-		tester.testStatus='Upper the Syringe out of the Reagent ' + str(testStepNumber)
-		success=tester.UpperSyringes()
-		if not success:
-			tester.debugMessage('Unable to upper the Syringe out of the Reagent ' + str(testStepNumber))
-			sendUnableToRotateAlarm(tester,reagentSlot,testName)
-			return False
+		#The mixer, the syringe carriage and the agitator are driven separately, so the mixer is cleaned and filled while the reagent is drawn
+		executor=StepExecutor(parallel=tester.pipelineTestSteps,debugLog=tester.debugLog)
+		def agitate(secs):
+			with executor.holding('agitator'):
+				tester.turnAgitator(secs)
 
-		tester.infoMessage('Move to Mixerreactor') 
-		tester.testStatus='Move to Mixerreactor'
-		TargetXas=CentimeterToMove[Mixerreactor]
-		success=tester.XtoTargetReagent(TargetXas)
-		if not success:
-			tester.debugMessage('Unable to move to Mixerreactor ')
-			sendUnableToRotateAlarm(tester,reagentSlot,testName)
-			return False
-
-		tester.infoMessage('Lower the Syringe in the Mixerreactor') 
-		tester.testStatus='Lower the Syringe in the Mixerreactor'
-		success=tester.lowerSyringesInMixerreactor()
-		if not success:
-			tester.debugMessage('Unable to lower the Syringe in the Mixerreactor')
-			sendUnableToRotateAlarm(tester,reagentSlot,testName)
-			return False
+		lastTestLongAgo=tester.calculateLastTest()
+		doseAfter=[]
+		if waterVolInML>0:
+			doseAfter.append(executor.add('prepare mixer',lambda: prepareMixerReactor(tester,executor,testName,waterVolInML,lastTestLongAgo),resources=('mainPump','mainDrain','sensor'),laterResources=('agitator',)))
 
-		if AgitateSecsBetweenDrips>0:
-			tester.infoMessage('Dose Reagent Liquid ' + str(testStepNumber) + ' in steps') 
-			tester.testStatus='Dose Reagent Liquid ' + str(testStepNumber) + ' in steps'
-			mlToDispense=amountToDispense
-			while True:
-				if mlToDispense>0:
-					success=tester.fillSyringes(mlToDispense)
-					tester.turnAgitator(AgitateSecsBetweenDrips)
-					mlToDispense-=0.01
-				else:
-					break
-		else:
-			tester.infoMessage('Dose Reagent Liquid ' + str(testStepNumber)) 
-			tester.testStatus='Dose Reagent Liquid ' + str(testStepNumber)
-			success=tester.doseSyringesLiquid()
-			if not success:
-				tester.debugMessage('Unable to dose Reagent Liquid ' + str(testStepNumber))
-				sendUnableFillSyringes(tester,reagentSlot,testName)
-				return False
+		drawAfter=[]
+		if lastTestLongAgo==True:
+			drawAfter.append(executor.add('clean syringe',cleanSyringe,resources=('carriage','cleanPumps','agitator')))
 
-		tester.infoMessage('Upper the Syringe out of the Mixerreactor') 
-		tester.testStatus='Upper the Syringe out of the Mixerreactor'
-		success=tester.UpperSyringes()
-		if not success:
-			tester.debugMessage('Unable to upper the Syringe out of the Mixerreactor')
-			sendUnableToRotateAlarm(tester,reagentSlot,testName)
-			return False
+		drawPlan=planReagentDraw(CentimeterToMove[reagentSlot],amountToDispense,airInSyringe,syringeTolorance,agitateReagentSecs,thickLiquid,agitate=agitate,wait=tester.sleep)
+		doseAfter.append(executor.add('draw reagent',lambda: runStepPlan(drawPlan),resources=('carriage',),after=drawAfter,laterResources=('agitator',)))
+		dosePlan=planReagentDose(CentimeterToMove[Mixerreactor],amountToDispense,AgitateSecsBetweenDrips,agitate=agitate)
+		executor.add('dose reagent',lambda: runStepPlan(dosePlan),resources=('carriage',),after=doseAfter,laterResources=('agitator',))
 
 		if agitateMixerSecs>0:
-			tester.infoMessage('Agitating the Mixerreactor for ' + str(agitateMixerSecs) + ' secs.') 
-			tester.testStatus='Agitating the Mixerreactor for ' + str(agitateMixerSecs) + ' secs.'
-			tester.turnAgitator(agitateMixerSecs)
+			def agitateMixer():
+				tester.infoMessage('Agitating the Mixerreactor for ' + str(agitateMixerSecs) + ' secs.') 
+				tester.testStatus='Agitating the Mixerreactor for ' + str(agitateMixerSecs) + ' secs.'
+				tester.turnAgitator(agitateMixerSecs)
+			executor.add('agitate mixer',agitateMixer,resources=('agitator',),after=('dose reagent',))
+
+		report=executor.run()
+		traceStepOperations(tester,testStepNumber,executor)
+		tester.debugLog.info('Test step ' + str(testStepNumber) + ' ' + describeReport(report))
+		tester.testStepSecs+=report['wallSecs']
+		tester.testStepSavedSecs+=report['savedSecs']
+		if not report['failed'] is None:
+			tester.debugMessage('Test step ' + str(testStepNumber) + ' stopped, ' + report['failed'] + ' failed')
+			return False
 
 		tester.saveNewReagentValue(reagentSlot,amountToDispense)
 
 		if tester.lastReagentRemainingML<tester.reagentRemainingMLAlarmThresholdAutoTester and tester.reagentAlmostEmptyAlarmEnable:
 			sendReagentAlarm(tester,reagentSlot,tester.lastReagentRemainingML)
 
-		cleanSyringe()
+		with tester.tracePhase('clean syringe','cleaning'):
+			cleanSyringe()
 
 		return True
 	except:
 		tester.debugLog.exception('Failure when running Test Step ' + str(testStepNumber))
 		return False
 	
+@traced('color read','test step')
 def getDirectReadResultsRGBColor(tester,ts,sequenceName):
+	logContext.set(step=None,phase='color read')
 	testSucceeded=True
 	results=None
-	tester.colorTable=tester.colorSheetList[ts.colorChartToUse].generateColorTableDisplay(tester)        
+	tester.colorTable=tester.colorSheetList[ts.colorChartToUse]
 	if ts.agitateMixtureSecs>0:
 		success=tester.UpperSyringes()
 		TargetXas=CentimeterToMove[Mixerreactor]
@@ -659,7 +675,7 @@ def getDirectReadResultsRGBColor(tester,ts,sequenceName):
 	timeRemaining=ts.delayBeforeReadingSecs-ts.agitateMixtureSecs
 	while timeRemaining>0:
 		tester.testStatus='Waiting ' + str(timeRemaining) + ' secs before reading mixture.'
-		time.sleep(1)
+		tester.sleep(1)
 		timeRemaining-=1
 	try:
 		rs=evaluateResults(tester,ts.colorChartToUse,results)
@@ -678,7 +694,7 @@ def getDirectReadResultsRGBColor(tester,ts,sequenceName):
 	
 	l,a,b,BGR,Rvalue,Gvalue,Bvalue=tester.measureArduinoSensor()
 
-	time.sleep(tester.pauseInSecsBeforeEmptyingMixingChamber)
+	tester.sleep(tester.pauseInSecsBeforeEmptyingMixingChamber)
 
 	if testSucceeded:
 		tester.testStatus='Result was: %.2f' % results + ' - Emptying chamber'
@@ -687,7 +703,9 @@ def getDirectReadResultsRGBColor(tester,ts,sequenceName):
 	tester.mainDrainPump(6)
 	return results
 
+@traced('absorption read','test step')
 def getDirectReadResultsWithArbsorption(tester,ts,sequenceName):
+	logContext.set(step=None,phase='absorption read')
 	testSucceeded=True
 	results=None
 	global BGR
@@ -704,7 +722,7 @@ def getDirectReadResultsWithArbsorption(tester,ts,sequenceName):
 	timeRemaining=ts.delayBeforeReadingSecs-ts.agitateMixtureSecs
 	while timeRemaining>0:
 		tester.testStatus='Waiting ' + str(timeRemaining) + ' secs before reading mixture.'
-		time.sleep(1)
+		tester.sleep(1)
 		timeRemaining-=1
 	try:
 		xg = np.fromstring(ts.lightAbsorptionValue, dtype=float, sep=',')
@@ -738,7 +756,7 @@ def getDirectReadResultsWithArbsorption(tester,ts,sequenceName):
 	
 	l,a,b,BGR,Rvalue,Gvalue,Bvalue=tester.measureArduinoSensor()
 
-	time.sleep(tester.pauseInSecsBeforeEmptyingMixingChamber)
+	tester.sleep(tester.pauseInSecsBeforeEmptyingMixingChamber)
 
 	if testSucceeded:
 		tester.testStatus='Result was: %.2f' % results + ' - Emptying chamber'
@@ -747,7 +765,48 @@ def getDirectReadResultsWithArbsorption(tester,ts,sequenceName):
 	tester.mainDrainPump(6)
 	return results
 
+def titrateToTransition(tester,ts,dispenseCount,amountToDose,dispenseLimit,colorResultsList,stepper,titrationTrace):
+	#Doses and reads until the transition is crossed or dispenseLimit is passed.  The stepper decides each dose.
+	targetProgress=getBinaryTransitionTarget(tester,ts.colorChartToUse,ts.titrationTransition)
+	while dispenseCount<=dispenseLimit:
+		success=tester.fillSyringes(amountToDose+airInSyringe)
+		tester.testStatus='Processing with dispense = ' + str(round(dispenseCount,2))
+		if ts.titrationAgitateMixerSecs>0:
+			tester.turnAgitator(ts.titrationAgitateMixerSecs)
+		tester.sleep(0.5)
+		rs=evaluateResultsBinary(tester,ts.colorChartToUse)
+		rs.swatchDropCount=round(dispenseCount,2)
+		colorResultsList.append(rs)
+		print('Observed Value = ' + str(rs.valueAtSwatch))
+		progress=getBinaryTransitionProgress(tester,ts.colorChartToUse,rs.channel1,rs.channel2,rs.channel3)
+		stepper.recordObservation(dispenseCount,progress)
+		titrationTrace.append({'time':time.time(),'dispensed':dispenseCount,'value':rs.valueAtSwatch,'progress':progress,'step':None})
+		if rs.valueAtSwatch>=ts.titrationTransition:
+			print('Exited')
+			return True,stepper.endpoint(targetProgress),dispenseCount,amountToDose
+		step=stepper.nextStep(targetProgress,dispenseLimit-dispenseCount)
+		titrationTrace[-1]['step']=step
+		amountToDose-=step
+		dispenseCount+=step
+	print('Exited')
+	return False,0,dispenseCount,amountToDose
+
+def logTitrationTrace(tester,titrationTrace):
+	tester.lastTitrationTrace=titrationTrace
+	if len(titrationTrace)==0:
+		return
+	startTime=titrationTrace[0]['time']
+	tester.debugMessage('Titration trace (' + ('adaptive' if tester.titrationAdaptive else 'linear') + ', ' + str(len(titrationTrace)) + ' reads):')
+	for entry in titrationTrace:
+		if entry['step'] is None:
+			stepText='-'
+		else:
+			stepText='%.3f' % entry['step']
+		tester.debugMessage('  %6.1f s  dispensed %.3f ML  value %.3f  progress %.3f  next step %s' % (entry['time']-startTime,entry['dispensed'],entry['value'],entry['progress'],stepText))
+
+@traced('titration','test step')
 def runTitration(tester,ts,sequenceName):
+	logContext.set(step=None,phase='titration')
 	global BGR
 	l,a,b,BGR,Rvalue,Gvalue,Bvalue=tester.measureArduinoSensor()
 
@@ -843,7 +902,7 @@ def runTitration(tester,ts,sequenceName):
 		if remainingWaitTime>0:
 			tester.infoMessage('Waiting for ' + str(remainingWaitTime) + ' secs before beginning titration.') 
 			tester.testStatus='Waiting for ' + str(remainingWaitTime) + ' secs before beginning titration.'
-			time.sleep(remainingWaitTime)
+			tester.sleep(remainingWaitTime)
 
 		tester.infoMessage('Lower the Syringe in the Mixerreactor') 
 		tester.testStatus='Lower the Syringe in the Mixerreactor'
@@ -854,10 +913,11 @@ def runTitration(tester,ts,sequenceName):
 			return False
 
 		dispenseCount=0
-		firstpass=0
 		triggerpoint=0
 		colorResultsList=[]
+		titrationTrace=[]
 		testSucceeded=False
+		stepper=titrationStepper(adaptive=tester.titrationAdaptive,minStepML=tester.titrationMinStepML,maxStepML=tester.titrationMaxStepML)
 
 		if ts.titrationFirstSkip>0.01:
 			TitronFirstSkipdose=1-ts.titrationFirstSkip
@@ -865,25 +925,7 @@ def runTitration(tester,ts,sequenceName):
 			amountToDose-=ts.titrationFirstSkip
 			dispenseCount+=ts.titrationFirstSkip
 
-		while dispenseCount<=amountToDispense:
-			success=tester.fillSyringes(amountToDose+airInSyringe)
-			tester.testStatus='Processing with dispense = ' + str(round(dispenseCount,2))
-			if ts.titrationAgitateMixerSecs>0:
-				tester.turnAgitator(ts.titrationAgitateMixerSecs)
-			time.sleep(0.5)
-			rs=evaluateResultsBinary(tester,ts.colorChartToUse)
-			rs.swatchDropCount=round(dispenseCount,2)
-			colorResultsList.append(rs)
-			print('Observed Value = ' + str(rs.valueAtSwatch))
-			if rs.valueAtSwatch>=ts.titrationTransition:
-				testSucceeded=True
-				firstpass+=1
-				if firstpass==1:
-					triggerpoint=dispenseCount
-				break	
-			amountToDose-=0.01
-			dispenseCount+=0.01
-		print('Exited')
+		testSucceeded,triggerpoint,dispenseCount,amountToDose=titrateToTransition(tester,ts,dispenseCount,amountToDose,amountToDispense,colorResultsList,stepper,titrationTrace)
 
 		if titrationsecondamount>0.01 and testSucceeded==False:
 			tester.infoMessage('Upper the Syringe' )
@@ -1007,26 +1049,9 @@ def runTitration(tester,ts,sequenceName):
 				sendUnableToRotateAlarm(tester,ts.titrationSlot,testName)
 				return False
 
-			while dispenseCount<=ts.titrationMaxAmount:
-				success=tester.fillSyringes(amountToDose+airInSyringe)
-				tester.testStatus='Processing with dispense = ' + str(round(dispenseCount,2))
-				if ts.titrationAgitateMixerSecs>0:
-					tester.turnAgitator(ts.titrationAgitateMixerSecs)
-				time.sleep(0.5)
-				rs=evaluateResultsBinary(tester,ts.colorChartToUse)
-				rs.swatchDropCount=round(dispenseCount,2)
-				colorResultsList.append(rs)
-				print('Observed Value = ' + str(rs.valueAtSwatch))
-				if rs.valueAtSwatch>=ts.titrationTransition:
-					testSucceeded=True
-					firstpass+=1
-					if firstpass==1:
-						triggerpoint=dispenseCount
-					break
-
-				amountToDose-=0.01
-				dispenseCount+=0.01
-			print('Exited')
+			testSucceeded,triggerpoint,dispenseCount,amountToDose=titrateToTransition(tester,ts,dispenseCount,amountToDose,ts.titrationMaxAmount,colorResultsList,stepper,titrationTrace)
+
+		logTitrationTrace(tester,titrationTrace)
 
 		tester.infoMessage('Upper the Syringe' )
 		tester.testStatus='Upper the Syringe'
@@ -1059,7 +1084,7 @@ def runTitration(tester,ts,sequenceName):
 			sendEvaluateAlarm(tester,sequenceName)
 			tester.debugLog.exception("Failure evaluating")
 
-		time.sleep(tester.pauseInSecsBeforeEmptyingMixingChamber)
+		tester.sleep(tester.pauseInSecsBeforeEmptyingMixingChamber)
 
 		tester.infoMessage('Move to CleaningReactor') 
 		tester.testStatus='Move to CleaningReactor'
@@ -1085,7 +1110,7 @@ def runTitration(tester,ts,sequenceName):
 
 			amountToDose-=0.01
 			success=tester.fillSyringes(amountToDose+airInSyringe)
-			time.sleep(1)
+			tester.sleep(1)
 
 			tester.cleanDrainPump(0)
 
@@ -1097,7 +1122,7 @@ def runTitration(tester,ts,sequenceName):
 				sendUnableToRotateAlarm(tester,ts.titrationSlot,testName)
 				return False
 
-			time.sleep(2)
+			tester.sleep(2)
 			tester.cleanDrainPumpOff()
 			tester.turnAgitatorOff()
 
@@ -1151,15 +1176,16 @@ def runTitration(tester,ts,sequenceName):
 			sendReagentAlarm(tester,ts.titrationSlot,tester.lastReagentRemainingML)
 		return results
 	except:
-		time.sleep(1)
+		tester.sleep(1)
 		tester.mainDrainPump(6)
 
 		tester.debugLog.exception('Failure when running Titration Step')
 		return None
 
+@traced('KH titration','test step')
 def runKHTest(tester,ts,sequenceName):
+	logContext.set(step=None,phase='KH titration')
 	from datetime import datetime as dt
-	from tester.models import TesterExternal,TestDefinition,JobExternal
 	PHmin = 6.5
 	PHmax = 9
 	PHStartSlowReagentDose = 6
@@ -1208,6 +1234,26 @@ def runKHTest(tester,ts,sequenceName):
 	tester.reagentPumpCommand(ts.titrationFirstSkip)
 	doseTotalReagent+=ts.titrationFirstSkip
 
+	endpointML=None
+	if tester.khPredictiveEndpoint and testSucceeded==None:
+		predictor=phEndpointPredictor(endpointPH=PHreachpoint,slowStartPH=PHStartSlowReagentDose,minDoseML=tester.khMinDoseML,maxDoseML=tester.khMaxDoseML)
+		predictor.recordObservation(0,PH)
+		while doseTotalReagent<ts.titrationMaxAmount:
+			dose=predictor.nextDose(ts.titrationMaxAmount-doseTotalReagent)
+			tester.infoMessage('Dosed ' + str(round(doseTotalReagent,3)) + 'ML and PH is ' + str(PH) + ', next dose ' + str(round(dose,3)) + 'ML') 
+			tester.testStatus='Dosed ' + str(round(doseTotalReagent,3)) + 'ML and PH is ' + str(PH)
+			tester.reagentPumpCommand(dose)
+			doseTotalReagent+=dose
+			PH = tester.read_ph()
+			predictor.recordObservation(doseTotalReagent,PH)
+			if PH <= PHreachpoint:
+				endpointML=predictor.endpoint()
+				print ('Test passed with total reagent used ' + str(doseTotalReagent) + ', endpoint at ' + str(endpointML))
+				testSucceeded=True
+				break
+		if testSucceeded==None:
+			testSucceeded=False
+
 	while doseTotalReagent<=ts.titrationMaxAmount and testSucceeded==None:
 		tester.infoMessage('Dosed ' + str(doseTotalReagent) + 'ML and PH is ' + str(PH)) 
 		tester.testStatus='Dosed ' + str(doseTotalReagent) + 'ML and PH is ' + str(PH)
@@ -1233,7 +1279,9 @@ def runKHTest(tester,ts,sequenceName):
 	tester.mixerJarMotorCommandManual(0)
 	
 	if testSucceeded is True:
-		KHValue = round((doseTotalReagent*ts.calctovalue),2)
+		if endpointML is None:
+			endpointML=doseTotalReagent
+		KHValue = round((endpointML*ts.calctovalue),2)
 		tester.infoMessage('Result was: '+ str(KHValue) + 'KH')
 		tester.testStatus='Result was: '+ str(KHValue) + 'KH'
 		sendMeasurementReport(tester,sequenceName,KHValue)
@@ -1267,10 +1315,7 @@ def runKHTest(tester,ts,sequenceName):
 		print('KH test needs to be remeasured because out of accetable range, now check for time.')
 		if lastKHWithExtraTime <= dt.now():
 			print('test has to be redone, test will be scheduled again')
-			te=TesterExternal.objects.get(pk=1)
-			newJob=JobExternal()
-			newJob.jobToRun=TestDefinition.objects.get(testName=sequenceName)
-			newJob.save()
+			tester.addJobToQueue(sequenceName)
 		else:
 			print('test is already done again, no further action needed.')
 	else:
@@ -1284,7 +1329,7 @@ def CalibratePH(tester):
 		waitTime-=1
 		tester.infoMessage('Wait ' + str(waitTime) + ' Sec') 
 		tester.systemStatus='Wait ' + str(waitTime) + ' Sec'
-		time.sleep(1)
+		tester.sleep(1)
 	result=tester.calibratePH()
 	if result is True:
 		message = 'Passed'
@@ -1295,28 +1340,80 @@ def CalibratePH(tester):
 	global PH
 	PH = tester.read_ph()
 	print('PH now: ' + str(PH))
-	time.sleep(10)
+	tester.sleep(10)
 	tester.systemStatus="Idle"
 	return
 
 
+def mixerCleanedByTest(ts):
+	#A test that fills the mixer cleans it with tank water first, so the osmose clean before it can be left out
+	return not ts is None and not ts.KHtestwithPHProbe and ts.waterVolInML>0 and not ts.reagent1Slot is None and ts.reagent1Amount>0
+
+@traced('park','cleaning')
+def parkTester(tester,forceHome=False):
+	logContext.set(step=None,phase='park')
+	if forceHome:
+		#A step that failed part way can leave the syringes lowered, away from where GRBL was last sent
+		tester.homingArduinoStepper(force=True)
+	osmoseCleanMixerReactor(tester)
+	tester.sleep(1)
+	if tester.parkArduinoStepper():
+		tester.infoMessage('System Parked') 
+	tester.batchInProgress=False
+	logContext.set(step=None,phase=None)
+
+def reportBatch(tester):
+	if len(tester.batchResults)>1:
+		summary=', '.join(testName + ' ' + ('failed' if results is None else '%.2f' % results) for testName,results in tester.batchResults)
+		tester.testStatus='Batch done: ' + summary
+		tester.infoMessage('Batch of %d tests took %.0f secs, skipped %d osmose cleans (%.0f ML): ' % (len(tester.batchResults),time.time()-tester.batchStartTime,
+			tester.batchParkingsSkipped,tester.batchParkingsSkipped*tester.mixerCleanCycles*tester.mixerCleanML) + summary)
+	tester.batchResults=[]
+	tester.batchParkingsSkipped=0
+
+def leaveMixerForNextTest(tester):
+	#When the next test is already due and cleans the mixer itself, park once after it instead
+	nextTest=None
+	if tester.batchQueuedTests and not tester.abortJob:
+		nextTest=tester.peekNextTest()
+	if mixerCleanedByTest(nextTest):
+		tester.batchInProgress=True
+		tester.batchParkingsSkipped+=1
+		tester.infoMessage('Leaving the Mixer for ' + nextTest.testName + ' to clean')
+	else:
+		parkTester(tester)
+
+def parkBeforeTest(tester,ts):
+	#The test the mixer was left for may have been removed from the queue after another test became due
+	if tester.batchInProgress and not mixerCleanedByTest(ts):
+		tester.infoMessage('Parking before ' + ts.testName + ', which does not clean the Mixer')
+		parkTester(tester)
+		reportBatch(tester)
+		tester.batchStartTime=time.time()
+
 def runTestSequence(tester,sequenceName):
-	from tester.models import ReagentSetup
 	tester.systemStatus="Running Test"
 	tester.abortJob=False
+	if not tester.batchInProgress:
+		tester.batchStartTime=time.time()
 	results=None
 	tester.infoMessage('Running Test ' + sequenceName) 
 	tester.currentTest=sequenceName
+	testStartTime=time.time()
+	tester.startTestTrace(sequenceName)
+	logContext.set(test=sequenceName,step=None,phase='start')
 	testSucceeded=None
 	global BGR
 	try:
 		ts=tester.testSequenceList[sequenceName]
+		parkBeforeTest(tester,ts)
+		tester.hardware.sampleForTest(tester,ts)
 
 		if ts.KHtestwithPHProbe:
 			if not ts.titrationSlot is None:
-				if (ReagentSetup.objects.get(slotName=ts.titrationSlot).fluidRemainingInML)<tester.reagentRemainingMLAlarmThresholdKHTester:
-					sendReagentAlarm(tester,ts.titrationSlot,ReagentSetup.objects.get(slotName=ts.titrationSlot).fluidRemainingInML)
-					tester.infoMessage('KH Reagent to low to start test')
+				for slotLabel,slotName,remainingML in tester.findShortReagents(ts,tester.reagentRemainingMLAlarmThresholdKHTester):
+					sendReagentAlarm(tester,slotName,remainingML)
+					tester.infoMessage(slotLabel + ' to low to start test')
 					testSucceeded=False
 
 				if not testSucceeded is False and not tester.abortJob:
@@ -1327,32 +1424,16 @@ def runTestSequence(tester,sequenceName):
 
 		else:
 
-			numSteps=0
-			tester.homingArduinoStepper()
-			if not ts.reagent1Slot is None:
-				numSteps+=1
-				if (ReagentSetup.objects.get(slotName=ts.reagent1Slot).fluidRemainingInML)<tester.reagentRemainingMLAlarmThresholdAutoTester:
-					tester.infoMessage('Reagent 1 to low to start test')
-					sendReagentAlarm(tester,ts.reagent1Slot,ReagentSetup.objects.get(slotName=ts.reagent1Slot).fluidRemainingInML)
-					testSucceeded=False
-			if not ts.reagent2Slot is None:
-				numSteps+=1
-				if (ReagentSetup.objects.get(slotName=ts.reagent2Slot).fluidRemainingInML)<tester.reagentRemainingMLAlarmThresholdAutoTester:
-					tester.infoMessage('Reagent 2 to low to start test')
-					sendReagentAlarm(tester,ts.reagent2Slot,ReagentSetup.objects.get(slotName=ts.reagent2Slot).fluidRemainingInML)
-					testSucceeded=False
-			if not ts.reagent3Slot is None:
-				numSteps+=1
-				if (ReagentSetup.objects.get(slotName=ts.reagent3Slot).fluidRemainingInML)<tester.reagentRemainingMLAlarmThresholdAutoTester:
-					sendReagentAlarm(tester,ts.reagent3Slot,ReagentSetup.objects.get(slotName=ts.reagent3Slot).fluidRemainingInML)
-					tester.infoMessage('Reagent 3 to low to start test')
-					testSucceeded=False
-			if not ts.titrationSlot is None:
-				numSteps+=1
-				if (ReagentSetup.objects.get(slotName=ts.titrationSlot).fluidRemainingInML)<tester.reagentRemainingMLAlarmThresholdAutoTester:
-					sendReagentAlarm(tester,ts.titrationSlot,ReagentSetup.objects.get(slotName=ts.titrationSlot).fluidRemainingInML)
-					tester.infoMessage('Titration to low to start test')
-					testSucceeded=False
+			numSteps=len(tester.getReagentSlotsForTest(ts))
+			tester.testStepSecs=0
+			tester.testStepSavedSecs=0
+			if not tester.homingArduinoStepper():
+				tester.infoMessage('Unable to home the syringe carriage')
+				testSucceeded=False
+			for slotLabel,slotName,remainingML in tester.findShortReagents(ts,tester.reagentRemainingMLAlarmThresholdAutoTester):
+				tester.infoMessage(slotLabel + ' to low to start test')
+				sendReagentAlarm(tester,slotName,remainingML)
+				testSucceeded=False
 
 			if not testSucceeded is False:
 				if not ts.reagent1Slot is None and ts.reagent1Amount>0:
@@ -1364,6 +1445,7 @@ def runTestSequence(tester,sequenceName):
 						if success and not ts.reagent3Slot is None and ts.reagent3Amount>0  and not tester.abortJob:
 							success=runTestStep(tester,3,sequenceName,0,ts.reagent3Slot,ts.reagent3AgitateSecs,ts.reagent3AgitateMixerSecs,ts.reagent3AgitateSecsBetweenDrips,ts.reagent3Amount,ts.reagent3ThickLiquid,lastStep=numSteps==3)
 							testSucceeded=success
+				tester.infoMessage('Test steps took %.0f secs, %.0f secs saved by overlapping them' % (tester.testStepSecs,tester.testStepSavedSecs))
 				if testSucceeded and not tester.abortJob:
 					if ts.titrationSlot is None:
 						if not ts.colorChartToUse is None:
@@ -1389,12 +1471,10 @@ def runTestSequence(tester,sequenceName):
 						tester.testStatus='Test Failed'
 						print('Test Failed')
 
-				osmoseCleanMixerReactor(tester)
-
-				time.sleep(1)
-
-				tester.homingArduinoStepper()
-				tester.infoMessage('System Parked') 
+			if testSucceeded is True:
+				leaveMixerForNextTest(tester)
+			else:
+				parkTester(tester,forceHome=True)
 		if testSucceeded is False or None:
 			tester.testStatus='Test Failed'
 		else:
@@ -1402,8 +1482,19 @@ def runTestSequence(tester,sequenceName):
 		tester.colorTable=None
 	except:
 		tester.debugLog.exception('Failure when running Test')
+		#The test stopped part way, so the next one can not count on the mixer
+		tester.batchInProgress=False
 	if tester.KHTester is True:
 		tester.turnAgitatorOff()
+	try:
+		tester.saveMeasurementIfDue(force=True)
+	except:
+		tester.debugLog.exception('Unable to save the last measurement')
+	tester.saveTestTrace()
+	tester.testDurationSeconds.observe(time.time()-testStartTime,test=sequenceName)
+	tester.testsRun.inc(test=sequenceName,result='aborted' if tester.abortJob else ('failed' if testSucceeded is False else 'succeeded'))
+	tester.batchResults.append((sequenceName,None if testSucceeded is False else results))
+	logContext.clear()
 	tester.systemStatus="Idle"
 	BGR=255,255,255
 	return testSucceeded
@@ -1435,22 +1526,21 @@ def queueTestJob(tester,jobToQueue):
 def runTestFromQueue():    
 	while True:
 		try:
-			moreToDo=tester.anyMoreJobs()
-			if moreToDo and tester.systemStatus=='Idle':
-				tester.runTestLock.acquire()
+			tester.jobDispatcher.waitForReadyJob(lambda: tester.systemStatus=='Idle')
+			tester.runTestLock.acquire()
+			try:
 				nextJobToRun=tester.getNextJob()
+			finally:
 				tester.runTestLock.release()
-				if nextJobToRun is None:
-					time.sleep(10)
-				else:
-					if tester.simulation:
-						print('Would have runTestSequence for ' + nextJobToRun)
-					else:
-						runTestSequence(tester,nextJobToRun)
-					tester.abortJob=False
-					tester.clearRunningJobs() 
-			else:
-				time.sleep(10)
+			if not nextJobToRun is None:
+				runTestSequence(tester,nextJobToRun)
+				if tester.batchInProgress and not tester.anyMoreJobs():
+					#The test the mixer was left for was removed before it could start
+					parkTester(tester)
+				if not tester.batchInProgress:
+					reportBatch(tester)
+				tester.abortJob=False
+				tester.clearRunningJobs() 
 		except:
 			tester.debugLog.exception("Error in Test Runner...")
 			time.sleep(10)
@@ -1514,7 +1604,12 @@ def testerJobScheduler():
 			tester.resetJobSchedule=False
 			resetJobSchedules()
 		schedule.run_pending()
-		time.sleep(10) 
+		#Sleep until the next scheduled job, waking early if the schedules are edited.  Capped so clock changes are picked up.
+		secsToNextJob=schedule.idle_seconds()
+		if secsToNextJob is None or secsToNextJob>60:
+			secsToNextJob=60
+		tester.jobScheduleChanged.wait(max(secsToNextJob,0))
+		tester.jobScheduleChanged.clear()
 		
 def runDiagnosticTest(diagnosticTest):
 	tester.systemStatus="Running Diagnostic"
@@ -1555,14 +1650,22 @@ def testerDiagnostics():
 			tester.diagnosticLock.release()
 			runDiagnosticTest(nextDiagnostic)
 		else:
+			#Woken when a diagnostic is queued, and rechecked while the tester is busy
+			if diagnosticQueueItemCount>0:
+				tester.diagnosticLock.wait(1)
+			else:
+				tester.diagnosticLock.wait()
 			tester.diagnosticLock.release()
-		time.sleep(10)
 				 
 def exit_handler():
 	global remoteControlThreadRPYC
 	tester.debugMessage('Done')
+	tester.saveMeasurementIfDue(force=True)
+	if not tester.grbl is None:
+		tester.grbl.stop()
 	remoteControlThreadRPYC.close()
 	tester.webcamRelease()
+	tester.stopLogging()
 	
 if __name__ == '__main__':
 	from WebCmdHandler import processWebCommand
@@ -1592,9 +1695,13 @@ if __name__ == '__main__':
 		else:
 			tester.infoMessage('Web port not active, so launching webserver on port: ' + str(tester.webPort))
 			runWebServer(tester,testerWebName)
-	tester.videoLowResCaptureLock=threading.Condition()
+	tester.frameBuffer=FrameRingBuffer()
+	tester.streamFanout=EncodedFrameFanout(tester.maxStreamViewers)
 	tester.runTestLock=threading.Lock()
-	tester.diagnosticLock=threading.Lock()
+	tester.diagnosticLock=threading.Condition()
+	tester.jobScheduleChanged=threading.Event()
+	tester.jobDispatcher=JobDispatcher()
+	tester.loadJobQueueFromDB()
 	tester.testerLog.info('Feeded Server Threaded Started')
 	remoteControlThreadRPYC = ThreadedServer(TesterRemoteControl, port = 18861)
 	atexit.register(exit_handler)
@@ -1603,6 +1710,9 @@ if __name__ == '__main__':
 	videoGrabberThread=threading.Thread(target=videoGrabber,name='Video Grabber',args=())
 	videoGrabberThread.start()
 	tester.infoMessage('Thread: ' + videoGrabberThread.getName() + ' started')
+	videoCompositorThread=threading.Thread(target=videoCompositor,name='Video Compositor',args=())
+	videoCompositorThread.start()
+	tester.infoMessage('Thread: ' + videoCompositorThread.getName() + ' started')
 	videoStreamerThread=threading.Thread(target=videoStreamer,name='Video Streamer',args=())
 	videoStreamerThread.start()
 	tester.infoMessage('Thread: ' + videoStreamerThread.getName() + ' started')
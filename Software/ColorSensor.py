@@ -0,0 +1,155 @@
+'''
+AutoTester is the controlling software to automatically run water tests
+Further info can be found at: https://robogardens.com/?p=928
+This software is free for DIY, Nonprofit, and educational uses.
+Copyright (C) 2017 - RoboGardens.com
+
+Created on Oct 18, 2026
+
+This module talks to the IO Rodeo colorimeter on the Arduino.  The batched mode asks for all the
+channels with one [1] command and waits on the reply line, the legacy mode sends [9], [10] and [11]
+with fixed pauses the way the tester always has.  The fake sensor answers the same protocol over a
+pty so the code can be run without the hardware.
+'''
+
+import os
+import threading
+import time
+import serial   # @UnresolvedImport
+
+CMD_GET_MEASUREMENT=1
+CMD_GET_MEASUREMENT_RED=9
+CMD_GET_MEASUREMENT_GREEN=10
+CMD_GET_MEASUREMENT_BLUE=11
+RSP_SUCCESS='1'
+
+class ColorSensor:
+    def __init__(self,sensorPort,batchedMeasurement=True,responseTimeoutSecs=2,debugLog=None):
+        self.sensorPort=sensorPort
+        self.batchedMeasurement=batchedMeasurement
+        self.responseTimeoutSecs=responseTimeoutSecs
+        self.debugLog=debugLog
+        #Reads that had to be made again, for the tester's metrics
+        self.retries=0
+
+    def sendCommand(self,command):
+        self.sensorPort.write(str.encode("[" + str(command) + "]" + '\n'))
+
+    def readResponseLine(self):
+        #readline returns whatever arrived within the port timeout, so keep reading until the line is complete
+        deadline=time.time()+self.responseTimeoutSecs
+        line=b''
+        while True:
+            line+=self.sensorPort.readline()
+            if line.endswith(b'\n'):
+                return line
+            if time.time()>=deadline:
+                raise serial.SerialTimeoutException('No response from color sensor, got: ' + str(line))
+
+    def parseResponse(self,line):
+        fields=line.decode('ascii',errors='replace').strip().lstrip('[').rstrip(']').split(',')
+        if fields[0].strip()!=RSP_SUCCESS:
+            raise ValueError('Color sensor error response: ' + line.decode('ascii',errors='replace').strip())
+        return [float(field) for field in fields[1:]]
+
+    def measureBatched(self):
+        self.sensorPort.reset_input_buffer()
+        self.sendCommand(CMD_GET_MEASUREMENT)
+        values=self.parseResponse(self.readResponseLine())
+        #Frequencies, transmissions and absorbances each for red, green, blue and white
+        return values[8],values[9],values[10]
+
+    def measureLegacy(self):
+        self.sensorPort.write(str.encode("[9]" + '\n')) #Measure Red
+        time.sleep(0.1)
+        Rarduinovalue=self.sensorPort.readline()
+        time.sleep(0.2)
+        self.sensorPort.write(str.encode("[10]" + '\n')) #Measure Green
+        time.sleep(0.1)
+        Garduinovalue=self.sensorPort.readline()
+        time.sleep(0.2)
+        self.sensorPort.write(str.encode("[11]" + '\n')) #Measure Blue
+        time.sleep(0.1)
+        Barduinovalue=self.sensorPort.readline()
+        return float(Rarduinovalue[-16:-3]),float(Garduinovalue[-16:-3]),float(Barduinovalue[-16:-3])
+
+    def measureRGB(self):
+        #Returns the red, green and blue absorbance
+        if self.batchedMeasurement:
+            try:
+                return self.measureBatched()
+            except (serial.SerialException,ValueError,IndexError):
+                if not self.debugLog is None:
+                    self.debugLog.exception('Batched color measurement failed, falling back to single channel commands')
+                self.batchedMeasurement=False
+                self.retries+=1
+        return self.measureLegacy()
+
+class fakeColorSensor:
+    #Answers the colorimeter protocol on a pty, for tests and for running without the Arduino.  absorbance can be a function called for each measurement.
+    def __init__(self,absorbance=(.25,.5,.75),measurementSecs=.01,supportsBatched=True):
+        self.absorbance=absorbance
+        self.measurementSecs=measurementSecs
+        self.supportsBatched=supportsBatched
+        self.commandsReceived=[]
+        self.masterFD,self.slaveFD=os.openpty()
+        self.portName=os.ttyname(self.slaveFD)
+        self.running=True
+        self.responder=threading.Thread(target=self.respond,name='Fake Color Sensor',daemon=True)
+        self.responder.start()
+
+    def formatValue(self,value):
+        #Same width as the tester firmware so the legacy [-16:-3] slice reads it
+        return '%.11f' % value
+
+    def reply(self,command):
+        time.sleep(self.measurementSecs)
+        absorbance=self.absorbance() if callable(self.absorbance) else self.absorbance
+        if command==CMD_GET_MEASUREMENT and self.supportsBatched:
+            fields=['1']+['1000']*4+[self.formatValue(1-value) for value in absorbance]+[self.formatValue(1)]
+            fields+=[self.formatValue(value) for value in absorbance]+[self.formatValue(0)]
+        elif command in (CMD_GET_MEASUREMENT_RED,CMD_GET_MEASUREMENT_GREEN,CMD_GET_MEASUREMENT_BLUE):
+            value=absorbance[command-CMD_GET_MEASUREMENT_RED]
+            fields=['1','1000',self.formatValue(1-value),self.formatValue(value)]
+        elif command==CMD_GET_MEASUREMENT:
+            fields=['0','unknown command']
+        else:
+            fields=['1']
+        return '[' + ','.join(fields) + ']\r\n'
+
+    def respond(self):
+        pending=b''
+        while self.running:
+            try:
+                pending+=os.read(self.masterFD,100)
+            except OSError:
+                return
+            while b'\n' in pending:
+                line,pending=pending.split(b'\n',1)
+                command=int(line.decode().strip().lstrip('[').rstrip(']').split(',')[0])
+                self.commandsReceived.append(command)
+                try:
+                    os.write(self.masterFD,self.reply(command).encode())
+                except OSError:
+                    return
+
+    def close(self):
+        self.running=False
+        os.close(self.slaveFD)
+        os.close(self.masterFD)
+
+def benchmarkColorSensor(iterations=5):
+    fake=fakeColorSensor()
+    sensorPort=serial.Serial(fake.portName,9600,timeout=.1)
+    for batched in (False,True):
+        sensor=ColorSensor(sensorPort,batchedMeasurement=batched)
+        startTime=time.perf_counter()
+        for i in range(iterations):
+            values=sensor.measureRGB()
+        elapsedSecs=time.perf_counter()-startTime
+        print(('Batched' if batched else 'Legacy') + ' measurement: %.0f ms, values %s' % (elapsedSecs/iterations*1000,str(values)))
+    sensorPort.close()
+    fake.close()
+
+if __name__ == '__main__':
+    benchmarkColorSensor()
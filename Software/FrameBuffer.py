@@ -0,0 +1,293 @@
+'''
+AutoTester is the controlling software to automatically run water tests
+Further info can be found at: https://robogardens.com/?p=928
+This software is free for DIY, Nonprofit, and educational uses.
+Copyright (C) 2017 - RoboGardens.com
+
+Created on Oct 18, 2026
+
+This module holds the ring buffer that passes camera frames from the video grabber to the
+streaming viewers and the image processing code.  Frames are copied once into preallocated
+slots by the grabber and readers get read only views of the slots.  A slot being read is never
+overwritten, and if every free slot is in use the grabber drops the frame instead of waiting.
+It also holds the fan-out of the encoded stream, which is composited and encoded once per frame
+and shared by all of the stream viewers.
+'''
+
+import threading
+import time
+import numpy as np
+
+class FrameRingBuffer:
+    def __init__(self,numSlots=4):
+        self.numSlots=numSlots
+        self.frameLock=threading.Condition()
+        self.slotFrames=[None]*numSlots
+        self.slotSequence=[0]*numSlots
+        self.slotReaders=[0]*numSlots
+        self.latestSlot=None
+        self.latestSequence=0
+        self.resetStatistics()
+
+    def resetStatistics(self):
+        self.statisticsStart=time.time()
+        self.framesPublished=0
+        self.framesDropped=0
+        self.frameAllocations=0
+        self.frameCopies=0
+        self.lockAcquisitions=0
+        self.lockContentions=0
+        self.lockWaitSecs=0
+
+    def lockBuffer(self):
+        if self.frameLock.acquire(blocking=False):
+            self.lockAcquisitions+=1
+            return
+        startWait=time.perf_counter()
+        self.frameLock.acquire()
+        self.lockAcquisitions+=1
+        self.lockContentions+=1
+        self.lockWaitSecs+=time.perf_counter()-startWait
+
+    def findFreeSlot(self):
+        #Oldest slot that is neither the latest frame nor held by a reader
+        freeSlot=None
+        for slot in range(self.numSlots):
+            if slot==self.latestSlot or self.slotReaders[slot]>0:
+                continue
+            if freeSlot is None or self.slotSequence[slot]<self.slotSequence[freeSlot]:
+                freeSlot=slot
+        return freeSlot
+
+    def publishFrame(self,image):
+        #Only the video grabber publishes, so the slot can be filled outside the lock once it is reserved
+        self.lockBuffer()
+        try:
+            slot=self.findFreeSlot()
+            if slot is None:
+                self.framesDropped+=1
+                return False
+            self.slotSequence[slot]=-1
+        finally:
+            self.frameLock.release()
+        slotFrame=self.slotFrames[slot]
+        if slotFrame is None or slotFrame.shape!=image.shape or slotFrame.dtype!=image.dtype:
+            slotFrame=np.empty(image.shape,dtype=image.dtype)
+            self.slotFrames[slot]=slotFrame
+            self.frameAllocations+=1
+        np.copyto(slotFrame,image)
+        self.lockBuffer()
+        try:
+            self.latestSequence+=1
+            self.slotSequence[slot]=self.latestSequence
+            self.latestSlot=slot
+            self.framesPublished+=1
+            self.frameLock.notify_all()
+        finally:
+            self.frameLock.release()
+        return True
+
+    def acquireFrame(self,afterSequence=None,timeout=None):
+        #Waits for a frame newer than afterSequence (default: the next frame) and returns a read only view of it.
+        #The slot stays reserved until releaseFrame is called with the returned slot.
+        self.lockBuffer()
+        try:
+            if afterSequence is None:
+                afterSequence=self.latestSequence
+            if not self.frameLock.wait_for(lambda: self.latestSequence>afterSequence,timeout):
+                return None,None,None
+            slot=self.latestSlot
+            self.slotReaders[slot]+=1
+            sequence=self.latestSequence
+        finally:
+            self.frameLock.release()
+        frameView=self.slotFrames[slot].view()
+        frameView.flags.writeable=False
+        return sequence,frameView,slot
+
+    def releaseFrame(self,slot):
+        if slot is None:
+            return
+        self.lockBuffer()
+        try:
+            self.slotReaders[slot]-=1
+        finally:
+            self.frameLock.release()
+
+    def copyLatestFrame(self,afterSequence=None,timeout=None):
+        #For callers that draw on the frame and so need their own writable copy
+        sequence,frameView,slot=self.acquireFrame(afterSequence,timeout)
+        if frameView is None:
+            return None
+        try:
+            self.frameCopies+=1
+            return frameView.copy()
+        finally:
+            self.releaseFrame(slot)
+
+    def getStatistics(self):
+        elapsedSecs=max(time.time()-self.statisticsStart,.001)
+        return {'framesPerSec':self.framesPublished/elapsedSecs,
+                'droppedPerSec':self.framesDropped/elapsedSecs,
+                'allocationsPerSec':(self.frameAllocations+self.frameCopies)/elapsedSecs,
+                'lockAcquisitions':self.lockAcquisitions,
+                'lockContentions':self.lockContentions,
+                'lockWaitMs':self.lockWaitSecs*1000,
+                'readersHoldingFrames':sum(self.slotReaders)}
+
+    def statisticsText(self):
+        stats=self.getStatistics()
+        return 'Frames/s: %.1f, Dropped/s: %.1f, Allocations/s: %.1f, Lock contentions: %d of %d, Lock wait: %.1f ms' % \
+            (stats['framesPerSec'],stats['droppedPerSec'],stats['allocationsPerSec'],stats['lockContentions'],stats['lockAcquisitions'],stats['lockWaitMs'])
+
+class EncodedFrameFanout:
+    #Holds the latest composited and encoded stream part so every viewer writes the same bytes.
+    #Viewers always take the newest part, so a slow viewer skips parts instead of holding up the compositor.
+    def __init__(self,maxViewers=4):
+        self.maxViewers=maxViewers
+        self.partLock=threading.Condition()
+        self.latestPart=None
+        self.latestSequence=0
+        self.activeViewers=0
+        self.resetStatistics()
+
+    def resetStatistics(self):
+        self.statisticsStart=time.time()
+        self.partsEncoded=0
+        self.encodeSecs=0
+        self.partsSkipped=0
+        self.viewersRejected=0
+
+    def addViewer(self):
+        with self.partLock:
+            if self.activeViewers>=self.maxViewers:
+                self.viewersRejected+=1
+                return False
+            self.activeViewers+=1
+            self.partLock.notify_all()
+            return True
+
+    def removeViewer(self):
+        with self.partLock:
+            self.activeViewers-=1
+
+    def waitForViewers(self,timeout=None):
+        with self.partLock:
+            return self.partLock.wait_for(lambda: self.activeViewers>0,timeout)
+
+    def publishPart(self,jpg,encodeSecs=0):
+        #The multipart headers are built once here rather than by each viewer
+        jpgBytes=bytes(jpg)
+        part=b'--jpgboundary\r\nContent-type: image/jpeg\r\nContent-length: ' + str(len(jpgBytes)).encode() + b'\r\n\r\n' + jpgBytes + b'\r\n'
+        with self.partLock:
+            self.latestPart=part
+            self.latestSequence+=1
+            self.partsEncoded+=1
+            self.encodeSecs+=encodeSecs
+            self.partLock.notify_all()
+
+    def waitForPart(self,afterSequence=None,timeout=None):
+        with self.partLock:
+            if afterSequence is None:
+                afterSequence=self.latestSequence
+            if not self.partLock.wait_for(lambda: self.latestSequence>afterSequence,timeout):
+                return afterSequence,None
+            if afterSequence>0:
+                self.partsSkipped+=self.latestSequence-afterSequence-1
+            return self.latestSequence,self.latestPart
+
+    def getStatistics(self):
+        elapsedSecs=max(time.time()-self.statisticsStart,.001)
+        if self.partsEncoded>0:
+            avgEncodeMs=self.encodeSecs/self.partsEncoded*1000
+        else:
+            avgEncodeMs=0
+        return {'encodesPerSec':self.partsEncoded/elapsedSecs,
+                'avgEncodeMs':avgEncodeMs,
+                'activeViewers':self.activeViewers,
+                'skippedPerSec':self.partsSkipped/elapsedSecs,
+                'viewersRejected':self.viewersRejected}
+
+    def statisticsText(self):
+        stats=self.getStatistics()
+        return 'Viewers: %d, Encodes/s: %.1f, Avg encode: %.1f ms, Skipped by slow viewers/s: %.1f, Viewers rejected: %d' % \
+            (stats['activeViewers'],stats['encodesPerSec'],stats['avgEncodeMs'],stats['skippedPerSec'],stats['viewersRejected'])
+
+class legacyFrameExchange:
+    #The previous single frame exchange (Condition plus a copy per reader), instrumented the same way for comparison
+    def __init__(self):
+        self.frameLock=threading.Condition()
+        self.latestImage=None
+        self.resetStatistics()
+
+    def resetStatistics(self):
+        self.statisticsStart=time.time()
+        self.framesPublished=0
+        self.frameAllocations=0
+        self.lockAcquisitions=0
+        self.lockContentions=0
+        self.lockWaitSecs=0
+
+    def lockBuffer(self):
+        if self.frameLock.acquire(blocking=False):
+            self.lockAcquisitions+=1
+            return
+        startWait=time.perf_counter()
+        self.frameLock.acquire()
+        self.lockAcquisitions+=1
+        self.lockContentions+=1
+        self.lockWaitSecs+=time.perf_counter()-startWait
+
+    def publishFrame(self,image):
+        self.lockBuffer()
+        self.latestImage=image
+        self.framesPublished+=1
+        self.frameLock.notify_all()
+        self.frameLock.release()
+
+    def copyLatestFrame(self,timeout=None):
+        self.lockBuffer()
+        self.frameLock.wait(timeout)
+        imageCopy=self.latestImage.copy()
+        self.frameAllocations+=1
+        self.frameLock.release()
+        return imageCopy
+
+    def statisticsText(self):
+        elapsedSecs=max(time.time()-self.statisticsStart,.001)
+        return 'Frames/s: %.1f, Allocations/s: %.1f, Lock contentions: %d of %d, Lock wait: %.1f ms' % \
+            (self.framesPublished/elapsedSecs,self.frameAllocations/elapsedSecs,self.lockContentions,self.lockAcquisitions,self.lockWaitSecs*1000)
+
+def benchmarkFrameExchange(numReaders=4,framesPerSecond=30,runSecs=5,readerWorkSecs=.02):
+    #Simulated grabber plus readers doing encode sized work, run once with each exchange
+    image=np.random.randint(0,255,(640,480,3),dtype=np.uint8)
+    for exchangeName in ('Legacy','Ring buffer'):
+        if exchangeName=='Legacy':
+            exchange=legacyFrameExchange()
+        else:
+            exchange=FrameRingBuffer()
+        running=[True]
+        def reader():
+            while running[0]:
+                if exchangeName=='Legacy':
+                    frame=exchange.copyLatestFrame(timeout=1)
+                    time.sleep(readerWorkSecs)
+                else:
+                    sequence,frame,slot=exchange.acquireFrame(timeout=1)
+                    time.sleep(readerWorkSecs)
+                    exchange.releaseFrame(slot)
+        readers=[threading.Thread(target=reader) for i in range(numReaders)]
+        for readerThread in readers:
+            readerThread.start()
+        exchange.resetStatistics()
+        endTime=time.time()+runSecs
+        while time.time()<endTime:
+            exchange.publishFrame(image)
+            time.sleep(1/framesPerSecond)
+        running[0]=False
+        for readerThread in readers:
+            readerThread.join()
+        print(exchangeName + ': ' + exchange.statisticsText())
+
+if __name__ == '__main__':
+    benchmarkFrameExchange()
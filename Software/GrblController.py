@@ -0,0 +1,460 @@
+'''
+AutoTester is the controlling software to automatically run water tests
+Further info can be found at: https://robogardens.com/?p=928
+This software is free for DIY, Nonprofit, and educational uses.
+Copyright (C) 2017 - RoboGardens.com
+
+Created on Oct 18, 2026
+
+This module drives the GRBL board that moves the syringe carriage.  One thread owns the serial
+port.  It streams queued G-code lines into GRBL's receive buffer (character counting, so moves can
+be chained without waiting for each other) and polls the status report while moves are pending.
+Callers get a future for each command.  A move's future resolves once GRBL reports Idle with the
+axis at its last queued target.  X moves are refused while the last Z move queued leaves the
+syringe lowered, whichever thread queues them.  The driver also keeps track of whether the
+position from the last homing can still be trusted, so homing is only repeated after an alarm, a
+reset of the board or a set number of moves.  The fake GRBL answers the same protocol over a pty
+so this can run without the board.
+'''
+
+import collections
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+import serial   # @UnresolvedImport
+
+GRBL_RX_BUFFER_SIZE=128
+AXES='XYZ'
+#The tester's stepper firmware answers $H with this error once homing is done
+HOMING_DONE_REPLY='error: Expected command letter'
+
+class GrblError(Exception):
+    pass
+
+def parseStatusReport(line):
+    #Handles both the 0.9 report <Idle,MPos:0.000,0.000,0.000,WPos:...> and the 1.1 report <Idle|MPos:0.000,0.000,0.000|FS:0,0>
+    if isinstance(line,bytes):
+        line=line.decode('ascii',errors='replace')
+    line=line.strip()
+    if not line.startswith('<') or not line.endswith('>'):
+        return None
+    body=line[1:-1]
+    if '|' in body:
+        fields=body.split('|')
+        state=fields[0]
+        positionFields=dict(field.split(':',1) for field in fields[1:] if ':' in field)
+    else:
+        state,sep,rest=body.partition(',')
+        positionFields={}
+        key=None
+        for field in rest.split(','):
+            if ':' in field:
+                key,field=field.split(':',1)
+                positionFields[key]=field
+            elif not key is None:
+                positionFields[key]+=','+field
+    position=positionFields.get('MPos',positionFields.get('WPos'))
+    if position is None:
+        return {'state':state.split(':')[0],'position':None}
+    return {'state':state.split(':')[0],'position':tuple(float(value) for value in position.split(',')[:3])}
+
+class GrblController:
+    def __init__(self,port,statusPollSecs=.05,positionTolerance=.01,moveTimeoutSecs=120,safeZ=0,debugLog=None):
+        self.port=port
+        self.safeZ=safeZ
+        self.statusPollSecs=statusPollSecs
+        self.positionTolerance=positionTolerance
+        self.moveTimeoutSecs=moveTimeoutSecs
+        self.debugLog=debugLog
+        self.commandQueue=queue.Queue()
+        self.sentCommands=collections.deque()
+        self.bufferedChars=0
+        self.pendingMoves=[]
+        #Where the queued moves leave each axis, None until homed or first moved
+        self.commandedPosition=[None,None,None]
+        self.queueLock=threading.Lock()
+        #Cleared by an alarm, a reset of the board or a lost serial port
+        self.homed=False
+        self.movesSinceHoming=0
+        self.statusRequests=[]
+        #The status requests waiting on each ? sent, so a report already on its way does not answer a later request
+        self.statusPolls=collections.deque()
+        self.resetRequested=False
+        self.resets=0
+        self.lastStatus=None
+        self.nextStatusPoll=0
+        self.running=False
+        self.driverThread=None
+
+    def start(self):
+        #readline only waits one poll period so the thread gets back to sending queued lines promptly
+        self.port.timeout=self.statusPollSecs
+        self.running=True
+        self.driverThread=threading.Thread(target=self.run,name='GRBL Driver',daemon=True)
+        self.driverThread.start()
+
+    def stop(self):
+        self.running=False
+        if not self.driverThread is None:
+            self.driverThread.join()
+            self.driverThread=None
+        self.failPending(GrblError('GRBL driver stopped'))
+
+    def sendLine(self,line,acceptReplies=()):
+        #Resolves with GRBL's reply once the line has been accepted.  acceptReplies are error replies that also count as accepted.
+        future=concurrent.futures.Future()
+        with self.queueLock:
+            if line=='$H':
+                self.commandedPosition=[0.0,0.0,0.0]
+            self.commandQueue.put({'line':line,'future':future,'axis':None,'target':None,'acceptReplies':acceptReplies})
+        return future
+
+    def requestStatus(self):
+        #Resolves with a status report asked for after this call
+        future=concurrent.futures.Future()
+        with self.queueLock:
+            self.statusRequests.append(future)
+            self.nextStatusPoll=0
+        return future
+
+    def home(self,timeoutSecs):
+        #Raises GrblError if GRBL refuses to home, or TimeoutError if it has not answered in time, and then resets it so it stops seeking
+        future=self.sendLine('$H',acceptReplies=(HOMING_DONE_REPLY,))
+        try:
+            return future.result(timeout=timeoutSecs)
+        except concurrent.futures.TimeoutError:
+            self.resetRequested=True
+            raise
+
+    def homingNeeded(self,maxMovesBetweenHoming,statusTimeoutSecs=2):
+        #Returns why the machine has to be homed, or None when the position from the last homing still holds
+        if not self.homed:
+            return 'not homed since the last alarm or reset'
+        if self.movesSinceHoming>=maxMovesBetweenHoming:
+            return str(self.movesSinceHoming) + ' moves since homing'
+        try:
+            status=self.requestStatus().result(timeout=statusTimeoutSecs)
+        except Exception:
+            return 'no status report from GRBL'
+        if status['state']!='Idle':
+            return 'GRBL is ' + status['state']
+        return None
+
+    def syringeLowered(self):
+        z=self.commandedPosition[AXES.index('Z')]
+        return not z is None and z>self.safeZ+self.positionTolerance
+
+    def queueMove(self,axis,target):
+        #Resolves with True once GRBL is Idle with the axis at target
+        future=concurrent.futures.Future()
+        with self.queueLock:
+            if axis=='X' and self.syringeLowered():
+                future.set_exception(GrblError(axis + str(target) + ' refused, the syringe is lowered'))
+                return future
+            self.commandedPosition[AXES.index(axis)]=float(target)
+            self.movesSinceHoming+=1
+            self.commandQueue.put({'line':axis+str(target),'future':future,'axis':AXES.index(axis),'target':float(target),'acceptReplies':()})
+        return future
+
+    def move(self,axis,target):
+        return self.queueMove(axis,target).result(timeout=self.moveTimeoutSecs)
+
+    def run(self):
+        pendingLine=b''
+        while self.running:
+            try:
+                if self.resetRequested:
+                    self.resetGrbl()
+                self.sendQueuedLines()
+                if (self.pendingMoves or self.sentCommands or self.statusRequests) and time.time()>=self.nextStatusPoll:
+                    with self.queueLock:
+                        self.statusPolls.append(self.statusRequests)
+                        self.statusRequests=[]
+                    self.port.write(b'?')
+                    self.nextStatusPoll=time.time()+self.statusPollSecs
+                pendingLine+=self.port.readline()
+            except (serial.SerialException,OSError) as e:
+                if not self.debugLog is None:
+                    self.debugLog.exception('GRBL driver lost the serial port')
+                self.running=False
+                self.homed=False
+                self.failPending(GrblError('GRBL serial port failed: ' + str(e)))
+                return
+            if pendingLine.endswith(b'\n'):
+                self.handleLine(pendingLine.decode('ascii',errors='replace').strip())
+                pendingLine=b''
+
+    def resetGrbl(self):
+        #Ctrl-X is a real time soft reset.  GRBL drops everything it was doing and answers with its welcome banner.
+        self.resetRequested=False
+        self.resets+=1
+        self.port.write(b'\x18')
+        self.homed=False
+        self.failPending(GrblError('GRBL was reset'))
+
+    def sendQueuedLines(self):
+        #GRBL acknowledges each line as it leaves the receive buffer, so keep it full but never overflow it
+        while True:
+            try:
+                command=self.commandQueue.queue[0]
+            except IndexError:
+                return
+            lineBytes=(command['line']+'\n').encode()
+            if self.sentCommands and self.bufferedChars+len(lineBytes)>=GRBL_RX_BUFFER_SIZE:
+                return
+            self.commandQueue.get_nowait()
+            if not command['future'].set_running_or_notify_cancel():
+                continue
+            self.port.write(lineBytes)
+            self.bufferedChars+=len(lineBytes)
+            self.sentCommands.append((command,len(lineBytes)))
+
+    def handleLine(self,line):
+        if line=='':
+            return
+        status=parseStatusReport(line)
+        if not status is None:
+            self.handleStatus(status)
+        elif line=='ok' or line.startswith('error'):
+            if not self.sentCommands:
+                return
+            command,lineLength=self.sentCommands.popleft()
+            self.bufferedChars-=lineLength
+            if line=='ok' or line in command['acceptReplies']:
+                if command['line']=='$H':
+                    self.homed=True
+                    self.movesSinceHoming=0
+                if command['axis'] is None:
+                    command['future'].set_result(line)
+                else:
+                    self.pendingMoves.append(command)
+                    self.nextStatusPoll=0
+            else:
+                if command['line']=='$H':
+                    #Homing disabled or the machine locked, so the position sendLine assumed was never reached
+                    self.homed=False
+                    with self.queueLock:
+                        self.commandedPosition=[None,None,None]
+                command['future'].set_exception(GrblError(command['line'] + ': ' + line))
+        elif line.startswith('ALARM'):
+            self.homed=False
+            self.failPending(GrblError(line))
+        elif line.startswith('Grbl '):
+            #The welcome banner, so the board was reset or power cycled and the position is lost
+            if not self.debugLog is None:
+                self.debugLog.info('GRBL restarted: ' + line)
+            self.homed=False
+            with self.queueLock:
+                self.commandedPosition=[None,None,None]
+            self.failPending(GrblError('GRBL restarted'))
+        elif not self.debugLog is None:
+            self.debugLog.info('GRBL: ' + line)
+
+    def handleStatus(self,status):
+        self.lastStatus=status
+        with self.queueLock:
+            statusRequests=self.statusPolls.popleft() if self.statusPolls else []
+        for future in statusRequests:
+            future.set_result(status)
+        if status['state'].startswith('Alarm'):
+            self.homed=False
+            self.failMoves(GrblError('GRBL is in alarm state'))
+            return
+        if status['state']!='Idle' or status['position'] is None:
+            return
+        #Idle means every acknowledged move has run, but only the last move on each axis can be checked against the position
+        lastMoves={}
+        for command in self.pendingMoves:
+            lastMoves[command['axis']]=command
+        arrivedAxes=[axis for axis,command in lastMoves.items() if abs(status['position'][axis]-command['target'])<=self.positionTolerance]
+        stillMoving=[]
+        for command in self.pendingMoves:
+            if command['axis'] in arrivedAxes:
+                command['future'].set_result(True)
+            else:
+                stillMoving.append(command)
+        self.pendingMoves=stillMoving
+
+    def failMoves(self,exception):
+        for command in self.pendingMoves:
+            command['future'].set_exception(exception)
+        self.pendingMoves=[]
+
+    def failPending(self,exception):
+        self.failMoves(exception)
+        with self.queueLock:
+            statusRequests=[future for poll in self.statusPolls for future in poll]+self.statusRequests
+            self.statusPolls.clear()
+            self.statusRequests=[]
+        for future in statusRequests:
+            future.set_exception(exception)
+        while self.sentCommands:
+            command,lineLength=self.sentCommands.popleft()
+            command['future'].set_exception(exception)
+        self.bufferedChars=0
+        while True:
+            try:
+                command=self.commandQueue.get_nowait()
+            except queue.Empty:
+                return
+            if command['future'].set_running_or_notify_cancel():
+                command['future'].set_exception(exception)
+
+class fakeGrbl:
+    #Answers the GRBL 0.9 protocol on a pty.  Moves run one after the other at unitsPerSec, or taking moveSecs(axis,distance) when given.
+    #moveListener(axis,startPosition,target,position) is called as each move finishes.
+    def __init__(self,unitsPerSec=100,homingSecs=.1,rejectLines=(),moveSecs=None,moveListener=None,homingReply='ok',rejectReply='error: Bad number format'):
+        self.unitsPerSec=unitsPerSec
+        self.homingSecs=homingSecs
+        self.homingReply=homingReply
+        self.rejectLines=rejectLines
+        self.rejectReply=rejectReply
+        self.moveSecs=moveSecs
+        self.moveListener=moveListener
+        self.linesReceived=[]
+        self.statusRequests=0
+        self.position=[0.0,0.0,0.0]
+        self.motionQueue=collections.deque()
+        self.moveStart=None
+        self.alarm=False
+        self.stateLock=threading.Lock()
+        self.masterFD,self.slaveFD=os.openpty()
+        self.portName=os.ttyname(self.slaveFD)
+        self.running=True
+        self.responder=threading.Thread(target=self.respond,name='Fake GRBL',daemon=True)
+        self.responder.start()
+
+    def updateMotion(self):
+        #Advances the current move to now and starts the next one when it finishes
+        now=time.time()
+        while self.motionQueue:
+            axis,target=self.motionQueue[0]
+            if self.moveStart is None:
+                self.moveStart=(now,self.position[axis])
+            startTime,startPosition=self.moveStart
+            if self.moveSecs is None:
+                travelSecs=abs(target-startPosition)/self.unitsPerSec
+            else:
+                travelSecs=self.moveSecs(AXES[axis],abs(target-startPosition))
+            if now-startTime<travelSecs:
+                self.position[axis]=startPosition+(target-startPosition)*(now-startTime)/travelSecs
+                return
+            self.position[axis]=target
+            self.motionQueue.popleft()
+            self.moveStart=None
+            if not self.moveListener is None:
+                self.moveListener(AXES[axis],startPosition,target,list(self.position))
+            now=startTime+travelSecs
+
+    def statusReport(self):
+        with self.stateLock:
+            self.updateMotion()
+            if self.alarm:
+                state='Alarm'
+            elif self.motionQueue:
+                state='Run'
+            else:
+                state='Idle'
+            position=','.join('%.3f' % value for value in self.position)
+        return '<' + state + ',MPos:' + position + ',WPos:' + position + '>\r\n'
+
+    def reply(self,line):
+        self.linesReceived.append(line)
+        if line in self.rejectLines:
+            return self.rejectReply + '\r\n'
+        if line=='$H':
+            time.sleep(self.homingSecs)
+            with self.stateLock:
+                self.motionQueue.clear()
+                self.moveStart=None
+                self.position=[0.0,0.0,0.0]
+                self.alarm=False
+            return self.homingReply + '\r\n'
+        if line=='$X':
+            self.alarm=False
+            return 'ok\r\n'
+        with self.stateLock:
+            self.updateMotion()
+            axis=AXES.index(line[0])
+            self.motionQueue.append((axis,float(line[1:])))
+        return 'ok\r\n'
+
+    def write(self,text):
+        try:
+            os.write(self.masterFD,text.encode())
+        except OSError:
+            self.running=False
+
+    def respond(self):
+        pending=b''
+        while self.running:
+            try:
+                pending+=os.read(self.masterFD,100)
+            except OSError:
+                return
+            #? and Ctrl-X are real time commands and are acted on without waiting for a newline
+            if b'\x18' in pending:
+                pending=pending.split(b'\x18')[-1]
+                with self.stateLock:
+                    self.motionQueue.clear()
+                    self.moveStart=None
+                self.write('\r\nGrbl 0.9j [\'$\' for help]\r\n')
+            while b'?' in pending:
+                pending=pending.replace(b'?',b'',1)
+                self.statusRequests+=1
+                self.write(self.statusReport())
+            while b'\n' in pending:
+                line,pending=pending.split(b'\n',1)
+                line=line.decode().strip()
+                if line!='':
+                    self.write(self.reply(line))
+
+    def close(self):
+        self.running=False
+        os.close(self.slaveFD)
+        os.close(self.masterFD)
+
+def legacyMove(port,axis,target):
+    #The per move loop the tester used before the driver thread
+    port.write(str.encode(axis + str(target) + '\n'))
+    time.sleep(2)
+    while True:
+        port.write(str.encode("?" + '\n'))
+        port.flushInput()
+        time.sleep(0.2)
+        grbl_out = str(port.readline())
+        status=parseStatusReport(grbl_out[2:-1].replace('\\r\\n',''))
+        if not status is None and not status['position'] is None and round(status['position'][AXES.index(axis)],2)==float(target):
+            return True
+
+def benchmarkGrblController():
+    #The eight moves of a reagent dose: mixer, reagent, lower, fill, raise, mixer, lower, dose
+    moves=[('X',10),('X',30),('Z',55),('Y',50),('Z',0),('X',10),('Z',40),('Y',0)]
+    fake=fakeGrbl(unitsPerSec=200)
+    port=serial.Serial(fake.portName,115200,timeout=.1)
+    startTime=time.time()
+    for axis,target in moves:
+        legacyMove(port,axis,target)
+    print('Legacy: %.1f secs for %d moves' % (time.time()-startTime,len(moves)))
+    port.write(b'$H\n')
+    time.sleep(.5)
+    port.reset_input_buffer()
+    controller=GrblController(port)
+    controller.start()
+    startTime=time.time()
+    for axis,target in moves:
+        controller.move(axis,target)
+    print('Driver, one move at a time: %.1f secs for %d moves' % (time.time()-startTime,len(moves)))
+    controller.sendLine('$H').result()
+    startTime=time.time()
+    futures=[controller.queueMove(axis,target) for axis,target in moves]
+    concurrent.futures.wait(futures)
+    print('Driver, chained moves: %.1f secs for %d moves' % (time.time()-startTime,len(moves)))
+    controller.stop()
+    port.close()
+    fake.close()
+
+if __name__ == '__main__':
+    benchmarkGrblController()
@@ -0,0 +1,485 @@
+'''
+AutoTester is the controlling software to automatically run water tests
+Further info can be found at: https://robogardens.com/?p=928
+This software is free for DIY, Nonprofit, and educational uses.
+Copyright (C) 2017 - RoboGardens.com
+
+Created on Oct 18, 2026
+
+This module is the hardware layer of the tester.  The tester gets the GPIO pins, the motor HATs,
+the serial ports of the GRBL board and the color sensor, the pH probe, the pump step pulses and
+its waits from one hardware object.  piHardware is the Raspberry Pi with the boards attached.
+simulatedHardware stands in for all of it on any Linux box: the GRBL board and the color sensor
+are fakes answering their protocols on a pty, and the motors, valves and pumps act on a simulated
+world holding the mixer, the syringe and the KH jar.  What reaches the mixer drives the color the
+sensor reads, and what reaches the KH jar drives the pH the probe reads, so a whole test runs and
+gives a result.  The simulation runs at timeScale real secs per sec, so hours of tests take minutes.
+'''
+
+import math
+import threading
+import time
+import serial   # @UnresolvedImport
+from GrblController import fakeGrbl
+from ColorSensor import fakeColorSensor
+from StepPulses import createPulseBackend,simulatedPulseBackend
+from Titration import simulatedKHChemistry
+from MotionPlanner import CentimeterToMove,Mixerreactor,Cleanreactor,ZInReagent,ZInMixerreactor,estimateMoveSecs,AXIS_MAX_RATE,AXIS_ACCELERATION
+
+#Motor HAT addresses and motor numbers, as TesterCore drives them
+AGITATOR=(0x61,1)
+MAIN_DRAIN=(0x61,2)
+TANK_VALVE=(0x62,3)
+OSMOSE_VALVE=(0x62,4)
+KH_DRAIN=(0x60,1)
+CLEAR_ABSORBANCE=(.02,.02,.02)
+
+class piPHProbe:
+    #The DFRobot pH board read through the ADS1115
+    def __init__(self):
+        from DFRobot_ADS1115 import ADS1115
+        from DFRobot_PH import DFRobot_PH
+        self.ads1115=ADS1115()
+        self.ph=DFRobot_PH()
+
+    def begin(self):
+        self.ads1115.setAddr_ADS1115(0x4A)
+        self.ads1115.setGain(0x00)
+        self.ph.begin()
+
+    def readPH(self,temperature):
+        return self.ph.readPH(self.ads1115.readVoltage(0)['r'],temperature)
+
+    def calibrate(self):
+        self.begin()
+        voltage=self.ads1115.readVoltage(0)['r']
+        print ("A0:%dmV "%(voltage))
+        self.ph.calibration(voltage)
+
+class piHardware:
+    name='pi'
+    simulated=False
+
+    def __init__(self):
+        import RPi.GPIO as GPIO   # @UnresolvedImport
+        from adafruit_motorkit import MotorKit
+        self.gpio=GPIO
+        self.motorKitClass=MotorKit
+        self.phProbe=piPHProbe()
+
+    def motorKit(self,address):
+        return self.motorKitClass(address=address)
+
+    def openStepperPort(self):
+        return serial.Serial('/dev/ttyUSB0', 9600, timeout=.1)
+
+    def openSensorPort(self,baudRate):
+        return serial.Serial('/dev/ttyACM0', baudRate, timeout=.1)
+
+    def createPulseBackend(self,preference,debugLog=None):
+        return createPulseBackend(preference,self.gpio,debugLog)
+
+    def attachPumps(self,mainPump,khSamplePump,khReagentPump):
+        pass
+
+    def sleep(self,secs):
+        time.sleep(secs)
+
+    def sampleForTest(self,tester,ts):
+        pass
+
+    def close(self):
+        self.gpio.cleanup()
+
+class simulatedGPIO:
+    #Stands in for RPi.GPIO and remembers the level of each pin
+    BCM=11
+    OUT=0
+    LOW=0
+    HIGH=1
+
+    def __init__(self):
+        self.levels={}
+
+    def setmode(self,mode):
+        pass
+
+    def setwarnings(self,warnings):
+        pass
+
+    def setup(self,pin,mode):
+        self.levels.setdefault(pin,self.LOW)
+
+    def output(self,pin,level):
+        self.levels[pin]=level
+
+    def cleanup(self):
+        self.levels={}
+
+class simulatedMotor:
+    def __init__(self,world,address,number):
+        self.world=world
+        self.address=address
+        self.number=number
+        self.currentThrottle=None
+
+    @property
+    def throttle(self):
+        return self.currentThrottle
+
+    @throttle.setter
+    def throttle(self,value):
+        self.currentThrottle=value
+        self.world.motorChanged((self.address,self.number),value)
+
+class simulatedMotorKit:
+    def __init__(self,world,address):
+        self.motor1=simulatedMotor(world,address,1)
+        self.motor2=simulatedMotor(world,address,2)
+        self.motor3=simulatedMotor(world,address,3)
+        self.motor4=simulatedMotor(world,address,4)
+
+class simulatedPHProbe:
+    def __init__(self,world):
+        self.world=world
+
+    def begin(self):
+        pass
+
+    def readPH(self,temperature):
+        return self.world.readPH()
+
+    def calibrate(self):
+        print ('Simulated pH probe, nothing to calibrate')
+
+def labToAbsorbance(l,a,b):
+    #The inverse of measureArduinoSensor, which reads 1-absorbance as sRGB
+    from colormath.color_objects import LabColor,sRGBColor
+    from colormath.color_conversions import convert_color
+    rgb=convert_color(LabColor(l,a,b),sRGBColor)
+    return tuple(min(max(1-value,0),1) for value in (rgb.rgb_r,rgb.rgb_g,rgb.rgb_b))
+
+def swatchesByValue(tester,colorSheetName):
+    try:
+        swatchList=tester.colorSheetList[colorSheetName].swatchList
+    except (KeyError,AttributeError):
+        return []
+    return sorted((swatch for swatch in swatchList.values() if swatch.lightingConditions==tester.currentLightingConditions),key=lambda swatch:swatch.valueAtSwatch)
+
+def swatchAbsorbance(swatches,value):
+    #The absorbance of the chart color for value, between the two swatches either side of it
+    values=[swatch.valueAtSwatch for swatch in swatches]
+    if value<=values[0]:
+        lower=upper=swatches[0]
+    elif value>=values[-1]:
+        lower=upper=swatches[-1]
+    else:
+        index=next(index for index,swatchValue in enumerate(values) if swatchValue>=value)
+        lower,upper=swatches[index-1],swatches[index]
+    fraction=0 if upper.valueAtSwatch==lower.valueAtSwatch else (value-lower.valueAtSwatch)/(upper.valueAtSwatch-lower.valueAtSwatch)
+    lab=[getattr(lower,name)+(getattr(upper,name)-getattr(lower,name))*fraction for name in ('channel1','channel2','channel3')]
+    return labToAbsorbance(*lab)
+
+class developingColorModel:
+    #The color develops towards targetAbsorbance after the last reagent reaches the mixer, three times as fast while it is agitated
+    def __init__(self,targetAbsorbance,developSecs=60):
+        self.targetAbsorbance=targetAbsorbance
+        self.developSecs=developSecs
+
+    def absorbance(self,world):
+        if sum(world.mixer['reagents'].values())<=0 or world.mixerVolumeML()<=0:
+            return CLEAR_ABSORBANCE
+        progress=1-math.exp(-world.developedSecs/self.developSecs)
+        return tuple(clear+(target-clear)*progress for clear,target in zip(CLEAR_ABSORBANCE,self.targetAbsorbance))
+
+class titrationColorModel:
+    #The indicator flips from startAbsorbance to endAbsorbance as the titrant dosed into the mixer passes endpointML
+    def __init__(self,titrantSlot,endpointML,startAbsorbance,endAbsorbance,widthML=.02):
+        self.titrantSlot=titrantSlot
+        self.endpointML=endpointML
+        self.startAbsorbance=startAbsorbance
+        self.endAbsorbance=endAbsorbance
+        self.widthML=widthML
+
+    def absorbance(self,world):
+        if world.mixerVolumeML()<=0:
+            return CLEAR_ABSORBANCE
+        titrantML=world.mixer['reagents'].get(self.titrantSlot,0)
+        flipped=1/(1+math.exp(-max(min((titrantML-self.endpointML)/self.widthML,50),-50)))
+        return tuple(start+(end-start)*flipped for start,end in zip(self.startAbsorbance,self.endAbsorbance))
+
+def reactionModelFor(tester,ts,value):
+    #What the sensor will read for a tank water value of the test.  KH tests are read with the pH probe instead.
+    if ts.KHtestwithPHProbe:
+        return None
+    if not ts.titrationSlot is None:
+        swatches=swatchesByValue(tester,ts.colorChartToUse)
+        if len(swatches)>=2:
+            startAbsorbance=labToAbsorbance(swatches[0].channel1,swatches[0].channel2,swatches[0].channel3)
+            endAbsorbance=labToAbsorbance(swatches[1].channel1,swatches[1].channel2,swatches[1].channel3)
+        else:
+            startAbsorbance,endAbsorbance=(.1,.6,.3),(.5,.2,.1)
+        return titrationColorModel(ts.titrationSlot,value/(ts.calctovalue or 1),startAbsorbance,endAbsorbance)
+    if not ts.lightAbsorptionTest is None:
+        #The calibration of the test turned around, from result to absorbance
+        absorbances=[float(field) for field in ts.lightAbsorptionValue.split(',')]
+        results=[float(field) for field in ts.lightAbsorptionResult.split(',')]
+        pairs=sorted(zip(results,absorbances))
+        absorbance=pairs[0][1]
+        for (lowResult,lowAbsorbance),(highResult,highAbsorbance) in zip(pairs,pairs[1:]):
+            if lowResult<=value<=highResult and highResult>lowResult:
+                absorbance=lowAbsorbance+(highAbsorbance-lowAbsorbance)*(value-lowResult)/(highResult-lowResult)
+            elif value>highResult:
+                absorbance=highAbsorbance
+        channel=[color in ts.lightAbsorptionColor for color in ('Red','Green','Blue')]
+        return developingColorModel(tuple(absorbance if used else .05 for used in channel))
+    swatches=swatchesByValue(tester,ts.colorChartToUse)
+    if len(swatches)==0:
+        return developingColorModel((.3,.3,.3))
+    return developingColorModel(swatchAbsorbance(swatches,value))
+
+def defaultTankValue(tester,ts):
+    #The middle of what the test can measure
+    if ts.KHtestwithPHProbe:
+        return 8.0
+    if not ts.titrationSlot is None:
+        return ts.titrationMaxAmount*ts.calctovalue/2
+    if not ts.lightAbsorptionTest is None:
+        results=[float(field) for field in ts.lightAbsorptionResult.split(',')]
+        return (min(results)+max(results))/2
+    swatches=swatchesByValue(tester,ts.colorChartToUse)
+    if len(swatches)==0:
+        return 0
+    return swatches[len(swatches)//2].valueAtSwatch
+
+class simulatedWorld:
+    #What the simulated devices act on.  Times are simulated secs, which pass 1/timeScale times as fast as real ones.
+    def __init__(self,timeScale=1,clock=time.time,seed=None):
+        self.timeScale=timeScale
+        self.clock=clock
+        self.seed=seed
+        self.startTime=clock()
+        self.lock=threading.RLock()
+        self.throttles={}
+        self.pumps={}
+        self.pulseBackend=None
+        self.mixer={'tankML':0,'osmoseML':0,'reagents':{}}
+        self.developedSecs=0
+        self.lastAdvance=self.now()
+        self.syringe={'slot':None,'liquidML':0}
+        self.khJar={'sampleML':0,'acidML':0}
+        self.khDegrees=8.0
+        self.acidNormality=.05
+        self.khChemistry=None
+        self.model=None
+        self.events=[]
+
+    def now(self):
+        return (self.clock()-self.startTime)/self.timeScale
+
+    def record(self,event):
+        #Kept short, the simulation can run for days
+        self.events.append((round(self.now(),2),event))
+        del self.events[:-500]
+
+    def mixerVolumeML(self):
+        return self.mixer['tankML']+self.mixer['osmoseML']+sum(self.mixer['reagents'].values())
+
+    def isOn(self,motor):
+        return (self.throttles.get(motor) or 0)>0
+
+    def advance(self):
+        now=self.now()
+        if sum(self.mixer['reagents'].values())>0:
+            self.developedSecs+=(now-self.lastAdvance)*(3 if self.isOn(AGITATOR) else 1)
+        self.lastAdvance=now
+
+    def motorChanged(self,motor,throttle):
+        with self.lock:
+            self.advance()
+            wasOn=self.isOn(motor)
+            self.throttles[motor]=throttle
+            if self.isOn(motor) and not wasOn:
+                #The drains run for longer than the mixer or the jar takes to empty
+                if motor==MAIN_DRAIN:
+                    self.mixer={'tankML':0,'osmoseML':0,'reagents':{}}
+                    self.developedSecs=0
+                    self.record('mixer drained')
+                elif motor==KH_DRAIN:
+                    self.khJar={'sampleML':0,'acidML':0}
+                    self.record('KH jar drained')
+
+    def attachPumps(self,pulseBackend,mainPump,khSamplePump,khReagentPump):
+        self.pulseBackend=pulseBackend
+        self.pumps={mainPump.stepPin:('main',mainPump),khSamplePump.stepPin:('KH sample',khSamplePump),khReagentPump.stepPin:('KH reagent',khReagentPump)}
+
+    def pulsesSent(self,stepPin,steps):
+        if not stepPin in self.pumps:
+            return
+        role,pump=self.pumps[stepPin]
+        direction=1 if self.pulseBackend.pinLevels.get(pump.directionPin,0)==0 else -1
+        with self.lock:
+            self.advance()
+            if role=='main':
+                #The valves are open at throttle 0, and osmose water needs fewer steps per ML like mainPumpStepsPerML says
+                if self.throttles.get(TANK_VALVE)==0:
+                    self.mixer['tankML']=max(self.mixer['tankML']+direction*steps/int(pump.stepsPerML),0)
+                elif self.throttles.get(OSMOSE_VALVE)==0:
+                    self.mixer['osmoseML']=max(self.mixer['osmoseML']+direction*steps/int(pump.stepsPerML/1.5),0)
+            elif role=='KH sample':
+                self.khJar['sampleML']=max(self.khJar['sampleML']+direction*steps/pump.stepsPerML,0)
+            else:
+                self.khJar['acidML']=max(self.khJar['acidML']+direction*steps/pump.stepsPerML,0)
+            self.record('%s pump %.3f ML' % (role,direction*steps/pump.stepsPerML))
+
+    def placeAt(self,x):
+        place,placeX=min(CentimeterToMove.items(),key=lambda item:abs(item[1]-x))
+        return place if abs(placeX-x)<.5 else None
+
+    def moveDone(self,axis,startPosition,target,position):
+        #The syringe is Y in hundredths of an ML.  Drawing takes up what the tip is in, dosing lets the liquid out before the air.
+        if axis!='Y':
+            return
+        x,y,z=position
+        place=self.placeAt(x)
+        ml=(target-startPosition)/100
+        with self.lock:
+            self.advance()
+            if ml>0:
+                if not place in (None,Mixerreactor,Cleanreactor) and z>=ZInReagent-1:
+                    self.syringe={'slot':place,'liquidML':self.syringe['liquidML']+ml}
+                elif place==Cleanreactor and z>=ZInMixerreactor:
+                    self.syringe={'slot':'water','liquidML':self.syringe['liquidML']+ml}
+                return
+            liquidML=min(self.syringe['liquidML'],-ml)
+            if liquidML<=0:
+                return
+            slot=self.syringe['slot']
+            self.syringe['liquidML']-=liquidML
+            if self.syringe['liquidML']<=0:
+                self.syringe={'slot':None,'liquidML':0}
+            if place==Mixerreactor and self.mixerVolumeML()>0:
+                self.mixer['reagents'][slot]=self.mixer['reagents'].get(slot,0)+liquidML
+                self.developedSecs=0
+                self.record('%.3f ML of %s dosed into the mixer' % (liquidML,slot))
+
+    def setKHChemistry(self,khDegrees,acidNormality):
+        with self.lock:
+            self.khDegrees=khDegrees
+            self.acidNormality=acidNormality
+            self.khChemistry=None
+
+    def readPH(self):
+        with self.lock:
+            sampleML=self.khJar['sampleML']
+            if sampleML<1:
+                #The probe is out of the water
+                return 7.0
+            if self.khChemistry is None or self.khChemistry.sampleML!=sampleML:
+                self.khChemistry=simulatedKHChemistry(self.khDegrees,sampleML=sampleML,acidNormality=self.acidNormality,seed=self.seed)
+            return self.khChemistry.phAt(self.khJar['acidML'])
+
+    def absorbance(self):
+        with self.lock:
+            self.advance()
+            if self.model is None:
+                return CLEAR_ABSORBANCE
+            return self.model.absorbance(self)
+
+class simulatedHardware:
+    name='simulated'
+    simulated=True
+
+    def __init__(self,timeScale=.05,seed=None,clock=time.time):
+        self.timeScale=timeScale
+        self.world=simulatedWorld(timeScale,clock=clock,seed=seed)
+        self.gpio=simulatedGPIO()
+        self.phProbe=simulatedPHProbe(self.world)
+        self.tankValues={}
+        self.grbl=None
+        self.colorSensor=None
+
+    def motorKit(self,address):
+        return simulatedMotorKit(self.world,address)
+
+    def moveSecs(self,axis,distance):
+        return estimateMoveSecs(distance,AXIS_MAX_RATE[axis],AXIS_ACCELERATION[axis])*self.timeScale
+
+    def openStepperPort(self):
+        self.grbl=fakeGrbl(homingSecs=15*self.timeScale,moveSecs=self.moveSecs,moveListener=self.world.moveDone)
+        return serial.Serial(self.grbl.portName, 9600, timeout=.1)
+
+    def openSensorPort(self,baudRate):
+        self.colorSensor=fakeColorSensor(absorbance=self.world.absorbance,measurementSecs=.3*self.timeScale)
+        return serial.Serial(self.colorSensor.portName, baudRate, timeout=.1)
+
+    def createPulseBackend(self,preference,debugLog=None):
+        self.pulseBackend=simulatedPulseBackend(realTime=True,sleep=self.sleep,listener=self.world.pulsesSent)
+        return self.pulseBackend
+
+    def attachPumps(self,mainPump,khSamplePump,khReagentPump):
+        self.world.attachPumps(self.pulseBackend,mainPump,khSamplePump,khReagentPump)
+
+    def sleep(self,secs):
+        if secs>0:
+            time.sleep(secs*self.timeScale)
+
+    def setTankValue(self,testName,value):
+        #What the tank water measures for a test, otherwise the middle of the test's range
+        self.tankValues[testName]=value
+
+    def sampleForTest(self,tester,ts):
+        value=self.tankValues.get(ts.testName)
+        if value is None:
+            value=defaultTankValue(tester,ts)
+        if ts.KHtestwithPHProbe:
+            #So the acid at calctovalue dKH per ML reaches the equivalence point at the tank's KH
+            self.world.setKHChemistry(value,ts.waterVolInML*(ts.calctovalue or 1)/2800)
+        with self.world.lock:
+            self.world.model=reactionModelFor(tester,ts,value)
+        tester.debugMessage('Simulated tank water has ' + str(round(value,2)) + ' for ' + ts.testName)
+
+    def close(self):
+        for fake in (self.grbl,self.colorSensor):
+            if not fake is None:
+                fake.close()
+
+DEVICE_TREE_MODEL_FILES=('/proc/device-tree/model','/sys/firmware/devicetree/base/model')
+
+def isRaspberryPi(modelFiles=DEVICE_TREE_MODEL_FILES):
+    for modelFile in modelFiles:
+        try:
+            with open(modelFile,'rb') as model:
+                return b'Raspberry Pi' in model.read()
+        except OSError:
+            continue
+    return False
+
+def createHardware(preference='auto',timeScale=.05,debugLog=None):
+    #preference is auto, pi or simulated.  auto simulates only on a host that is not a Pi, a Pi missing its libraries raises like pi does.
+    if preference=='pi' or (preference=='auto' and isRaspberryPi()):
+        return piHardware()
+    if preference=='auto' and not debugLog is None:
+        debugLog.warning('This host is not a Raspberry Pi, simulating the hardware')
+    return simulatedHardware(timeScale)
+
+def benchmarkSimulatedHardware(timeScale=.01,calcToValue=1):
+    #A KH titration on the simulated jar, dosed the way runKHTest does without the predictor, and the moves of a reagent dose
+    hardware=simulatedHardware(timeScale,seed=1)
+    world=hardware.world
+    world.setKHChemistry(8.0,50*calcToValue/2800)
+    world.khJar['sampleML']=50
+    doseML=0
+    reads=0
+    ph=world.readPH()
+    while ph>4.5 and doseML<15:
+        doseML+=.5 if ph>6 else .05
+        world.khJar['acidML']=doseML
+        ph=world.readPH()
+        reads+=1
+    print('KH 8.0 measured as %.2f after %.2f ML and %d reads' % (doseML*calcToValue,doseML,reads))
+    for axis,distance in (('X',51.1),('Z',55),('Y',100)):
+        print('%s %.1f: %.2f secs on the board, %.3f secs simulated' % (axis,distance,hardware.moveSecs(axis,distance)/timeScale,hardware.moveSecs(axis,distance)))
+
+if __name__ == '__main__':
+    benchmarkSimulatedHardware()
@@ -87,19 +87,19 @@ class feature:
 
     def snapPhoto(self,tester,suffix=None):
         pathToImageFolder=tester.basePath + 'Images'
-        tester.videoLowResCaptureLock.acquire()
-        tester.videoLowResCaptureLock.wait()
-        imageCopy=tester.latestLowResImage.copy()
-        tester.videoLowResCaptureLock.release()
-        clipped=self.clipImage(tester,imageCopy)
-        pathToClipping=pathToImageFolder + '/' + self.featureName
-        if not os.path.isdir(pathToClipping):
-            os.mkdir(pathToClipping)
-        if suffix is None:
-            fn=pathToClipping + '/' + self.featureName + '-' + datetime.datetime.now().strftime("%Y-%m-%d %H-%M-%S") + '.jpg'
-        else:
-            fn=pathToClipping + '/' + self.featureName + '-' + suffix + '-' + datetime.datetime.now().strftime("%Y-%m-%d %H-%M-%S") + '.jpg'
-        cv2.imwrite(fn,clipped)
+        frameSequence,frame,frameSlot=tester.frameBuffer.acquireFrame()
+        try:
+            clipped=self.clipImage(tester,frame)
+            pathToClipping=pathToImageFolder + '/' + self.featureName
+            if not os.path.isdir(pathToClipping):
+                os.mkdir(pathToClipping)
+            if suffix is None:
+                fn=pathToClipping + '/' + self.featureName + '-' + datetime.datetime.now().strftime("%Y-%m-%d %H-%M-%S") + '.jpg'
+            else:
+                fn=pathToClipping + '/' + self.featureName + '-' + suffix + '-' + datetime.datetime.now().strftime("%Y-%m-%d %H-%M-%S") + '.jpg'
+            cv2.imwrite(fn,clipped)
+        finally:
+            tester.frameBuffer.releaseFrame(frameSlot)
         tester.debugMessage('Clipped image saved at: ' + fn)
     
     def computeGapDarkness(self,image):
@@ -166,23 +166,56 @@ class colorSheet:
         self.tableWidth=80
         self.tableRowHeight=40
         self.tableStartPosition=300
+        self.matchCandidateMatrixList={}
+        self.contentVersion=0
+        self.colorTableCache={}
+        
+    def invalidateMatchCandidates(self):
+        self.matchCandidateMatrixList={}
+        
+    def markContentsChanged(self):
+        #Call after the swatches have been changed so anything built from them is rebuilt on next use
+        self.contentVersion+=1
+        self.colorTableCache={}
+        self.invalidateMatchCandidates()
+        
+    def compileMatchCandidates(self,tester):
+        self.invalidateMatchCandidates()
+        swatchCountPerCondition={}
+        for swatchName in self.swatchList:
+            lightingConditions=self.swatchList[swatchName].lightingConditions
+            swatchCountPerCondition[lightingConditions]=swatchCountPerCondition.get(lightingConditions,0)+1
+        for lightingConditions in swatchCountPerCondition:
+            if swatchCountPerCondition[lightingConditions]>=2:
+                getMatchCandidateMatrix(tester,self.colorSheetName,lightingConditions)
         
     def generateColorTableDisplay(self,tester,width=80,height=40):
+        #The rendered table is shared with every caller, so it is read only
+        cacheKey=(self.contentVersion,tester.lightingConditionToDisplay,width,height)
+        try:
+            return self.colorTableCache[cacheKey]
+        except KeyError:
+            pass
+        colorTable=self.renderColorTableDisplay(tester.lightingConditionToDisplay,width,height)
+        if not colorTable is None:
+            colorTable.flags.writeable=False
+        self.colorTableCache[cacheKey]=colorTable
+        return colorTable
+    
+    def renderColorTableDisplay(self,lightingConditions,width,height):
         numSwatches=len(self.swatchList)
         if numSwatches<=0:
             return None
-        index=0
+        swatchesToShow=[]
         for swatchName in sorted(self.swatchList):
             swatch=self.swatchList[swatchName]
-            if swatch.lightingConditions==tester.lightingConditionToDisplay:
-                index+=1
-        colorTable=np.zeros((height*index,width,3),dtype=np.uint8)
+            if swatch.lightingConditions==lightingConditions:
+                swatchesToShow.append(swatch)
+        colorTable=np.zeros((height*len(swatchesToShow),width,3),dtype=np.uint8)
         index=0
-        for swatchName in sorted(self.swatchList):
-            swatch=self.swatchList[swatchName]
-            if swatch.lightingConditions==tester.lightingConditionToDisplay:
-                colorTable[index*height:(index+1)*height,:,]=swatch.generateBGRRect(width,height)
-                index+=1
+        for swatch in swatchesToShow:
+            colorTable[index*height:(index+1)*height,:,]=swatch.generateBGRRect(width,height)
+            index+=1
         return colorTable
     
     def loadSwatchesImage(self,tester,xCoord,yCoord,swatchValue):
@@ -191,10 +224,7 @@ class colorSheet:
             imageFile=tester.basePath+'Simulation/SimulationImage-640x480.jpg'
             clickableImage=cv2.imread(imageFile)
         else:
-            tester.videoLowResCaptureLock.acquire()
-            tester.videoLowResCaptureLock.wait()
-            clickableImage=tester.latestLowResImage.copy()
-            tester.videoLowResCaptureLock.release()
+            clickableImage=tester.frameBuffer.copyLatestFrame()
         swatchDelRow=self.getInsideSwatchTablePosition(xCoord,yCoord)
         if not xCoord==-1:
             if swatchDelRow is None:
@@ -281,7 +311,7 @@ class swatch:
         labBlock[:,:,0]=self.channel1 
         labBlock[:,:,1]=self.channel2 
         labBlock[:,:,2]=self.channel3
-        bgrImage=cv2.cvtColor(labBlock,cv2.COLOR_Lab2BGR)*255
+        bgrImage=(cv2.cvtColor(labBlock,cv2.COLOR_Lab2BGR)*255).astype(np.uint8)
         if showValues:
             font = cv2.FONT_HERSHEY_SIMPLEX        
             cv2.putText(bgrImage,str(self.valueAtSwatch),(int(width/2-20),int(height/2)+10), font, .75,(0,0,0),2,cv2.LINE_AA)
@@ -307,7 +337,7 @@ class resultsSwatch:
         labBlock[:,:,0]=self.channel1
         labBlock[:,:,1]=self.channel2
         labBlock[:,:,2]=self.channel3
-        bgrImage=cv2.cvtColor(labBlock,cv2.COLOR_Lab2BGR)*255
+        bgrImage=(cv2.cvtColor(labBlock,cv2.COLOR_Lab2BGR)*255).astype(np.uint8)
         font = cv2.FONT_HERSHEY_SIMPLEX 
         cv2.putText(bgrImage,swatchStr,(10,20), font, .7,(0,0,0),2,cv2.LINE_AA)
         return bgrImage
@@ -352,15 +382,18 @@ def addIntermediateValues(l1,a1,b1,v1,l2,a2,b2,v2,candidateList,increments=10):
         candidateList.append([intermediateL,intermediateA,intermediateB,intermediateV])
         index+=1
     
-def prepareMatchCandidateList(tester,colorSheetName):
+def prepareMatchCandidateList(tester,colorSheetName,lightingConditions=None):
     #this assumes that the swatches are numbered in linear and consecutive number (run a quick check)
+    if lightingConditions is None:
+        lightingConditions=tester.currentLightingConditions
+    candidateList=[]
     try:
         consecutive=True
         enoughSamples=True
         i=1
         for swatchRowAndCondition in sorted(tester.colorSheetList[colorSheetName].swatchList):
             potentialSwatch=tester.colorSheetList[colorSheetName].swatchList[swatchRowAndCondition]
-            if potentialSwatch.lightingConditions==tester.currentLightingConditions:
+            if potentialSwatch.lightingConditions==lightingConditions:
                 if not potentialSwatch.swatchRow==i:
                     consecutive=False
                 i+=1
@@ -370,27 +403,26 @@ def prepareMatchCandidateList(tester,colorSheetName):
             tester.debugLog.info('Aborting because swatches for color sheet: ' + colorSheetName + ' are not consecutive')
         if not enoughSamples:
             tester.debugLog.info('Aborting because there are <2 swatches for color sheet: ' + colorSheetName)
-        candidateList=[]
         currentSwatchNumber=1
-        currentSwatch=tester.colorSheetList[colorSheetName].swatchList[str(currentSwatchNumber) + '/' + tester.currentLightingConditions]
-        startDiffChannel1=tester.colorSheetList[colorSheetName].swatchList['1/' + tester.currentLightingConditions].channel1-tester.colorSheetList[colorSheetName].swatchList['2/' + tester.currentLightingConditions].channel1
-        startDiffChannel2=tester.colorSheetList[colorSheetName].swatchList['1/' + tester.currentLightingConditions].channel2-tester.colorSheetList[colorSheetName].swatchList['2/' + tester.currentLightingConditions].channel2
-        startDiffChannel3=tester.colorSheetList[colorSheetName].swatchList['1/' + tester.currentLightingConditions].channel3-tester.colorSheetList[colorSheetName].swatchList['2/' + tester.currentLightingConditions].channel3
-        startDiffValue=tester.colorSheetList[colorSheetName].swatchList['1/' + tester.currentLightingConditions].valueAtSwatch-tester.colorSheetList[colorSheetName].swatchList['2/' + tester.currentLightingConditions].valueAtSwatch
+        currentSwatch=tester.colorSheetList[colorSheetName].swatchList[str(currentSwatchNumber) + '/' + lightingConditions]
+        startDiffChannel1=tester.colorSheetList[colorSheetName].swatchList['1/' + lightingConditions].channel1-tester.colorSheetList[colorSheetName].swatchList['2/' + lightingConditions].channel1
+        startDiffChannel2=tester.colorSheetList[colorSheetName].swatchList['1/' + lightingConditions].channel2-tester.colorSheetList[colorSheetName].swatchList['2/' + lightingConditions].channel2
+        startDiffChannel3=tester.colorSheetList[colorSheetName].swatchList['1/' + lightingConditions].channel3-tester.colorSheetList[colorSheetName].swatchList['2/' + lightingConditions].channel3
+        startDiffValue=tester.colorSheetList[colorSheetName].swatchList['1/' + lightingConditions].valueAtSwatch-tester.colorSheetList[colorSheetName].swatchList['2/' + lightingConditions].valueAtSwatch
         addIntermediateValues(currentSwatch.channel1+startDiffChannel1,currentSwatch.channel2+startDiffChannel2,currentSwatch.channel3+startDiffChannel3,currentSwatch.valueAtSwatch+startDiffValue,currentSwatch.channel1,currentSwatch.channel2,currentSwatch.channel3,currentSwatch.valueAtSwatch,candidateList)
-        nextSwatch=tester.colorSheetList[colorSheetName].swatchList[str(currentSwatchNumber+1) + '/' + tester.currentLightingConditions]
+        nextSwatch=tester.colorSheetList[colorSheetName].swatchList[str(currentSwatchNumber+1) + '/' + lightingConditions]
         try:
             while True:
                 addIntermediateValues(currentSwatch.channel1,currentSwatch.channel2,currentSwatch.channel3,currentSwatch.valueAtSwatch,nextSwatch.channel1,nextSwatch.channel2,nextSwatch.channel3,nextSwatch.valueAtSwatch,candidateList)
                 currentSwatch=nextSwatch
                 currentSwatchNumber+=1
-                nextSwatch=tester.colorSheetList[colorSheetName].swatchList[str(currentSwatchNumber+1) + '/' + tester.currentLightingConditions]
+                nextSwatch=tester.colorSheetList[colorSheetName].swatchList[str(currentSwatchNumber+1) + '/' + lightingConditions]
         except:
             lastDiffSwatchNumber=currentSwatchNumber
-            endDiffChannel1=tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber) + '/' + tester.currentLightingConditions].channel1-tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber-1) + '/' + tester.currentLightingConditions].channel1
-            endDiffChannel2=tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber) + '/' + tester.currentLightingConditions].channel2-tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber-1) + '/' + tester.currentLightingConditions].channel2
-            endDiffChannel3=tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber) + '/' + tester.currentLightingConditions].channel3-tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber-1) + '/' + tester.currentLightingConditions].channel3
-            endDiffValue=tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber) + '/' + tester.currentLightingConditions].valueAtSwatch-tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber-1) + '/' + tester.currentLightingConditions].valueAtSwatch
+            endDiffChannel1=tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber) + '/' + lightingConditions].channel1-tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber-1) + '/' + lightingConditions].channel1
+            endDiffChannel2=tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber) + '/' + lightingConditions].channel2-tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber-1) + '/' + lightingConditions].channel2
+            endDiffChannel3=tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber) + '/' + lightingConditions].channel3-tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber-1) + '/' + lightingConditions].channel3
+            endDiffValue=tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber) + '/' + lightingConditions].valueAtSwatch-tester.colorSheetList[colorSheetName].swatchList[str(lastDiffSwatchNumber-1) + '/' + lightingConditions].valueAtSwatch
             addIntermediateValues(currentSwatch.channel1,currentSwatch.channel2,currentSwatch.channel3,currentSwatch.valueAtSwatch,currentSwatch.channel1+endDiffChannel1,currentSwatch.channel2+endDiffChannel2,currentSwatch.channel3+endDiffChannel3,currentSwatch.valueAtSwatch+endDiffValue,candidateList)
 #        for item in candidateList:
 #            print(item)
@@ -398,17 +430,29 @@ def prepareMatchCandidateList(tester,colorSheetName):
         tester.debugLog.exception("Creating candidates...") 
     return candidateList 
   
+def getMatchCandidateMatrix(tester,colorSheetName,lightingConditions=None):
+    #Candidates only change when the swatches change, so they are compiled once per sheet and lighting condition
+    if lightingConditions is None:
+        lightingConditions=tester.currentLightingConditions
+    cs=tester.colorSheetList[colorSheetName]
+    candidateMatrix=cs.matchCandidateMatrixList.get(lightingConditions)
+    if candidateMatrix is None:
+        candidateList=prepareMatchCandidateList(tester,colorSheetName,lightingConditions)
+        candidateMatrix=np.array(candidateList,dtype=np.float64).reshape(-1,4)
+        if len(candidateMatrix)>0:
+            cs.matchCandidateMatrixList[lightingConditions]=candidateMatrix
+    return candidateMatrix
+
+def findClosestCandidateValue(candidateMatrix,l,a,b):
+    diffL=candidateMatrix[:,0]-l
+    diffA=candidateMatrix[:,1]-a
+    diffB=candidateMatrix[:,2]-b
+    squaredDistances=diffL*diffL + diffA*diffA + diffB*diffB
+    return float(candidateMatrix[np.argmin(squaredDistances),3])
+
 def findClosestSwatchMatch(tester,colorSheetName,l,a,b):
-    minDistance=99999
-    closestSwath=None
-    closestIndex=0
-    candidateList=prepareMatchCandidateList(tester,colorSheetName)
-    for labValues in candidateList:
-        swatchDistance=getLABDistance(l,a,b,labValues[0],labValues[1],labValues[2])
-        if swatchDistance<minDistance:
-            closestValue=labValues[3]
-            minDistance=swatchDistance
-    return  closestValue
+    candidateMatrix=getMatchCandidateMatrix(tester,colorSheetName)
+    return findClosestCandidateValue(candidateMatrix,l,a,b)
         
 def evaluateColor(tester,colorSheetName,results):
     l,a,b,BGR,Rvalue,Gvalue,Bvalue=tester.measureArduinoSensor()
@@ -423,7 +467,7 @@ def evaluateColor(tester,colorSheetName,results):
     resultSwatch.channel3=b
     return resultSwatch
 
-def prepareBinaryMatchCandidateList(tester,colorSheetName):
+def prepareBinaryMatchCandidateList(tester,colorSheetName,increments=100):
     #this assumes that the swatches are numbered in linear and consecutive number (run a quick check)
     try:
         consecutive=True
@@ -452,17 +496,54 @@ def prepareBinaryMatchCandidateList(tester,colorSheetName):
         endChannel2=tester.colorSheetList[colorSheetName].swatchList['2/' + tester.currentLightingConditions].channel2
         endChannel3=tester.colorSheetList[colorSheetName].swatchList['2/' + tester.currentLightingConditions].channel3
         endValue=tester.colorSheetList[colorSheetName].swatchList['2/' + tester.currentLightingConditions].valueAtSwatch
-        addIntermediateValues(startChannel1,startChannel2,startChannel3,startValue,endChannel1,endChannel2,endChannel3,endValue,candidateList,increments=100)
+        addIntermediateValues(startChannel1,startChannel2,startChannel3,startValue,endChannel1,endChannel2,endChannel3,endValue,candidateList,increments=increments)
         candidateList.append([endChannel1,endChannel2,endChannel3,endValue])
     except:
         tester.debugLog.exception("Creating candidates...") 
     return candidateList 
   
+def getBinaryMatchCandidate(startSwatch,endSwatch,index,increments):
+    #Same arithmetic as addIntermediateValues, with the last index being the end swatch itself
+    if index>=increments:
+        return endSwatch.channel1,endSwatch.channel2,endSwatch.channel3,endSwatch.valueAtSwatch
+    candidateL=((increments-index)*startSwatch.channel1+index*endSwatch.channel1)/increments
+    candidateA=((increments-index)*startSwatch.channel2+index*endSwatch.channel2)/increments
+    candidateB=((increments-index)*startSwatch.channel3+index*endSwatch.channel3)/increments
+    candidateV=((increments-index)*startSwatch.valueAtSwatch+index*endSwatch.valueAtSwatch)/increments
+    return candidateL,candidateA,candidateB,candidateV
+
+def findClosestBinarySwatchMatchProjection(tester,colorSheetName,l,a,b,increments=100):
+    #The binary candidates are evenly spaced on the segment swatch 1 -> swatch 2, so project onto the segment
+    #instead of building the list.  The neighbours of the projected index are compared with the same distance
+    #calculation as the list so the result is identical to the list lookup.
+    startSwatch=tester.colorSheetList[colorSheetName].swatchList['1/' + tester.currentLightingConditions]
+    endSwatch=tester.colorSheetList[colorSheetName].swatchList['2/' + tester.currentLightingConditions]
+    deltaL=endSwatch.channel1-startSwatch.channel1
+    deltaA=endSwatch.channel2-startSwatch.channel2
+    deltaB=endSwatch.channel3-startSwatch.channel3
+    segmentLengthSquared=deltaL*deltaL + deltaA*deltaA + deltaB*deltaB
+    if segmentLengthSquared>0:
+        position=((l-startSwatch.channel1)*deltaL + (a-startSwatch.channel2)*deltaA + (b-startSwatch.channel3)*deltaB)/segmentLengthSquared
+    else:
+        position=0
+    position=min(max(position,0),1)
+    projectedIndex=int(round(position*increments))
+    minDistance=99999
+    index=max(projectedIndex-1,0)
+    while index<=min(projectedIndex+1,increments):
+        candidateL,candidateA,candidateB,candidateV=getBinaryMatchCandidate(startSwatch,endSwatch,index,increments)
+        swatchDistance=getLABDistance(l,a,b,candidateL,candidateA,candidateB)
+        if swatchDistance<minDistance:
+            closestValue=candidateV
+            minDistance=swatchDistance
+        index+=1
+    return closestValue
+
 def findClosestBinarySwatchMatch(tester,colorSheetName,l,a,b):
+    if tester.binaryMatchUseProjection:
+        return findClosestBinarySwatchMatchProjection(tester,colorSheetName,l,a,b,increments=tester.binaryMatchIncrements)
     minDistance=99999
-    closestSwath=None
-    closestIndex=0
-    candidateList=prepareBinaryMatchCandidateList(tester,colorSheetName)
+    candidateList=prepareBinaryMatchCandidateList(tester,colorSheetName,increments=tester.binaryMatchIncrements)
     for labValues in candidateList:
         swatchDistance=getLABDistance(l,a,b,labValues[0],labValues[1],labValues[2])
         if swatchDistance<minDistance:
@@ -470,8 +551,25 @@ def findClosestBinarySwatchMatch(tester,colorSheetName,l,a,b):
             minDistance=swatchDistance
     return  closestValue
         
+def getBinaryTransitionProgress(tester,colorSheetName,l,a,b):
+    #How far the color has moved from swatch 1 towards swatch 2 (0 to 1), judged by the Lab distance left to swatch 2
+    startSwatch=tester.colorSheetList[colorSheetName].swatchList['1/' + tester.currentLightingConditions]
+    endSwatch=tester.colorSheetList[colorSheetName].swatchList['2/' + tester.currentLightingConditions]
+    swatchDistance=getLABDistance(startSwatch.channel1,startSwatch.channel2,startSwatch.channel3,endSwatch.channel1,endSwatch.channel2,endSwatch.channel3)
+    if swatchDistance<=0:
+        return 0
+    remainingDistance=getLABDistance(l,a,b,endSwatch.channel1,endSwatch.channel2,endSwatch.channel3)
+    return min(max(1-remainingDistance/swatchDistance,0),1)
+
+def getBinaryTransitionTarget(tester,colorSheetName,transitionValue):
+    #The transition value expressed as progress from swatch 1 to swatch 2
+    startValue=tester.colorSheetList[colorSheetName].swatchList['1/' + tester.currentLightingConditions].valueAtSwatch
+    endValue=tester.colorSheetList[colorSheetName].swatchList['2/' + tester.currentLightingConditions].valueAtSwatch
+    if endValue==startValue:
+        return 1
+    return min(max((transitionValue-startValue)/(endValue-startValue),0),1)
+
 def evaluateColorBinary(tester,image,colorSheetName,l,a,b):
-    l,a,b,BGR,Rvalue,Gvalue,Bvalue=tester.measureArduinoSensor()
     closestValue=findClosestBinarySwatchMatch(tester,colorSheetName,l,a,b)
     resultSwatch=resultsSwatch()
     resultSwatch.swatchDropCount=None
@@ -481,5 +579,74 @@ def evaluateColorBinary(tester,image,colorSheetName,l,a,b):
     resultSwatch.channel3=b
     return resultSwatch    
 
+class benchmarkTester:
+    #Minimal stand in for the tester so the matching code can be timed without hardware or database
+    def __init__(self,numSwatches=8):
+        import logging
+        self.debugLog=logging.getLogger('Benchmark')
+        self.currentLightingConditions='LED'
+        self.lightingConditionToDisplay='LED'
+        cs=colorSheet('Benchmark')
+        index=1
+        while index<=numSwatches:
+            sw=swatch(cs.colorSheetName)
+            sw.swatchRow=index
+            sw.valueAtSwatch=index*.5
+            sw.channel1=90-index*6
+            sw.channel2=-20+index*4
+            sw.channel3=40-index*7
+            cs.swatchList[str(index) + '/LED']=sw
+            index+=1
+        self.colorSheetList={cs.colorSheetName:cs}
+        self.binaryMatchUseProjection=True
+        self.binaryMatchIncrements=100
+
+def findClosestSwatchMatchUncached(tester,colorSheetName,l,a,b):
+    #The original list based lookup, kept for comparison in the benchmark
+    minDistance=99999
+    candidateList=prepareMatchCandidateList(tester,colorSheetName)
+    for labValues in candidateList:
+        swatchDistance=getLABDistance(l,a,b,labValues[0],labValues[1],labValues[2])
+        if swatchDistance<minDistance:
+            closestValue=labValues[3]
+            minDistance=swatchDistance
+    return  closestValue
+
+def benchmarkSwatchMatch(iterations=2000):
+    import time
+    tester=benchmarkTester()
+    labSamples=[(random.uniform(30,90),random.uniform(-20,20),random.uniform(-20,40)) for i in range(iterations)]
+    startTime=time.perf_counter()
+    uncachedResults=[findClosestSwatchMatchUncached(tester,'Benchmark',l,a,b) for l,a,b in labSamples]
+    uncachedSecs=time.perf_counter()-startTime
+    tester.colorSheetList['Benchmark'].compileMatchCandidates(tester)
+    startTime=time.perf_counter()
+    cachedResults=[findClosestSwatchMatch(tester,'Benchmark',l,a,b) for l,a,b in labSamples]
+    cachedSecs=time.perf_counter()-startTime
+    print('Uncached lookup: %.1f us' % (uncachedSecs/iterations*1000000))
+    print('Cached lookup: %.1f us' % (cachedSecs/iterations*1000000))
+    print('Speedup: %.1fx' % (uncachedSecs/cachedSecs))
+    print('Results identical: ' + str(uncachedResults==cachedResults))
+
+def benchmarkColorTable(iterations=300):
+    import time
+    tester=benchmarkTester()
+    cs=tester.colorSheetList['Benchmark']
+    frame=np.zeros((640,480,3),dtype=np.uint8)
+    startTime=time.perf_counter()
+    for i in range(iterations):
+        colorTable=cs.renderColorTableDisplay(tester.lightingConditionToDisplay,cs.tableWidth,cs.tableRowHeight)
+        frame[cs.tableStartPosition:cs.tableStartPosition+colorTable.shape[0],:colorTable.shape[1],:]=colorTable
+    renderSecs=time.perf_counter()-startTime
+    startTime=time.perf_counter()
+    for i in range(iterations):
+        colorTable=cs.generateColorTableDisplay(tester,width=cs.tableWidth,height=cs.tableRowHeight)
+        frame[cs.tableStartPosition:cs.tableStartPosition+colorTable.shape[0],:colorTable.shape[1],:]=colorTable
+    cachedSecs=time.perf_counter()-startTime
+    print('Color table rendered per frame: %.1f us' % (renderSecs/iterations*1000000))
+    print('Color table cached: %.1f us' % (cachedSecs/iterations*1000000))
+    print('Tables identical: ' + str(np.array_equal(colorTable,cs.renderColorTableDisplay(tester.lightingConditionToDisplay,cs.tableWidth,cs.tableRowHeight))))
+
 if __name__ == '__main__':
-    pass
\ No newline at end of file
+    benchmarkSwatchMatch()
+    benchmarkColorTable()
\ No newline at end of file
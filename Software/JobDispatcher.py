@@ -0,0 +1,103 @@
+'''
+AutoTester is the controlling software to automatically run water tests
+Further info can be found at: https://robogardens.com/?p=928
+This software is free for DIY, Nonprofit, and educational uses.
+Copyright (C) 2017 - RoboGardens.com
+
+Created on Oct 18, 2026
+
+This module holds the in memory queue of test jobs.  The JobExternal table stays the durable
+record of the queue, but the test runner waits here for work instead of polling the database.
+Jobs are kept in timeStamp order and the runner is woken as soon as a job is queued or becomes due.
+'''
+
+import threading
+import heapq
+import time
+
+class JobDispatcher:
+    def __init__(self,busyRecheckSecs=1):
+        self.busyRecheckSecs=busyRecheckSecs
+        self.jobLock=threading.Condition()
+        self.jobHeap=[]
+        self.jobsQueued={}
+
+    def addJob(self,jobID,timeStamp):
+        with self.jobLock:
+            if jobID in self.jobsQueued:
+                return
+            readyTime=timeStamp.timestamp()
+            self.jobsQueued[jobID]=readyTime
+            heapq.heappush(self.jobHeap,(readyTime,jobID))
+            self.jobLock.notify_all()
+
+    def replaceJobs(self,jobList):
+        #jobList is (jobID,timeStamp) pairs as read back from the JobExternal table
+        with self.jobLock:
+            self.jobsQueued={}
+            for jobID,timeStamp in jobList:
+                self.jobsQueued[jobID]=timeStamp.timestamp()
+            self.jobHeap=[(readyTime,jobID) for jobID,readyTime in self.jobsQueued.items()]
+            heapq.heapify(self.jobHeap)
+            self.jobLock.notify_all()
+
+    def removeJob(self,jobID):
+        with self.jobLock:
+            self.jobsQueued.pop(jobID,None)
+
+    def discardRemovedJobs(self):
+        #Removed jobs are left in the heap and dropped lazily when they reach the top
+        while self.jobHeap and self.jobsQueued.get(self.jobHeap[0][1])!=self.jobHeap[0][0]:
+            heapq.heappop(self.jobHeap)
+
+    def anyReadyJobs(self):
+        with self.jobLock:
+            self.discardRemovedJobs()
+            return len(self.jobHeap)>0 and self.jobHeap[0][0]<=time.time()
+
+    def queuedJobCount(self):
+        with self.jobLock:
+            return len(self.jobsQueued)
+
+    def peekReadyJob(self):
+        #The job popReadyJob would return, left in the queue
+        with self.jobLock:
+            self.discardRemovedJobs()
+            if len(self.jobHeap)==0 or self.jobHeap[0][0]>time.time():
+                return None
+            return self.jobHeap[0][1]
+
+    def popReadyJob(self):
+        with self.jobLock:
+            self.discardRemovedJobs()
+            if len(self.jobHeap)==0 or self.jobHeap[0][0]>time.time():
+                return None
+            readyTime,jobID=heapq.heappop(self.jobHeap)
+            del self.jobsQueued[jobID]
+            return jobID
+
+    def waitForReadyJob(self,canStart=None,timeout=None):
+        #Blocks until the earliest job is due and canStart() allows it to run.  Returns False on timeout.
+        if timeout is None:
+            endTime=None
+        else:
+            endTime=time.time()+timeout
+        with self.jobLock:
+            while True:
+                self.discardRemovedJobs()
+                now=time.time()
+                waitSecs=None
+                if self.jobHeap:
+                    if self.jobHeap[0][0]<=now:
+                        if canStart is None or canStart():
+                            return True
+                        #Nothing signals when the tester goes idle again, so check back shortly
+                        waitSecs=self.busyRecheckSecs
+                    else:
+                        waitSecs=self.jobHeap[0][0]-now
+                if not endTime is None:
+                    if now>=endTime:
+                        return False
+                    if waitSecs is None or endTime-now<waitSecs:
+                        waitSecs=endTime-now
+                self.jobLock.wait(waitSecs)
@@ -0,0 +1,142 @@
+'''
+AutoTester is the controlling software to automatically run water tests
+Further info can be found at: https://robogardens.com/?p=928
+This software is free for DIY, Nonprofit, and educational uses.
+Copyright (C) 2017 - RoboGardens.com
+
+Created on Oct 18, 2026
+
+This module moves the tester's log writing off the threads that run the hardware.  The loggers
+only put records on a queue, and one listener thread formats them and writes the files, so a slow
+SD card or a log rotation never holds up a pump, a move or a titration read.  When the queue is
+full a record is dropped and counted rather than waited for.  Each record is written as one line
+of JSON carrying the test, reagent step and phase that were running when it was logged.
+'''
+
+import json
+import logging
+import os
+import queue
+import tempfile
+import time
+from logging.handlers import QueueHandler,QueueListener,RotatingFileHandler
+
+LOG_QUEUE_SIZE=10000
+
+class LogContext:
+    #Only one test runs at a time, so the test, step and phase are shared by every thread working on it
+    def __init__(self):
+        self.values={'test':None,'step':None,'phase':None}
+
+    def set(self,**values):
+        for key in values:
+            if not key in self.values:
+                raise ValueError('Unknown log context ' + key)
+        #Replaced whole so a thread logging meanwhile never sees half an update
+        self.values=dict(self.values,**values)
+
+    def clear(self):
+        self.values={'test':None,'step':None,'phase':None}
+
+    def current(self):
+        return self.values
+
+logContext=LogContext()
+
+class nonBlockingQueueHandler(QueueHandler):
+    #The context is stamped on the record when it is logged, not when the listener gets to it
+    def __init__(self,recordQueue,context):
+        QueueHandler.__init__(self,recordQueue)
+        self.context=context
+        self.droppedRecords=0
+
+    def prepare(self,record):
+        for key,value in self.context.current().items():
+            setattr(record,key,value)
+        return QueueHandler.prepare(self,record)
+
+    def enqueue(self,record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.droppedRecords+=1
+
+class routingQueueListener(QueueListener):
+    #One listener thread for every logger, each record going only to the handlers of the logger it came from
+    def __init__(self,recordQueue):
+        QueueListener.__init__(self,recordQueue,respect_handler_level=True)
+        self.routes={}
+
+    def handle(self,record):
+        record=self.prepare(record)
+        for handler in self.routes.get(record.name,()):
+            if record.levelno>=handler.level:
+                handler.handle(record)
+
+class JsonFormatter(logging.Formatter):
+    def format(self,record):
+        fields={'time':self.formatTime(record),
+                'level':record.levelname,
+                'thread':record.threadName,
+                'test':getattr(record,'test',None),
+                'step':getattr(record,'step',None),
+                'phase':getattr(record,'phase',None),
+                'message':record.getMessage()}
+        return json.dumps(fields,default=str)
+
+class LogPipeline:
+    def __init__(self,queueSize=LOG_QUEUE_SIZE,context=logContext):
+        self.queue=queue.Queue(queueSize)
+        self.context=context
+        self.listener=routingQueueListener(self.queue)
+        self.queueHandlers=[]
+
+    def attach(self,logger,handlers):
+        #The handlers are only ever called from the listener's thread
+        queueHandler=nonBlockingQueueHandler(self.queue,self.context)
+        logger.addHandler(queueHandler)
+        self.queueHandlers.append(queueHandler)
+        self.listener.routes.setdefault(logger.name,[]).extend(handlers)
+        return queueHandler
+
+    def droppedRecords(self):
+        return sum(queueHandler.droppedRecords for queueHandler in self.queueHandlers)
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        #Writes whatever is still queued
+        if not self.listener._thread is None:
+            self.listener.stop()
+
+def benchmarkLogPipeline(records=5000):
+    #How long the logging thread is held up, writing straight to a small rotating file and through the pipeline
+    with tempfile.TemporaryDirectory() as logPath:
+        for name,queued,maxBytes in (('Rotating file, 8000 bytes',False,8000),('Rotating file, 1 MB',False,1000000),('Pipeline, 1 MB',True,1000000)):
+            logger=logging.getLogger('Benchmark ' + name)
+            logger.propagate=False
+            logger.setLevel(logging.INFO)
+            handler=RotatingFileHandler(os.path.join(logPath,name + '.log'),maxBytes=maxBytes,backupCount=4)
+            handler.setFormatter(JsonFormatter())
+            pipeline=None
+            if queued:
+                pipeline=LogPipeline()
+                pipeline.attach(logger,[handler])
+                pipeline.start()
+            else:
+                logger.addHandler(handler)
+            startTime=time.perf_counter()
+            worstSecs=0
+            for i in range(records):
+                recordStart=time.perf_counter()
+                logger.info('Dispensed drip %d of the titration reagent',i)
+                worstSecs=max(worstSecs,time.perf_counter()-recordStart)
+            loggingSecs=time.perf_counter()-startTime
+            if not pipeline is None:
+                pipeline.stop()
+            handler.close()
+            print('%s: %.1f us per record, worst %.1f ms' % (name,loggingSecs/records*1000000,worstSecs*1000))
+
+if __name__ == '__main__':
+    benchmarkLogPipeline()
@@ -0,0 +1,203 @@
+'''
+AutoTester is the controlling software to automatically run water tests
+Further info can be found at: https://robogardens.com/?p=928
+This software is free for DIY, Nonprofit, and educational uses.
+Copyright (C) 2017 - RoboGardens.com
+
+Created on Oct 18, 2026
+
+This module reads the tester logs for the logs page without reading whole files.  The last
+records are found by reading backwards from the end of the newest log file, and the page then polls
+with a cursor (the file's inode and a byte offset) for whatever has been written since.  When the
+log has rotated in between, the rest of the old file is read from its new name first.  Records can
+be filtered by level and thread, and the lines of a traceback stay with the record they belong to.
+Both the older text lines and the JSON lines of the log pipeline are read.
+'''
+
+import json
+import os
+import re
+
+LOG_LEVELS={'DEBUG':10,'INFO':20,'WARNING':30,'ERROR':40,'CRITICAL':50}
+RECORD_START=re.compile(r'^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3} - ')
+JSON_RECORD_START='{"time": '
+READ_BLOCK_SIZE=8192
+MAX_ROTATED_FILES=20
+
+def parseJsonRecord(line):
+    #One line of the log pipeline's JSON, shown the way the text records are with the test, step and phase before the message
+    try:
+        fields=json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(fields,dict) or not 'time' in fields:
+        return None
+    context=[]
+    if fields.get('test'):
+        context.append(fields['test'])
+    if not fields.get('step') is None:
+        context.append('step ' + str(fields['step']))
+    if fields.get('phase'):
+        context.append(fields['phase'])
+    message=str(fields.get('message',''))
+    if context:
+        message='[' + ', '.join(context) + '] ' + message
+    text=' - '.join(str(part) for part in (fields['time'],fields.get('thread'),fields.get('level'),message) if not part is None)
+    return {'time':fields['time'],'thread':fields.get('thread'),'level':fields.get('level'),'test':fields.get('test'),
+            'step':fields.get('step'),'phase':fields.get('phase'),'text':text}
+
+def parseRecordHeader(line):
+    #Lines are JSON or "time - [thread - ][LEVEL - ]message".  Returns None for the continuation lines of a record.
+    if line.startswith(JSON_RECORD_START):
+        return parseJsonRecord(line)
+    if not RECORD_START.match(line):
+        return None
+    parts=line.rstrip('\n').split(' - ',3)
+    record={'time':parts[0],'thread':None,'level':None,'text':line.rstrip('\n')}
+    if len(parts)>=3 and parts[1] in LOG_LEVELS:
+        record['level']=parts[1]
+    elif len(parts)>=4 and parts[2] in LOG_LEVELS:
+        record['thread']=parts[1]
+        record['level']=parts[2]
+    elif len(parts)>=3:
+        record['thread']=parts[1]
+    return record
+
+def recordMatches(record,minLevel=None,threadName=None):
+    #Records from before the level was logged count as INFO
+    if not minLevel is None and LOG_LEVELS.get(record['level'] or 'INFO',0)<LOG_LEVELS[minLevel]:
+        return False
+    if threadName and record['thread']!=threadName:
+        return False
+    return True
+
+def reverseLines(path,blockSize=READ_BLOCK_SIZE,endOffset=None):
+    #Yields the lines of a file from the last one back, reading one block at a time from the end
+    try:
+        logFile=open(path,'rb')
+    except FileNotFoundError:
+        return
+    with logFile:
+        position=os.fstat(logFile.fileno()).st_size if endOffset is None else endOffset
+        pending=b''
+        while position>0:
+            readSize=min(blockSize,position)
+            position-=readSize
+            logFile.seek(position)
+            pending=logFile.read(readSize)+pending
+            lines=pending.split(b'\n')
+            pending=lines[0]
+            for line in reversed(lines[1:]):
+                if line!=b'':
+                    yield line.decode('utf-8',errors='replace')
+        if pending!=b'':
+            yield pending.decode('utf-8',errors='replace')
+
+def logFileNames(logPath,logName,rotatedFiles=MAX_ROTATED_FILES):
+    #Newest first, the way RotatingFileHandler names them.  How many are kept is a setting, so look for them.
+    names=[os.path.join(logPath,logName)]
+    for number in range(1,rotatedFiles+1):
+        name=os.path.join(logPath,logName + '.' + str(number))
+        if not os.path.exists(name):
+            break
+        names.append(name)
+    return names
+
+def groupRecords(lines):
+    #lines run backwards, so a record's continuation lines arrive before its first line
+    continuation=[]
+    for line in lines:
+        header=parseRecordHeader(line)
+        if header is None:
+            continuation.append(line)
+            continue
+        header['text']='\n'.join([header['text']]+list(reversed(continuation)))
+        continuation=[]
+        yield header
+
+def tailRecords(logPath,logName,count=200,minLevel=None,threadName=None,maxScanBytes=4000000):
+    #The last count matching records, oldest first, and the cursor to poll for newer ones from.
+    #Reading stops after maxScanBytes so a filter that rarely matches can not read every file.
+    cursor=currentCursor(logPath,logName)
+    endOffset=int(cursor.split('-')[1])
+    records=[]
+    scannedBytes=0
+    def lines():
+        nonlocal scannedBytes
+        for number,path in enumerate(logFileNames(logPath,logName)):
+            for line in reverseLines(path,endOffset=endOffset if number==0 else None):
+                scannedBytes+=len(line)+1
+                yield line
+                if scannedBytes>=maxScanBytes:
+                    return
+    for record in groupRecords(lines()):
+        if recordMatches(record,minLevel,threadName):
+            records.append(record)
+            if len(records)>=count:
+                break
+    records.reverse()
+    return records,cursor
+
+def currentCursor(logPath,logName):
+    try:
+        status=os.stat(os.path.join(logPath,logName))
+    except FileNotFoundError:
+        return '0-0'
+    return str(status.st_ino) + '-' + str(status.st_size)
+
+def readForward(path,offset,maxBytes):
+    #Whole lines from offset on, and the offset just after the last one
+    try:
+        logFile=open(path,'rb')
+    except FileNotFoundError:
+        return [],offset
+    with logFile:
+        logFile.seek(offset)
+        data=logFile.read(maxBytes)
+    end=data.rfind(b'\n')
+    if end<0:
+        return [],offset
+    data=data[:end+1]
+    return data.decode('utf-8',errors='replace').splitlines(),offset+len(data)
+
+def readNewRecords(logPath,logName,cursor,minLevel=None,threadName=None,maxBytes=256000):
+    #Records written since cursor, and the cursor to poll with next.  A partly written last line is left for the next poll.
+    try:
+        inode,offset=(int(value) for value in cursor.split('-'))
+    except (AttributeError,ValueError):
+        return [],currentCursor(logPath,logName)
+    #Oldest first, so when the log has rotated since the last poll the file the cursor was in is finished before the newer ones
+    files=[]
+    for path in reversed(logFileNames(logPath,logName)):
+        try:
+            files.append((path,os.stat(path).st_ino))
+        except FileNotFoundError:
+            pass
+    if len(files)==0:
+        return [],'0-0'
+    startIndex=next((index for index,(path,fileInode) in enumerate(files) if fileInode==inode),None)
+    if startIndex is None:
+        #The cursor's file has rotated away altogether
+        startIndex=len(files)-1
+        offset=0
+    lines=[]
+    for index in range(startIndex,len(files)):
+        path,inode=files[index]
+        newLines,offset=readForward(path,offset,maxBytes)
+        lines+=newLines
+        maxBytes-=sum(len(line.encode('utf-8'))+1 for line in newLines)
+        if index==len(files)-1 or maxBytes<=0:
+            break
+        if len(newLines)>0 and offset<os.path.getsize(path):
+            break
+        offset=0
+    return filterLines(lines,minLevel,threadName),str(inode) + '-' + str(offset)
+
+def filterLines(lines,minLevel=None,threadName=None):
+    records=list(groupRecords(reversed(lines)))
+    records.reverse()
+    if len(lines)>0 and parseRecordHeader(lines[0]) is None:
+        #The rest of a record that started before the cursor
+        text='\n'.join(lines[:next((index for index,line in enumerate(lines) if not parseRecordHeader(line) is None),len(lines))])
+        records.insert(0,{'time':None,'thread':None,'level':None,'text':text})
+    return [record for record in records if recordMatches(record,minLevel,threadName)]
@@ -0,0 +1,226 @@
+'''
+AutoTester is the controlling software to automatically run water tests
+Further info can be found at: https://robogardens.com/?p=928
+This software is free for DIY, Nonprofit, and educational uses.
+Copyright (C) 2017 - RoboGardens.com
+
+Created on Oct 18, 2026
+
+This module keeps the tester's runtime metrics: counters, gauges and histograms, each with
+optional labels, rendered in the Prometheus text format for the /metrics page of the video
+streaming server.  Updating a metric only takes its lock and adds a number, so it can be done on
+the video and test threads.  A gauge or counter can instead be given a function that reads a
+value the tester already keeps, which is then only looked at when the metrics are scraped.
+'''
+
+import bisect
+import functools
+import math
+import threading
+import time
+
+CONTENT_TYPE='text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS=(.005,.01,.025,.05,.1,.25,.5,1,2.5,5,10)
+
+def formatValue(value):
+    if value==math.inf:
+        return '+Inf'
+    if value==-math.inf:
+        return '-Inf'
+    if isinstance(value,float) and value.is_integer() and abs(value)<1e15:
+        return str(int(value))
+    return repr(float(value)) if isinstance(value,float) else str(value)
+
+def escapeLabel(value):
+    return str(value).replace('\\','\\\\').replace('\n','\\n').replace('"','\\"')
+
+def formatLabels(labelNames,labelValues,extra=()):
+    pairs=list(zip(labelNames,labelValues))+list(extra)
+    if len(pairs)==0:
+        return ''
+    return '{' + ','.join(name + '="' + escapeLabel(value) + '"' for name,value in pairs) + '}'
+
+class metric:
+    kind=None
+
+    def __init__(self,name,helpText,labelNames=(),function=None):
+        self.name=name
+        self.helpText=helpText
+        self.labelNames=tuple(labelNames)
+        #function returns the value, or a dict of values by tuples of label values
+        self.function=function
+        self.lock=threading.Lock()
+        self.values={}
+
+    def labelKey(self,labels):
+        if set(labels)!=set(self.labelNames):
+            raise ValueError(self.name + ' takes labels ' + str(self.labelNames) + ', got ' + str(tuple(labels)))
+        return tuple(str(labels[name]) for name in self.labelNames)
+
+    def currentValues(self):
+        if self.function is None:
+            with self.lock:
+                return dict(self.values)
+        try:
+            values=self.function()
+        except Exception:
+            #Whatever the function reads may not exist yet while the tester starts up
+            return {}
+        if values is None:
+            return {}
+        if not isinstance(values,dict):
+            return {():values}
+        return {tuple(str(value) for value in key):value for key,value in values.items()}
+
+    def value(self,**labels):
+        return self.currentValues().get(self.labelKey(labels),0)
+
+    def render(self):
+        lines=['# HELP ' + self.name + ' ' + self.helpText.replace('\n',' '),'# TYPE ' + self.name + ' ' + self.kind]
+        for labelValues,value in sorted(self.currentValues().items()):
+            lines.append(self.name + formatLabels(self.labelNames,labelValues) + ' ' + formatValue(value))
+        return lines
+
+class Counter(metric):
+    kind='counter'
+
+    def inc(self,amount=1,**labels):
+        if amount<0:
+            raise ValueError('A counter can only go up')
+        key=self.labelKey(labels)
+        with self.lock:
+            self.values[key]=self.values.get(key,0)+amount
+
+class Gauge(metric):
+    kind='gauge'
+
+    def set(self,value,**labels):
+        key=self.labelKey(labels)
+        with self.lock:
+            self.values[key]=value
+
+    def inc(self,amount=1,**labels):
+        key=self.labelKey(labels)
+        with self.lock:
+            self.values[key]=self.values.get(key,0)+amount
+
+    def dec(self,amount=1,**labels):
+        self.inc(-amount,**labels)
+
+class Histogram(metric):
+    kind='histogram'
+
+    def __init__(self,name,helpText,labelNames=(),buckets=DEFAULT_BUCKETS):
+        metric.__init__(self,name,helpText,labelNames)
+        self.buckets=tuple(sorted(buckets))
+
+    def observe(self,value,**labels):
+        key=self.labelKey(labels)
+        bucket=bisect.bisect_left(self.buckets,value)
+        with self.lock:
+            counts=self.values.get(key)
+            if counts is None:
+                #Per bucket counts, not yet cumulative, then the sum and the count
+                counts=self.values[key]=[[0]*(len(self.buckets)+1),0,0]
+            counts[0][bucket]+=1
+            counts[1]+=value
+            counts[2]+=1
+
+    def time(self,**labels):
+        return timer(self,labels)
+
+    def count(self,**labels):
+        counts=self.currentValues().get(self.labelKey(labels))
+        return 0 if counts is None else counts[2]
+
+    def currentValues(self):
+        with self.lock:
+            return {key:[list(counts[0]),counts[1],counts[2]] for key,counts in self.values.items()}
+
+    def render(self):
+        lines=['# HELP ' + self.name + ' ' + self.helpText.replace('\n',' '),'# TYPE ' + self.name + ' histogram']
+        for labelValues,(bucketCounts,total,count) in sorted(self.currentValues().items()):
+            cumulative=0
+            for bound,bucketCount in zip(self.buckets+(math.inf,),bucketCounts):
+                cumulative+=bucketCount
+                lines.append(self.name + '_bucket' + formatLabels(self.labelNames,labelValues,(('le',formatValue(float(bound))),)) + ' ' + str(cumulative))
+            lines.append(self.name + '_sum' + formatLabels(self.labelNames,labelValues) + ' ' + formatValue(float(total)))
+            lines.append(self.name + '_count' + formatLabels(self.labelNames,labelValues) + ' ' + str(count))
+        return lines
+
+class timer:
+    #Times a with block or, used as a decorator, each call
+    def __init__(self,histogram,labels):
+        self.histogram=histogram
+        self.labels=labels
+
+    def __enter__(self):
+        self.startTime=time.perf_counter()
+        return self
+
+    def __exit__(self,excType,excValue,traceback):
+        self.histogram.observe(time.perf_counter()-self.startTime,**self.labels)
+        return False
+
+    def __call__(self,function):
+        @functools.wraps(function)
+        def wrapper(*args,**kwargs):
+            with timer(self.histogram,self.labels):
+                return function(*args,**kwargs)
+        return wrapper
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics={}
+        self.lock=threading.Lock()
+
+    def register(self,newMetric):
+        with self.lock:
+            if newMetric.name in self.metrics:
+                raise ValueError('Metric ' + newMetric.name + ' registered twice')
+            self.metrics[newMetric.name]=newMetric
+        return newMetric
+
+    def counter(self,name,helpText,labelNames=(),function=None):
+        return self.register(Counter(name,helpText,labelNames,function))
+
+    def gauge(self,name,helpText,labelNames=(),function=None):
+        return self.register(Gauge(name,helpText,labelNames,function))
+
+    def histogram(self,name,helpText,labelNames=(),buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name,helpText,labelNames,buckets))
+
+    def get(self,name):
+        return self.metrics.get(name)
+
+    def render(self):
+        with self.lock:
+            metrics=list(self.metrics.values())
+        lines=[]
+        for registered in metrics:
+            lines+=registered.render()
+        return '\n'.join(lines) + '\n'
+
+def countQueries(counter):
+    #A Django execute wrapper, counting each query by its first word
+    def wrapper(execute,sql,params,many,context):
+        operation=sql.lstrip().split(None,1)[0].upper() if sql.strip() else 'UNKNOWN'
+        counter.inc(operation=operation)
+        return execute(sql,params,many,context)
+    return wrapper
+
+def benchmarkMetrics(updates=100000):
+    registry=MetricsRegistry()
+    counter=registry.counter('benchmark_total','Updates')
+    histogram=registry.histogram('benchmark_seconds','Observations',labelNames=('sensor',))
+    for name,update in (('Counter inc',lambda: counter.inc()),('Histogram observe',lambda: histogram.observe(.03,sensor='color'))):
+        startTime=time.perf_counter()
+        for i in range(updates):
+            update()
+        print('%s: %.2f us' % (name,(time.perf_counter()-startTime)/updates*1000000))
+    startTime=time.perf_counter()
+    text=registry.render()
+    print('Render: %.2f ms for %d lines' % ((time.perf_counter()-startTime)*1000,text.count('\n')))
+
+if __name__ == '__main__':
+    benchmarkMetrics()
@@ -0,0 +1,189 @@
+'''
+AutoTester is the controlling software to automatically run water tests
+Further info can be found at: https://robogardens.com/?p=928
+This software is free for DIY, Nonprofit, and educational uses.
+Copyright (C) 2017 - RoboGardens.com
+
+Created on Oct 18, 2026
+
+This module plans the syringe carriage moves of a test step.  A plan is a list of segments, each
+a run of moves followed by an optional checkpoint (agitation or a wait).  The moves of a segment
+are queued on the GRBL driver together so they stream through GRBL's planner buffer, and the
+tester only waits for the machine where a checkpoint needs it to have stopped.  The same plan can
+be dry run to estimate how long the motion of a test takes.
+
+Run this module to print the estimate for every test definition.
+'''
+
+import math
+import os
+import sys
+import time
+
+Mixerreactor='Mixerreactor'
+Cleanreactor='Cleanreactor'
+CentimeterToMove={'A':0,'B':3.7,'C':7.3,'D':11,'E':14.9,'F':18.6,'G':22.1,'H':25.7,'I':29.7,'J':33.3,'K':36.9,'L':40.5,'M':44.5,'Cleanreactor':47.9,'Mixerreactor':51.1}
+ZUp=0
+ZInReagent=55
+ZInMixerreactor=40
+
+#GRBL defaults ($110-$112 in units/min and $120-$122 in units/sec^2), change to match the board's settings
+AXIS_MAX_RATE={'X':500,'Y':500,'Z':500}
+AXIS_ACCELERATION={'X':10,'Y':10,'Z':10}
+#Fixed sleep plus status polling the tester spent on each move before the GRBL driver thread
+LEGACY_SECS_PER_MOVE=2.2
+
+def syringePosition(ml):
+    #Same conversion as fillSyringes
+    return int(ml*100)
+
+class motionPlan:
+    def __init__(self):
+        self.segments=[]
+
+    def openSegment(self):
+        if len(self.segments)==0 or not self.segments[-1]['checkpoint'] is None:
+            self.segments.append({'moves':[],'checkpoint':None})
+        return self.segments[-1]
+
+    def move(self,axis,target,description):
+        self.openSegment()['moves'].append({'axis':axis,'target':target,'description':description})
+
+    def checkpoint(self,description,estimatedSecs=0,action=None):
+        #action runs once every move before it has finished
+        segment=self.openSegment()
+        segment['checkpoint']={'description':description,'estimatedSecs':estimatedSecs,'action':action}
+
+    def moveCount(self):
+        return sum(len(segment['moves']) for segment in self.segments)
+
+def planReagentDraw(reagentX,amountToDispense,airInSyringe,syringeTolerance,agitateReagentSecs,thickLiquid,agitate=None,wait=None,plan=None):
+    #From the move to the reagent slot until the syringe is back up out of the reagent with the dose in it
+    if plan is None:
+        plan=motionPlan()
+    plan.move('X',reagentX,'move to the reagent')
+    if agitateReagentSecs>0:
+        plan.checkpoint('Agitating the Reagent for ' + str(agitateReagentSecs) + ' secs.',agitateReagentSecs,lambda: agitate(agitateReagentSecs))
+    plan.move('Y',syringePosition(amountToDispense),'draw air into the syringe')
+    plan.move('Z',ZInReagent,'lower the syringe in the reagent')
+    plan.move('Y',syringePosition(airInSyringe),'push the air into the reagent')
+    plan.move('Y',syringePosition(amountToDispense+airInSyringe+syringeTolerance),'get the reagent liquid')
+    if thickLiquid:
+        plan.checkpoint('Wait for Thick Reagent',60,lambda: wait(60))
+    plan.move('Y',syringePosition(amountToDispense+airInSyringe),'return the extra reagent')
+    if thickLiquid:
+        plan.checkpoint('Wait for Thick Reagent',10,lambda: wait(10))
+    plan.move('Z',ZUp,'upper the syringe out of the reagent')
+    return plan
+
+def planReagentDose(mixerX,amountToDispense,agitateSecsBetweenDrips,agitate=None,plan=None):
+    #From the move to the mixer reactor until the syringe is back up out of it, the mixer has to be filled by then
+    if plan is None:
+        plan=motionPlan()
+    plan.move('X',mixerX,'move to the mixer reactor')
+    plan.move('Z',ZInMixerreactor,'lower the syringe in the mixer reactor')
+    if agitateSecsBetweenDrips>0:
+        mlToDispense=amountToDispense
+        while mlToDispense>0:
+            plan.move('Y',syringePosition(mlToDispense),'dose a drop of the reagent')
+            plan.checkpoint('Agitating between drops',agitateSecsBetweenDrips,lambda: agitate(agitateSecsBetweenDrips))
+            mlToDispense-=0.01
+    else:
+        plan.move('Y',0,'dose the reagent liquid')
+    plan.move('Z',ZUp,'upper the syringe out of the mixer reactor')
+    return plan
+
+def planReagentStep(reagentX,mixerX,amountToDispense,airInSyringe,syringeTolerance,agitateReagentSecs,agitateSecsBetweenDrips,thickLiquid,agitate=None,wait=None):
+    #The moves of runTestStep from the reagent slot until the syringe is back up out of the mixer reactor
+    plan=planReagentDraw(reagentX,amountToDispense,airInSyringe,syringeTolerance,agitateReagentSecs,thickLiquid,agitate,wait)
+    return planReagentDose(mixerX,amountToDispense,agitateSecsBetweenDrips,agitate,plan)
+
+def runMotionPlan(grbl,plan,statusCallback=None,timeoutSecs=120,trace=None):
+    #Returns None when the plan ran, otherwise the move that failed.  With a PhaseTrace each move is timed from when the one before it finished.
+    for segment in plan.segments:
+        if len(segment['moves'])>0:
+            if not statusCallback is None:
+                statusCallback(segment['moves'][0]['description'][:1].upper() + segment['moves'][0]['description'][1:])
+            moveStart=time.time()
+            futures=[grbl.queueMove(move['axis'],move['target']) for move in segment['moves']]
+            for move,future in zip(segment['moves'],futures):
+                try:
+                    future.result(timeout=timeoutSecs)
+                except Exception:
+                    #Lines GRBL has already accepted still run, only the ones not yet sent are dropped
+                    for pendingFuture in futures:
+                        pendingFuture.cancel()
+                    if not trace is None:
+                        trace.record(move['description'],'motion',moveStart,time.time(),failed=True)
+                    return move
+                if not trace is None:
+                    moveEnd=time.time()
+                    trace.record(move['description'],'motion',moveStart,moveEnd)
+                    moveStart=moveEnd
+        checkpoint=segment['checkpoint']
+        if not checkpoint is None:
+            if not statusCallback is None:
+                statusCallback(checkpoint['description'])
+            if not checkpoint['action'] is None:
+                checkpoint['action']()
+    return None
+
+def estimateMoveSecs(distance,maxRatePerMin,acceleration):
+    #Trapezoid profile from rest to rest, or a triangle if the move is too short to reach full speed
+    distance=abs(distance)
+    if distance==0:
+        return 0
+    maxRate=maxRatePerMin/60
+    if distance>=maxRate**2/acceleration:
+        return distance/maxRate+maxRate/acceleration
+    return 2*math.sqrt(distance/acceleration)
+
+def estimatePlan(plan,startPosition=None,axisMaxRate=AXIS_MAX_RATE,axisAcceleration=AXIS_ACCELERATION):
+    #Returns the motion secs, the checkpoint secs and the end position
+    if startPosition is None:
+        startPosition={'X':0,'Y':0,'Z':0}
+    position=dict(startPosition)
+    motionSecs=0
+    checkpointSecs=0
+    for segment in plan.segments:
+        for move in segment['moves']:
+            motionSecs+=estimateMoveSecs(move['target']-position[move['axis']],axisMaxRate[move['axis']],axisAcceleration[move['axis']])
+            position[move['axis']]=move['target']
+        if not segment['checkpoint'] is None:
+            checkpointSecs+=segment['checkpoint']['estimatedSecs']
+    return motionSecs,checkpointSecs,position
+
+def estimateTestDefinition(ts,airInSyringe=0,syringeTolerance=0.03):
+    #Syringe moves of the reagent steps only, not the pumps, the mixer cleaning or the syringe cleaning
+    mixerX=CentimeterToMove[Mixerreactor]
+    position={'X':mixerX,'Y':0,'Z':ZUp}
+    totalMotionSecs=0
+    totalCheckpointSecs=0
+    moveCount=0
+    for stepNumber in (1,2,3):
+        slot=getattr(ts,'reagent' + str(stepNumber) + 'Slot')
+        amount=getattr(ts,'reagent' + str(stepNumber) + 'Amount')
+        if slot is None or not amount or amount<=0:
+            break
+        plan=planReagentStep(CentimeterToMove[str(slot)],mixerX,amount,airInSyringe,syringeTolerance,
+            getattr(ts,'reagent' + str(stepNumber) + 'AgitateSecs') or 0,getattr(ts,'reagent' + str(stepNumber) + 'AgitateSecsBetweenDrips') or 0,
+            getattr(ts,'reagent' + str(stepNumber) + 'ThickLiquid'))
+        motionSecs,checkpointSecs,position=estimatePlan(plan,position)
+        totalMotionSecs+=motionSecs
+        totalCheckpointSecs+=checkpointSecs+(getattr(ts,'reagent' + str(stepNumber) + 'AgitateMixerSecs') or 0)
+        moveCount+=plan.moveCount()
+    return {'moves':moveCount,'motionSecs':totalMotionSecs,'checkpointSecs':totalCheckpointSecs,'legacyOverheadSecs':moveCount*LEGACY_SECS_PER_MOVE}
+
+def printTestDefinitionEstimates():
+    from tester.models import TestDefinition
+    for ts in TestDefinition.objects.select_related('reagent1Slot','reagent2Slot','reagent3Slot').filter(KHtestwithPHProbe=False):
+        estimate=estimateTestDefinition(ts)
+        print('%-40s %3d moves, %6.1f secs moving, %6.1f secs agitating/waiting (per move waits before the driver thread added %.0f secs)' % \
+            (ts.testName,estimate['moves'],estimate['motionSecs'],estimate['checkpointSecs'],estimate['legacyOverheadSecs']))
+
+if __name__ == '__main__':
+    import django
+    sys.path.append(os.path.abspath(os.path.dirname(os.path.abspath(__file__))))
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'AutoTesterv2.settings'
+    django.setup()
+    printTestDefinitionEstimates()
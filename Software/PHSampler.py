@@ -0,0 +1,110 @@
+'''
+AutoTester is the controlling software to automatically run water tests
+Further info can be found at: https://robogardens.com/?p=928
+This software is free for DIY, Nonprofit, and educational uses.
+Copyright (C) 2017 - RoboGardens.com
+
+Created on Oct 18, 2026
+
+This module samples the pH probe.  Samples are taken on a fixed schedule and folded into a
+running mean and variance as they arrive.  With early stopping the sampler returns as soon as the
+standard error of the mean is within tolerance, otherwise it takes samples until the time cap the
+way read_ph always has.  The sample count and spread are returned with the value so a noisy probe
+can be reported instead of silently averaged.
+'''
+
+import math
+import random
+import time
+
+class runningStatistics:
+    #Welford's method, so nothing but the count, mean and sum of squares is kept
+    def __init__(self):
+        self.count=0
+        self.mean=0.0
+        self.sumSquares=0.0
+
+    def add(self,value):
+        self.count+=1
+        delta=value-self.mean
+        self.mean+=delta/self.count
+        self.sumSquares+=delta*(value-self.mean)
+
+    def variance(self):
+        if self.count<2:
+            return 0.0
+        return self.sumSquares/(self.count-1)
+
+    def spread(self):
+        return math.sqrt(self.variance())
+
+    def standardError(self):
+        if self.count<2:
+            return float('inf')
+        return math.sqrt(self.variance()/self.count)
+
+class PHSampler:
+    def __init__(self,readPH,samplesPerSec=1,maxSampleSecs=5,earlyStop=False,minSamples=3,stableTolerance=.01,sleep=time.sleep):
+        self.readPH=readPH
+        self.samplesPerSec=samplesPerSec
+        self.maxSampleSecs=maxSampleSecs
+        self.earlyStop=earlyStop
+        self.minSamples=max(minSamples,2)
+        self.stableTolerance=stableTolerance
+        self.sleep=sleep
+
+    def maxSamples(self):
+        return max(int(round(self.maxSampleSecs*self.samplesPerSec)),1)
+
+    def sample(self):
+        #Like the original read_ph, each sample waits out one sample period first so the probe can settle
+        statistics=runningStatistics()
+        samplePeriod=1/self.samplesPerSec
+        startTime=time.time()
+        maxSamples=self.maxSamples()
+        stable=False
+        while statistics.count<maxSamples:
+            waitSecs=startTime+(statistics.count+1)*samplePeriod-time.time()
+            if waitSecs>0:
+                self.sleep(waitSecs)
+            statistics.add(self.readPH())
+            stable=statistics.count>=self.minSamples and statistics.standardError()<=self.stableTolerance
+            if stable and self.earlyStop:
+                break
+        return {'ph':round(statistics.mean,2),
+                'samples':statistics.count,
+                'spread':statistics.spread(),
+                'stable':stable,
+                'secs':time.time()-startTime}
+
+class simulatedPHProbe:
+    def __init__(self,ph=7.0,noise=.01,seed=None):
+        self.ph=ph
+        self.noise=noise
+        self.rng=random.Random(seed)
+
+    def readPH(self):
+        return self.ph+self.rng.gauss(0,self.noise)
+
+def benchmarkPHSampler(runs=5):
+    #Time is simulated by skipping the sleeps, so the secs reported are the scheduled sample time
+    for name,samplerArgs in (('Legacy',{}),('Early stop, 10/s',{'samplesPerSec':10,'earlyStop':True,'minSamples':5})):
+        for noise in (.005,.02,.1):
+            totalSamples=0
+            totalSecs=0
+            unstable=0
+            errors=[]
+            for run in range(runs):
+                probe=simulatedPHProbe(ph=6.2,noise=noise,seed=run)
+                sampler=PHSampler(probe.readPH,sleep=lambda secs: None,**samplerArgs)
+                reading=sampler.sample()
+                totalSamples+=reading['samples']
+                totalSecs+=reading['samples']/sampler.samplesPerSec
+                errors.append(abs(reading['ph']-probe.ph))
+                if not reading['stable']:
+                    unstable+=1
+            print('%s, probe noise %.3f: %.1f samples, %.1f secs, mean error %.3f, %d of %d flagged unstable' % \
+                (name,noise,totalSamples/runs,totalSecs/runs,sum(errors)/runs,unstable,runs))
+
+if __name__ == '__main__':
+    benchmarkPHSampler()
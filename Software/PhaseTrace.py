@@ -0,0 +1,164 @@
+'''
+AutoTester is the controlling software to automatically run water tests
+Further info can be found at: https://robogardens.com/?p=928
+This software is free for DIY, Nonprofit, and educational uses.
+Copyright (C) 2017 - RoboGardens.com
+
+Created on Oct 18, 2026
+
+This module records where the time of a test goes.  While a test runs the tester holds a trace,
+and the moves, pumps, agitation, sensor reads and database writes each add a phase to it with
+when it started and how long it took.  The trace is saved as JSON with the test's results, and
+the history page draws it as a waterfall.  Between tests there is no trace and timing a phase
+costs nothing.
+'''
+
+import contextlib
+import functools
+import inspect
+import json
+import threading
+import time
+
+MAX_TRACE_PHASES=3000
+
+class PhaseTrace:
+    def __init__(self,testName=None,clock=time.time):
+        self.testName=testName
+        self.clock=clock
+        self.startTime=clock()
+        self.phases=[]
+        self.categorySecs={}
+        self.droppedPhases=0
+        self.lock=threading.Lock()
+
+    def record(self,name,category,startTime,endTime,failed=False,thread=None):
+        #Phases can finish on several threads at once when a test step overlaps its operations
+        if thread is None:
+            thread=threading.current_thread().name
+        with self.lock:
+            self.categorySecs[category]=self.categorySecs.get(category,0)+endTime-startTime
+            if len(self.phases)>=MAX_TRACE_PHASES:
+                self.droppedPhases+=1
+                return
+            self.phases.append({'name':name,'category':category,'thread':thread,
+                'start':round(startTime-self.startTime,3),'secs':round(endTime-startTime,3),'failed':failed})
+
+    @contextlib.contextmanager
+    def phase(self,name,category):
+        startTime=self.clock()
+        failed=True
+        try:
+            yield
+            failed=False
+        finally:
+            self.record(name,category,startTime,self.clock(),failed)
+
+    def summary(self):
+        return ', '.join('%s %.0fs' % (category,secs) for category,secs in sorted(self.categorySecs.items(),key=lambda item:-item[1]))
+
+    def toJson(self):
+        #Phases in the order they started, a phase before the ones inside it
+        return json.dumps({'test':self.testName,'started':self.startTime,'secs':round(self.clock()-self.startTime,3),
+            'categorySecs':{category:round(secs,3) for category,secs in self.categorySecs.items()},
+            'droppedPhases':self.droppedPhases,'phases':sorted(self.phases,key=lambda phase:(phase['start'],-phase['secs']))})
+
+def tracedPhase(trace,name,category):
+    if trace is None:
+        return contextlib.nullcontext()
+    return trace.phase(name,category)
+
+def traced(name,category):
+    #For methods of the tester and functions taking it first.  name can use the other arguments by position or
+    #by name, e.g. 'move {0} to {1}' or 'move {axis} to {target}', however they were passed.
+    def decorator(function):
+        signature=inspect.signature(function)
+        @functools.wraps(function)
+        def wrapper(tester,*args,**kwargs):
+            trace=getattr(tester,'phaseTrace',None)
+            if trace is None:
+                return function(tester,*args,**kwargs)
+            try:
+                bound=signature.bind(tester,*args,**kwargs)
+                bound.apply_defaults()
+                phaseName=name.format(*list(bound.arguments.values())[1:],**bound.arguments)
+            except (TypeError,IndexError,KeyError):
+                #The call does not match the function, which will say so itself
+                phaseName=name
+            with trace.phase(phaseName,category):
+                return function(tester,*args,**kwargs)
+        return wrapper
+    return decorator
+
+def loadTrace(text):
+    if not text:
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+def waterfallRows(trace):
+    #Runs of the same phase on the same thread, like the reads of a titration, are drawn as one row.  left and width are percents of the test.
+    if trace is None or len(trace['phases'])==0:
+        return []
+    totalSecs=max(trace['secs'],max(phase['start']+phase['secs'] for phase in trace['phases']),.001)
+    rows=[]
+    for phase in trace['phases']:
+        lastRow=rows[-1] if len(rows)>0 else None
+        if not lastRow is None and (lastRow['name'],lastRow['category'],lastRow['thread'])==(phase['name'],phase['category'],phase['thread']):
+            lastRow['count']+=1
+            lastRow['secs']+=phase['secs']
+            lastRow['end']=max(lastRow['end'],phase['start']+phase['secs'])
+            lastRow['failed']=lastRow['failed'] or phase['failed']
+            continue
+        rows.append({'name':phase['name'],'category':phase['category'],'thread':phase['thread'],'count':1,
+            'start':phase['start'],'end':phase['start']+phase['secs'],'secs':phase['secs'],'failed':phase['failed']})
+    for row in rows:
+        row['left']=round(100*row['start']/totalSecs,2)
+        row['width']=round(max(100*(row['end']-row['start'])/totalSecs,.2),2)
+        row['label']=row['name'] + (' x' + str(row['count']) if row['count']>1 else '')
+    return rows
+
+def simulatedTrace(timeScale=.001):
+    #A test shaped trace, sleeping timeScale secs per sec
+    class simulatedTester:
+        phaseTrace=PhaseTrace('Simulated')
+        @traced('move {0} to {1}','motion')
+        def move(self,axis,target):
+            time.sleep(2*timeScale)
+        @traced('read color sensor','sensor')
+        def read(self):
+            time.sleep(.5*timeScale)
+        @traced('agitate','agitator')
+        def agitate(self,secs):
+            time.sleep(secs*timeScale)
+    tester=simulatedTester()
+    with tester.phaseTrace.phase('clean mixer','cleaning'):
+        time.sleep(60*timeScale)
+    for axis,target in (('Z',0),('X',22),('Z',55),('Y',120),('Z',0),('X',51)):
+        tester.move(axis,target)
+    tester.agitate(20)
+    for i in range(40):
+        tester.read()
+    return tester.phaseTrace
+
+def benchmarkPhaseTrace(phases=20000):
+    #What timing a phase adds to each call, with and without a trace
+    class timedTester:
+        phaseTrace=None
+        @traced('read color sensor','sensor')
+        def read(self):
+            pass
+    tester=timedTester()
+    for name,trace in (('No trace',None),('Trace',PhaseTrace('Benchmark'))):
+        tester.phaseTrace=trace
+        startTime=time.perf_counter()
+        for i in range(phases):
+            tester.read()
+        print('%s: %.2f us per phase' % (name,(time.perf_counter()-startTime)/phases*1000000))
+    for row in waterfallRows(json.loads(simulatedTrace().toJson())):
+        print('%6.1f%% %6.1f%%  %s' % (row['left'],row['width'],row['label']))
+
+if __name__ == '__main__':
+    benchmarkPhaseTrace()
@@ -0,0 +1,201 @@
+'''
+AutoTester is the controlling software to automatically run water tests
+Further info can be found at: https://robogardens.com/?p=928
+This software is free for DIY, Nonprofit, and educational uses.
+Copyright (C) 2017 - RoboGardens.com
+
+Created on Oct 18, 2026
+
+This module runs the operations of a test step side by side.  Each operation names the actuators
+it needs (the syringe carriage, the main pump, the agitator ...) and the operations that have to
+finish before it.  An operation starts on its own thread as soon as those have finished and all of
+its actuators are free, so operations on different actuators overlap and operations on the same
+actuator take turns.  An operation can also take an actuator for just part of its run, if it names
+it as a later resource when it is added.  It then waits for that actuator while holding its others,
+so add refuses a graph where an operation holding someone's later resource could itself be waiting.
+The run reports how long the step took and how long the operations would have taken one after another.
+'''
+
+import contextlib
+import threading
+import time
+
+class StepExecutor:
+    def __init__(self,parallel=True,debugLog=None):
+        self.parallel=parallel
+        self.debugLog=debugLog
+        self.operations=[]
+        self.resourceCondition=threading.Condition()
+        self.resourceOwners={}
+        self.currentOperation=threading.local()
+
+    def add(self,name,action,resources=(),after=(),laterResources=()):
+        #action returning False or raising fails the operation, and every operation after it is skipped.
+        #laterResources are the ones the action takes part way through with holding.
+        knownNames=[operation['name'] for operation in self.operations]
+        if name in knownNames:
+            raise ValueError('Operation ' + name + ' added twice')
+        for dependency in after:
+            if not dependency in knownNames:
+                raise ValueError('Operation ' + name + ' runs after unknown operation ' + dependency)
+        newOperation={'name':name,'action':action,'resources':tuple(resources),'after':tuple(after),'laterResources':tuple(laterResources),
+            'status':'Pending','result':None,'startTime':None,'endTime':None,'waitSecs':0,'holdingLater':False,'done':threading.Event()}
+        for operation in self.operations:
+            self.checkHoldAndWait(operation,newOperation)
+            self.checkHoldAndWait(newOperation,operation)
+        self.operations.append(newOperation)
+        return name
+
+    def checkHoldAndWait(self,waiter,holder):
+        #waiter waits for its later resources while holding its own.  That can not deadlock as long as whoever holds
+        #one of them for its whole run never waits, which is when it has no later resources of its own.
+        if not holder['laterResources']:
+            return
+        for resource in waiter['laterResources']:
+            if resource in holder['resources']:
+                raise ValueError('Operation ' + waiter['name'] + ' takes ' + resource + ' part way through, which ' + holder['name'] +
+                    ' holds while it can wait for ' + ', '.join(holder['laterResources']))
+
+    def operation(self,name):
+        for operation in self.operations:
+            if operation['name']==name:
+                return operation
+        return None
+
+    def acquire(self,resources):
+        #All or nothing, so two operations can never each hold half of what the other needs
+        me=threading.get_ident()
+        startTime=time.time()
+        with self.resourceCondition:
+            while any(resource in self.resourceOwners and self.resourceOwners[resource][0]!=me for resource in resources):
+                self.resourceCondition.wait()
+            for resource in resources:
+                owner,count=self.resourceOwners.get(resource,(me,0))
+                self.resourceOwners[resource]=(me,count+1)
+        return time.time()-startTime
+
+    def release(self,resources):
+        with self.resourceCondition:
+            for resource in resources:
+                owner,count=self.resourceOwners[resource]
+                if count>1:
+                    self.resourceOwners[resource]=(owner,count-1)
+                else:
+                    del self.resourceOwners[resource]
+            self.resourceCondition.notify_all()
+
+    @contextlib.contextmanager
+    def holding(self,*resources):
+        #For an operation that only needs an actuator for part of its run
+        operation=getattr(self.currentOperation,'operation',None)
+        holdingLater=False
+        if not operation is None:
+            undeclared=[resource for resource in resources if not resource in operation['resources'] and not resource in operation['laterResources']]
+            if undeclared:
+                raise ValueError('Operation ' + operation['name'] + ' takes ' + ', '.join(undeclared) + ' without naming it when it was added')
+            holdingLater=any(not resource in operation['resources'] for resource in resources)
+            if holdingLater and operation['holdingLater']:
+                #Whoever holds the second one may be waiting for the first
+                raise ValueError('Operation ' + operation['name'] + ' takes ' + ', '.join(resources) + ' while it holds a later resource')
+        waitSecs=self.acquire(resources)
+        if not operation is None:
+            operation['waitSecs']+=waitSecs
+            if holdingLater:
+                operation['holdingLater']=True
+        try:
+            yield
+        finally:
+            if holdingLater:
+                operation['holdingLater']=False
+            self.release(resources)
+
+    def runOperation(self,operation):
+        try:
+            for dependency in operation['after']:
+                dependency=self.operation(dependency)
+                dependency['done'].wait()
+                if dependency['status']!='Done':
+                    operation['status']='Skipped'
+                    return
+            self.acquire(operation['resources'])
+            self.currentOperation.operation=operation
+            operation['startTime']=time.time()
+            try:
+                operation['result']=operation['action']()
+                operation['status']='Failed' if operation['result'] is False else 'Done'
+            except Exception:
+                operation['status']='Failed'
+                if not self.debugLog is None:
+                    self.debugLog.exception('Step operation ' + operation['name'] + ' failed')
+            finally:
+                operation['endTime']=time.time()
+                self.currentOperation.operation=None
+                self.release(operation['resources'])
+        finally:
+            operation['done'].set()
+
+    def run(self):
+        startTime=time.time()
+        if self.parallel:
+            threads=[threading.Thread(target=self.runOperation,args=(operation,),name='Step ' + operation['name'],daemon=True) for operation in self.operations]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            #The order they were added in is an order that satisfies every dependency
+            for operation in self.operations:
+                self.runOperation(operation)
+        return self.report(time.time()-startTime)
+
+    def report(self,wallSecs):
+        serialSecs=0
+        operations=[]
+        for operation in self.operations:
+            secs=0
+            if not operation['startTime'] is None:
+                secs=operation['endTime']-operation['startTime']-operation['waitSecs']
+                serialSecs+=secs
+            operations.append({'name':operation['name'],'status':operation['status'],'secs':secs})
+        failed=[operation['name'] for operation in self.operations if operation['status']=='Failed']
+        return {'wallSecs':wallSecs,
+                'serialSecs':serialSecs,
+                'savedSecs':max(serialSecs-wallSecs,0),
+                'failed':failed[0] if failed else None,
+                'operations':operations}
+
+def describeReport(report):
+    return 'took %.1f secs, %.1f secs less than one operation at a time (%s)' % (report['wallSecs'],report['savedSecs'],
+        ', '.join('%s %.1fs' % (operation['name'],operation['secs']) for operation in report['operations']))
+
+def simulatedTestStep(executor,timeScale=.01,cleanSyringe=True):
+    #The operations of the first step of a test with typical times, sleeping timeScale secs per sec
+    def sleeper(secs):
+        return lambda: time.sleep(secs*timeScale)
+    def prepareMixer():
+        with executor.holding('agitator'):
+            time.sleep(60*timeScale)
+        time.sleep(21*timeScale)
+    def drawReagent():
+        time.sleep(4*timeScale)
+        with executor.holding('agitator'):
+            time.sleep(10*timeScale)
+        time.sleep(10*timeScale)
+    executor.add('prepare mixer',prepareMixer,resources=('mainPump','mainDrain','sensor'),laterResources=('agitator',))
+    after=()
+    if cleanSyringe:
+        after=(executor.add('clean syringe',sleeper(35),resources=('carriage','cleanPumps','agitator')),)
+    executor.add('draw reagent',drawReagent,resources=('carriage',),after=after,laterResources=('agitator',))
+    executor.add('dose reagent',sleeper(8),resources=('carriage',),after=('draw reagent','prepare mixer'))
+    executor.add('agitate mixer',sleeper(20),resources=('agitator',),after=('dose reagent',))
+
+def benchmarkStepExecutor(timeScale=.01):
+    for cleanSyringe in (False,True):
+        for parallel in (False,True):
+            executor=StepExecutor(parallel=parallel)
+            simulatedTestStep(executor,timeScale,cleanSyringe)
+            report=executor.run()
+            print('%s%s: %.1f simulated secs' % ('Pipelined' if parallel else 'One at a time',', syringe cleaned first' if cleanSyringe else '',report['wallSecs']/timeScale))
+
+if __name__ == '__main__':
+    benchmarkStepExecutor()
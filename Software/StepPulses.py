@@ -0,0 +1,301 @@
+'''
+AutoTester is the controlling software to automatically run water tests
+Further info can be found at: https://robogardens.com/?p=928
+This software is free for DIY, Nonprofit, and educational uses.
+Copyright (C) 2017 - RoboGardens.com
+
+Created on Oct 18, 2026
+
+This module generates the step pulses for the pump steppers.  A pulse train is described as a
+profile of (period in microseconds, number of steps) runs, ramping up to speed and back down.
+The pigpio backend hands the train to the pigpio daemon as DMA timed waves, with the constant
+speed part as one looped pulse.  The GPIO backend is the pure Python fallback, timing each edge
+against the clock instead of sleeping.  The simulated backend records the trains for tests and
+for running without the hardware.  StepperPump drives one pump through a backend.
+'''
+
+import functools
+import math
+import time
+import numpy as np
+
+try:
+    import pigpio   # @UnresolvedImport
+except:
+    pigpio=None
+
+DEFAULT_HIGH_US=10
+PIGPIO_LOOP_MIN_STEPS=20
+PIGPIO_MAX_PULSES_PER_WAVE=2000
+
+@functools.lru_cache(maxsize=32)
+def rampTable(startPeriodUs,runPeriodUs,periodDecrementUs=100):
+    #Periods of the ramp up from startPeriodUs to runPeriodUs, computed once per pump and speed
+    periods=np.arange(max(startPeriodUs,runPeriodUs),runPeriodUs,-periodDecrementUs)
+    periods=np.round(periods).astype(np.int64)
+    periods.flags.writeable=False
+    return periods
+
+def trapezoidalProfile(steps,startPeriodUs,runPeriodUs,periodDecrementUs=100):
+    #The period drops by periodDecrementUs per step from startPeriodUs to runPeriodUs, runs, then ramps back down the same way
+    steps=int(math.ceil(steps))
+    if steps<=0:
+        return []
+    rampPeriods=rampTable(startPeriodUs,runPeriodUs,periodDecrementUs)[:steps//2].tolist()
+    runSteps=steps-2*len(rampPeriods)
+    profile=[(periodUs,1) for periodUs in rampPeriods]
+    if runSteps>0:
+        profile.append((int(round(runPeriodUs)),runSteps))
+    profile+=[(periodUs,1) for periodUs in reversed(rampPeriods)]
+    return profile
+
+def profileSteps(profile):
+    return sum(count for periodUs,count in profile)
+
+def profileDurationSecs(profile):
+    return sum(periodUs*count for periodUs,count in profile)/1000000
+
+class simulatedPulseBackend:
+    name='simulated'
+
+    def __init__(self,realTime=False,sleep=time.sleep,listener=None):
+        self.realTime=realTime
+        self.sleep=sleep
+        #listener(stepPin,steps) is called once each train has been sent
+        self.listener=listener
+        self.pinWrites=[]
+        self.pinLevels={}
+        self.pulseTrains=[]
+
+    def setupOutput(self,pin):
+        pass
+
+    def write(self,pin,level):
+        self.pinWrites.append((pin,level))
+        self.pinLevels[pin]=level
+
+    def sendPulses(self,stepPin,profile,highUs=DEFAULT_HIGH_US):
+        durationSecs=profileDurationSecs(profile)
+        steps=profileSteps(profile)
+        self.pulseTrains.append({'pin':stepPin,'profile':list(profile),'highUs':highUs,'steps':steps,'durationSecs':durationSecs})
+        if self.realTime:
+            self.sleep(durationSecs)
+        if not self.listener is None:
+            self.listener(stepPin,steps)
+        return durationSecs
+
+    def risingEdgesUs(self,train):
+        #Times of the rising edges of a recorded train, from the start of the train
+        edges=[]
+        timeUs=0
+        for periodUs,count in train['profile']:
+            for i in range(count):
+                edges.append(timeUs)
+                timeUs+=periodUs
+        return edges
+
+class gpioPulseBackend:
+    #Pure Python fallback.  Each edge is scheduled from the start of the train so one late edge does not delay the rest.
+    name='gpio'
+
+    def __init__(self,gpio):
+        self.gpio=gpio
+        self.lateEdges=0
+
+    def setupOutput(self,pin):
+        self.gpio.setup(pin,self.gpio.OUT)
+
+    def write(self,pin,level):
+        self.gpio.output(pin,level)
+
+    def waitUntil(self,deadline):
+        #time.sleep can not time tens of microseconds, so spin
+        while time.perf_counter()<deadline:
+            pass
+
+    def sendPulses(self,stepPin,profile,highUs=DEFAULT_HIGH_US):
+        startTime=time.perf_counter()
+        nextEdge=startTime
+        for periodUs,count in profile:
+            periodSecs=periodUs/1000000
+            highSecs=min(highUs,periodUs/2)/1000000
+            for i in range(count):
+                self.gpio.output(stepPin,self.gpio.HIGH)
+                self.waitUntil(nextEdge+highSecs)
+                self.gpio.output(stepPin,self.gpio.LOW)
+                nextEdge+=periodSecs
+                now=time.perf_counter()
+                if now>nextEdge+periodSecs:
+                    #Too far behind to catch up without bunching steps together, so restart the schedule from now
+                    self.lateEdges+=1
+                    nextEdge=now
+                self.waitUntil(nextEdge)
+        return time.perf_counter()-startTime
+
+class pigpioPulseBackend:
+    name='pigpio'
+
+    def __init__(self,pi):
+        self.pi=pi
+
+    def setupOutput(self,pin):
+        self.pi.set_mode(pin,pigpio.OUTPUT)
+
+    def write(self,pin,level):
+        self.pi.write(pin,level)
+
+    def createWave(self,pulses):
+        self.pi.wave_add_generic(pulses)
+        return self.pi.wave_create()
+
+    def sendPulses(self,stepPin,profile,highUs=DEFAULT_HIGH_US):
+        #Ramp steps are sent as explicit pulses, long runs at one speed as a single step wave repeated by a chain loop
+        mask=1<<stepPin
+        startTime=time.time()
+        self.pi.wave_clear()
+        waveIDs=[]
+        chain=[]
+        pendingPulses=[]
+        def flushPulses():
+            if len(pendingPulses)>0:
+                waveID=self.createWave(pendingPulses)
+                waveIDs.append(waveID)
+                chain.append(waveID)
+                del pendingPulses[:]
+        for periodUs,count in profile:
+            highTimeUs=min(highUs,periodUs//2)
+            if count>=PIGPIO_LOOP_MIN_STEPS:
+                flushPulses()
+                waveID=self.createWave([pigpio.pulse(mask,0,highTimeUs),pigpio.pulse(0,mask,periodUs-highTimeUs)])
+                waveIDs.append(waveID)
+                while count>0:
+                    repeats=min(count,65535)
+                    chain+=[255,0,waveID,255,1,repeats%256,repeats//256]
+                    count-=repeats
+            else:
+                for i in range(count):
+                    pendingPulses+=[pigpio.pulse(mask,0,highTimeUs),pigpio.pulse(0,mask,periodUs-highTimeUs)]
+                if len(pendingPulses)>=PIGPIO_MAX_PULSES_PER_WAVE:
+                    flushPulses()
+        flushPulses()
+        try:
+            self.pi.wave_chain(chain)
+            #The duration is known up front, so sleep through most of it and only poll at the end
+            time.sleep(max(profileDurationSecs(profile)-.01,0))
+            while self.pi.wave_tx_busy():
+                time.sleep(.001)
+        finally:
+            for waveID in waveIDs:
+                self.pi.wave_delete(waveID)
+        return time.time()-startTime
+
+def createPulseBackend(preference='auto',gpio=None,debugLog=None):
+    #preference is auto, pigpio, gpio or simulated.  auto takes pigpio when its daemon is running.
+    if preference in ('auto','pigpio') and not pigpio is None:
+        pi=pigpio.pi()
+        if pi.connected:
+            return pigpioPulseBackend(pi)
+        if not debugLog is None:
+            debugLog.info('pigpio daemon is not running, step pulses will be timed in Python')
+    if preference!='simulated' and not gpio is None:
+        return gpioPulseBackend(gpio)
+    return simulatedPulseBackend()
+
+class StepperPump:
+    #One pump stepper.  Enable is active low and LOW on the direction pin pumps forward.
+    def __init__(self,name,backend,enablePin,stepPin,directionPin,stepsPerML,stepDelay,rampStartSecs,maxStepRate):
+        self.name=name
+        self.backend=backend
+        self.enablePin=enablePin
+        self.stepPin=stepPin
+        self.directionPin=directionPin
+        self.stepsPerML=stepsPerML
+        #stepDelay is the half period the old sleep loop aimed for, which is faster than the pumps can really be stepped
+        self.runPeriodUs=int(round(max(2*stepDelay*1000000,1000000/maxStepRate)))
+        self.startPeriodUs=int(round(rampStartSecs*1000000))
+        self.rampPeriodsUs=rampTable(self.startPeriodUs,self.runPeriodUs)
+        self.enabled=False
+
+    def stepsFor(self,ml,stepsPerML=None):
+        if stepsPerML is None:
+            stepsPerML=self.stepsPerML
+        return int(math.ceil(abs(ml)*stepsPerML))
+
+    def profileFor(self,steps):
+        return trapezoidalProfile(steps,self.startPeriodUs,self.runPeriodUs)
+
+    def dispenseSecs(self,ml,stepsPerML=None):
+        return profileDurationSecs(self.profileFor(self.stepsFor(ml,stepsPerML)))
+
+    def enable(self):
+        if not self.enabled:
+            self.backend.write(self.enablePin,0)
+            time.sleep(.0005)
+            self.enabled=True
+
+    def disable(self):
+        self.backend.write(self.enablePin,1)
+        self.enabled=False
+
+    def pump(self,ml,stepsPerML=None,debugLog=None):
+        #Negative ml pumps backwards.  Returns the secs the pulses took.
+        profile=self.profileFor(self.stepsFor(ml,stepsPerML))
+        if not debugLog is None:
+            debugLog.info('%s pump: %.3f ML, %d steps, %.2f secs' % (self.name,ml,profileSteps(profile),profileDurationSecs(profile)))
+        self.enable()
+        try:
+            self.backend.write(self.directionPin,0 if ml>0 else 1)
+            return self.backend.sendPulses(self.stepPin,profile)
+        finally:
+            self.disable()
+
+def legacyPulseLoop(gpio,stepPin,stepsToPump,stepDelay,RampUpTimeDelay):
+    #The sleep timed loop the pumps used before the pulse backends
+    stepCountThisPump=0
+    while stepCountThisPump<stepsToPump:
+        gpio.output(stepPin,gpio.HIGH)
+        time.sleep(stepDelay)
+        gpio.output(stepPin,gpio.LOW)
+        time.sleep(stepDelay)
+        stepCountThisPump+=1
+        if RampUpTimeDelay > 0.0001:
+            RampUpTimeDelay-=0.0001
+            time.sleep(RampUpTimeDelay)
+
+class edgeRecordingGPIO:
+    #Stands in for RPi.GPIO in the benchmark and records when each rising edge happened
+    OUT=0
+    LOW=0
+    HIGH=1
+
+    def __init__(self):
+        self.risingEdges=[]
+
+    def setup(self,pin,mode):
+        pass
+
+    def output(self,pin,level):
+        if level==self.HIGH:
+            self.risingEdges.append(time.perf_counter())
+
+def describeEdges(name,risingEdges,targetPeriodUs,targetSecs):
+    periodsUs=[(later-earlier)*1000000 for earlier,later in zip(risingEdges,risingEdges[1:])]
+    runPeriodsUs=periodsUs[len(periodsUs)//4:len(periodsUs)*3//4]
+    meanUs=sum(runPeriodsUs)/len(runPeriodsUs)
+    jitterUs=math.sqrt(sum((periodUs-meanUs)**2 for periodUs in runPeriodsUs)/len(runPeriodsUs))
+    print('%s: %d steps in %.2f secs (intended %.2f), run period %.1f us (intended %d), jitter %.1f us' % \
+        (name,len(risingEdges),risingEdges[-1]-risingEdges[0],targetSecs,meanUs,targetPeriodUs,jitterUs))
+
+def benchmarkPulseBackends(steps=13000,stepDelay=.000025,rampStartSecs=.005,runPeriodUs=200):
+    #One mL of the mixer reactor pump
+    gpio=edgeRecordingGPIO()
+    legacyPulseLoop(gpio,5,steps,stepDelay,rampStartSecs)
+    intendedPeriodUs=int(stepDelay*2*1000000)
+    describeEdges('Legacy sleep loop',gpio.risingEdges,intendedPeriodUs,steps*stepDelay*2+sum(rampStartSecs-.0001*step for step in range(1,50)))
+    profile=trapezoidalProfile(steps,rampStartSecs*1000000,runPeriodUs)
+    gpio=edgeRecordingGPIO()
+    gpioPulseBackend(gpio).sendPulses(5,profile)
+    describeEdges('GPIO backend',gpio.risingEdges,runPeriodUs,profileDurationSecs(profile))
+
+if __name__ == '__main__':
+    benchmarkPulseBackends()
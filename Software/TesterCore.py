@@ -16,11 +16,20 @@ import cv2   # @UnresolvedImport
 import numpy as np
 import math
 import time
+import concurrent.futures
 import os
-from adafruit_motorkit import MotorKit
 #import fisheye
 #from FishEyeWrapper import FishEye,load_model
 from ImageCheck import feature,colorSheet,swatch
+from ColorSensor import ColorSensor
+from PHSampler import PHSampler
+from GrblController import GrblController
+from Alarms import sendHomingAlarm
+from StepPulses import StepperPump
+from Hardware import createHardware
+from LogPipeline import LogPipeline,JsonFormatter
+from PhaseTrace import PhaseTrace,traced,tracedPhase
+from Metrics import MetricsRegistry,countQueries
 import sys
 import platform
 import datetime
@@ -32,15 +41,14 @@ import logging
 from logging.handlers import RotatingFileHandler
 import traceback
 import django
+from django.db import connections
+from django.db.backends.signals import connection_created
 from django.utils.timezone import activate
 from django.utils.dateparse import parse_datetime
 from django.utils import timezone
 import pytz
-import serial
 from colormath.color_objects import LabColor, AdobeRGBColor, sRGBColor
 from colormath.color_conversions import convert_color
-from DFRobot_ADS1115 import ADS1115
-from DFRobot_PH      import DFRobot_PH
 
 try:
 	from picamera.array import PiRGBArray   # @UnresolvedImport
@@ -51,12 +59,9 @@ except:
 currentVersion="0.04"
 
 if platform.system()=='Windows':
-	existsGPIO=False
 	existsDisplay=True
 	existsWebCam=True
 else:
-	import RPi.GPIO as GPIO   # @UnresolvedImport
-	existsGPIO=True
 	existsDisplay=False
 	existsI2C=True
 	existsWebCam=True
@@ -76,10 +81,6 @@ mainPumpEnableGPIO=6
 mainPumpStepGPIO=5
 mainPumpDirectionGPIO=11
 
-ads1115 = ADS1115()
-ph      = DFRobot_PH()
-
-PHsamplesBetweenTest = 5
 temperature	= 25.0
 
 class testSequence:
@@ -102,76 +103,63 @@ class Tester:
 		self.KHTester = True
 		self.LineTester = True
 		self.id = id
-		self.simulation=(platform.system()=='Windows')
 		self.basePath=getBasePath()
+		self.createMetrics()
 		self.webcam=None
 		self.lowResImageGenerator=None
 		self.measurementUnits=self.PRESENTATION_IMPERIAL
-		if existsGPIO:
-			GPIO.setmode(GPIO.BCM)
-			GPIO.setwarnings(False)
-			GPIO.setup(mainPumpEnableGPIO,GPIO.OUT)
-			GPIO.setup(mainPumpStepGPIO,GPIO.OUT)
-			GPIO.setup(mainPumpDirectionGPIO,GPIO.OUT)
-			GPIO.setup(KHSamplePumpEnableGPIO,GPIO.OUT)
-			GPIO.setup(KHSamplePumpStepGPIO,GPIO.OUT)
-			GPIO.setup(KHSamplePumpDirectionGPIO,GPIO.OUT)
-			GPIO.setup(KHReagentPumpEnableGPIO,GPIO.OUT)
-			GPIO.setup(KHReagentPumpStepGPIO,GPIO.OUT)
-			GPIO.setup(KHReagentPumpDirectionGPIO,GPIO.OUT)
-			GPIO.output(mainPumpEnableGPIO,GPIO.HIGH)
-			GPIO.output(mainPumpStepGPIO,GPIO.LOW)
-			GPIO.output(mainPumpDirectionGPIO,GPIO.LOW)
-			GPIO.output(KHSamplePumpEnableGPIO,GPIO.HIGH)
-			GPIO.output(KHSamplePumpStepGPIO,GPIO.LOW)
-			GPIO.output(KHSamplePumpDirectionGPIO,GPIO.LOW)
-			GPIO.output(KHReagentPumpEnableGPIO,GPIO.HIGH)
-			GPIO.output(KHReagentPumpStepGPIO,GPIO.LOW)
-			GPIO.output(KHReagentPumpDirectionGPIO,GPIO.LOW)
-
-		if self.KHTester is True:
-			self.pca60 = MotorKit(address=0x60)
-			self.pca60.motor2.throttle = 0
-			self.pca60.motor4.throttle = 0
-
-		if self.LineTester is True:
-			self.pca61 = MotorKit(address=0x61)
-			self.pca62 = MotorKit(address=0x62)
-			self.pca62.motor3.throttle = 1		#Close valve Tank Water
-			self.pca62.motor4.throttle = 1		#Close valve Osmose Water
-
 		self.ArduinoStepper=False
+		self.grbl=None
 		self.ArduinoSensor=False
+		self.colorSensor=None
+		self.latestMeasurement=None
+		self.latestMeasurementSaved=True
+		self.latestMeasurementSaveTime=0
+		self.lastTitrationTrace=[]
+		self.lastPHReading=None
+		self.testStepSecs=0
+		self.testStepSavedSecs=0
+		self.batchInProgress=False
+		self.batchResults=[]
+		self.batchStartTime=None
+		self.batchParkingsSkipped=0
+		self.phaseTrace=None
+		self.lastResultID=None
 		self.hommeArduinoStepper=False
 		self.loadTesterFromDB()
-		self.loadCalibrationValuesFromDB()
-		self.loadProcessingParametersFromDB()
-		self.loadStartupParametersFromDB()
-		self.loadReagentsFromDB()
+		#The files and the console are written from the log pipeline's thread, never from the thread that logged
+		self.logPipeline=LogPipeline()
+		jsonFormatter=JsonFormatter()
+		normalFormatter = logging.Formatter('%(asctime)s - %(threadName)s - %(levelname)s - %(message)s')
 		self.testerLog=logging.getLogger('TesterLog')
-		handler = RotatingFileHandler(self.basePath+ "Logs/tester.log", maxBytes=2000, backupCount=4)
-		simpleFormatter = logging.Formatter('%(asctime)s - %(message)s')
-		normalFormatter = logging.Formatter('%(asctime)s - %(threadName)s - %(message)s')
-		handler.setFormatter(simpleFormatter)
+		handler = RotatingFileHandler(self.basePath+ "Logs/tester.log", maxBytes=self.logMaxKB*1024, backupCount=self.logBackupCount)
+		handler.setFormatter(jsonFormatter)
 		handler.setLevel(logging.INFO)
-		self.testerLog.addHandler(handler)
+		self.logPipeline.attach(self.testerLog,[handler])
 		self.testerLog.setLevel(logging.INFO)
 		self.debugLog=logging.getLogger('Debug')
 		console = logging.StreamHandler()
 		console.setLevel(logging.DEBUG)
 		console.setFormatter(normalFormatter)
-		self.debugLog.addHandler(console)
-		handler2 = RotatingFileHandler(self.basePath+"Logs/debug.log", maxBytes=8000, backupCount=4)
-		handler2.setFormatter(normalFormatter)
+		handler2 = RotatingFileHandler(self.basePath+"Logs/debug.log", maxBytes=self.logMaxKB*1024, backupCount=self.logBackupCount)
+		handler2.setFormatter(jsonFormatter)
 		handler2.setLevel(logging.INFO)
-		self.debugLog.addHandler(handler2)
+		self.logPipeline.attach(self.debugLog,[console,handler2])
 		self.debugLog.setLevel(logging.DEBUG)
+		self.logPipeline.start()
+		self.hardware=createHardware(self.hardwareBackend,1/self.simulationSpeedup,self.debugLog)
+		self.simulation=self.hardware.simulated
+		self.initializeHardware()
+		self.loadCalibrationValuesFromDB()
+		self.loadProcessingParametersFromDB()
+		self.loadStartupParametersFromDB()
+		self.loadReagentsFromDB()
 		self.cameraType=self.getCameraType()
 		self.undistortImage=False
 		self.createDefaultBlackScreen()
 		self.getCameraModel()
-		self.videoLowResCaptureLock=None
-		self.latestLowResImage=None
+		self.frameBuffer=None
+		self.streamFanout=None
 		self.streamVideo=True
 		self.useImageForCalibration=False
 		self.cameraCompensationTransformationMatrix=None
@@ -184,9 +172,10 @@ class Tester:
 		self.currentAvgColor=np.array([0,0,0])
 		self.tooDark=False  
 		self.infoMessage('Tester Engine version ' + currentVersion + ' loaded') 
-		self.mainPumpEnabled=False
-		self.KHSamplePumpEnabled=False
-		self.KHReagentPumpEnabled=False
+		self.infoMessage('Hardware: ' + self.hardware.name + ('' if not self.simulation else ', running ' + str(self.simulationSpeedup) + ' times as fast'))
+		self.pulseBackend=self.hardware.createPulseBackend(self.pumpPulseBackend,self.debugLog)
+		self.debugMessage('Pump step pulses from the ' + self.pulseBackend.name + ' backend')
+		self.createPumps()
 		self.displayDot=False
 		self.avgGreenDotH=None
 		self.avgGreenDotS=None
@@ -221,6 +210,7 @@ class Tester:
 		self.showSwatches=False
 		self.colorTable=None
 		self.runTestLock=None
+		self.jobDispatcher=None
 		self.testStatus=None
 		self.currentTest=None
 		self.recordTestedImage=True
@@ -228,9 +218,40 @@ class Tester:
 		self.resetJobSchedule=False
 		self.diagnosticQueue=[]
 		self.diagnosticLock=None
+		self.jobScheduleChanged=None
 		self.systemStatus='Initializing'
 
 		
+	def initializeHardware(self):
+		#The pump pins are outputs with the drivers disabled, and the valves start closed
+		gpio=self.hardware.gpio
+		gpio.setmode(gpio.BCM)
+		gpio.setwarnings(False)
+		for enablePin,stepPin,directionPin in ((mainPumpEnableGPIO,mainPumpStepGPIO,mainPumpDirectionGPIO),
+				(KHSamplePumpEnableGPIO,KHSamplePumpStepGPIO,KHSamplePumpDirectionGPIO),
+				(KHReagentPumpEnableGPIO,KHReagentPumpStepGPIO,KHReagentPumpDirectionGPIO)):
+			gpio.setup(enablePin,gpio.OUT)
+			gpio.setup(stepPin,gpio.OUT)
+			gpio.setup(directionPin,gpio.OUT)
+			gpio.output(enablePin,gpio.HIGH)
+			gpio.output(stepPin,gpio.LOW)
+			gpio.output(directionPin,gpio.LOW)
+
+		if self.KHTester is True:
+			self.pca60 = self.hardware.motorKit(0x60)
+			self.pca60.motor2.throttle = 0
+			self.pca60.motor4.throttle = 0
+
+		if self.LineTester is True:
+			self.pca61 = self.hardware.motorKit(0x61)
+			self.pca62 = self.hardware.motorKit(0x62)
+			self.pca62.motor3.throttle = 1		#Close valve Tank Water
+			self.pca62.motor4.throttle = 1		#Close valve Osmose Water
+
+	def sleep(self,secs):
+		#Waits on the hardware, which are shorter when the hardware is simulated
+		self.hardware.sleep(secs)
+
 	def getCameraModel(self):
 		self.cameraModelFile=self.basePath + '/Calibrate/FisheyeUndistort-(' + self.lensType + ',' + str(self.cameraHeightLowRes) + ' x ' + str(self.cameraWidthLowRes) + ')-' + sys.version[0] + '.pkl'
 		try:
@@ -243,6 +264,35 @@ class Tester:
 			self.infoMessage('Camera Model Not Found')
 			self.cameraFisheyeExpansionFactor=self.defaultFisheyeExpansionFactor
 		
+	def createMetrics(self):
+		#Served at /metrics by the video streaming server.  The functions are read at scrape time, so they can refer to parts of the tester not created yet.
+		self.metrics=MetricsRegistry()
+		self.framesGrabbed=self.metrics.counter('autotester_frames_grabbed_total','Camera frames published to the frame buffer')
+		self.framesDropped=self.metrics.counter('autotester_frames_dropped_total','Camera frames dropped because every frame buffer slot was being read')
+		self.frameGrabFailures=self.metrics.counter('autotester_frame_grab_failures_total','Camera reads that returned no frame')
+		self.jpegEncodeSeconds=self.metrics.histogram('autotester_jpeg_encode_seconds','Time to draw the overlay on a stream frame and encode it as JPEG',
+			buckets=(.005,.01,.02,.03,.05,.075,.1,.15,.25,.5))
+		self.metrics.gauge('autotester_stream_viewers','Viewers connected to the MJPEG stream',function=lambda: self.streamFanout.activeViewers)
+		self.metrics.gauge('autotester_job_queue_depth','Test jobs waiting in the queue',function=lambda: self.jobDispatcher.queuedJobCount())
+		self.metrics.gauge('autotester_log_queue_depth','Log records waiting to be written',function=lambda: self.logPipeline.queue.qsize())
+		self.metrics.counter('autotester_log_records_dropped_total','Log records dropped because the log queue was full',function=lambda: self.logPipeline.droppedRecords())
+		self.testDurationSeconds=self.metrics.histogram('autotester_test_duration_seconds','How long a test took, from start to parked',labelNames=('test',),
+			buckets=(60,120,300,600,900,1200,1800,2400,3600,5400))
+		self.testsRun=self.metrics.counter('autotester_tests_total','Tests run by outcome',labelNames=('test','result'))
+		self.sensorReadSeconds=self.metrics.histogram('autotester_sensor_read_seconds','Time to read the color sensor or a settled pH',labelNames=('sensor',),
+			buckets=(.01,.025,.05,.1,.25,.5,1,2.5,5,10,30))
+		self.metrics.counter('autotester_serial_retries_total','Serial reads retried and GRBL resets',labelNames=('device',),
+			function=lambda: {('color sensor',):0 if self.colorSensor is None else self.colorSensor.retries,('grbl',):0 if self.grbl is None else self.grbl.resets})
+		self.dbQueries=self.metrics.counter('autotester_db_queries_total','Database queries made by the tester process',labelNames=('operation',))
+		#Each thread has its own database connection, so the counter is added to each as it connects
+		queryCounter=countQueries(self.dbQueries)
+		def addQueryCounter(sender,connection,**kwargs):
+			if not queryCounter in connection.execute_wrappers:
+				connection.execute_wrappers.append(queryCounter)
+		connection_created.connect(addQueryCounter,weak=False)
+		for existingConnection in connections.all():
+			addQueryCounter(None,existingConnection)
+
 	def debugMessage(self,message):
 		try:
 			if self.enableConsoleOutput:
@@ -256,6 +306,13 @@ class Tester:
 		except:  #Might not have initialized yet
 			print(message)
 			
+	def stopLogging(self):
+		#Called on the way out so the records still queued reach the files
+		self.logPipeline.stop()
+		dropped=self.logPipeline.droppedRecords()
+		if dropped>0:
+			print(str(dropped) + ' log records were dropped because the log queue was full')
+
 	def loadTesterFromDB(self):
 		from tester.models import TesterExternal
 		te=TesterExternal.objects.get(pk=1)
@@ -269,6 +326,19 @@ class Tester:
 		self.tooDarkThreshold=te.tooDarkThreshold
 		self.webPort=te.webPort
 		self.videoStreamingPort=te.videoStreamingPort
+		self.sensorBaudRate=te.sensorBaudRate
+		self.sensorBatchedMeasurement=te.sensorBatchedMeasurement
+		self.sensorResponseTimeoutSecs=te.sensorResponseTimeoutSecs
+		self.pumpPulseBackend=te.pumpPulseBackend
+		self.pumpMaxStepRate=te.pumpMaxStepRate
+		self.homingTimeoutSecs=te.homingTimeoutSecs
+		self.rehomeAfterMoves=te.rehomeAfterMoves
+		self.hardwareBackend=te.hardwareBackend
+		self.simulationSpeedup=te.simulationSpeedup
+		self.logMaxKB=te.logMaxKB
+		self.logBackupCount=te.logBackupCount
+		self.maxStreamViewers=te.maxStreamViewers
+		self.streamWriteTimeoutSecs=te.streamWriteTimeoutSecs
 		self.measurementUnits=te.measurementUnits
 		self.pumpPurgeTimeSeconds=te.pumpPurgeTimeSeconds
 		self.mixerCleanML=te.mixerCleanML
@@ -310,6 +380,22 @@ class Tester:
 		self.minImageRotationWithoutAdjustment=tpp.minImageRotationWithoutAdjustment
 		self.defaultFisheyeExpansionFactor=tpp.defaultFisheyeExpansionFactor
 		self.gapTolerance=tpp.gapTolerance
+		self.binaryMatchUseProjection=tpp.binaryMatchUseProjection
+		self.binaryMatchIncrements=tpp.binaryMatchIncrements
+		self.measurementSaveIntervalSecs=tpp.measurementSaveIntervalSecs
+		self.titrationAdaptive=tpp.titrationAdaptive
+		self.titrationMinStepML=tpp.titrationMinStepML
+		self.titrationMaxStepML=tpp.titrationMaxStepML
+		self.khPredictiveEndpoint=tpp.khPredictiveEndpoint
+		self.khMinDoseML=tpp.khMinDoseML
+		self.khMaxDoseML=tpp.khMaxDoseML
+		self.phSamplesPerSec=tpp.phSamplesPerSec
+		self.phMaxSampleSecs=tpp.phMaxSampleSecs
+		self.phEarlyStop=tpp.phEarlyStop
+		self.phMinSamples=tpp.phMinSamples
+		self.phStableTolerance=tpp.phStableTolerance
+		self.pipelineTestSteps=tpp.pipelineTestSteps
+		self.batchQueuedTests=tpp.batchQueuedTests
 		
 	def loadStartupParametersFromDB(self):
 		from tester.models import TesterStartupInfo
@@ -421,12 +507,14 @@ class Tester:
 				sw.swatchLRRow=swatchExternal.swatchLRRow
 				sw.swatchLRCol=swatchExternal.swatchLRCol
 				cs.swatchList[str(sw.swatchRow) + '/' + sw.lightingConditions]=sw
+			cs.compileMatchCandidates(self)
 		
 	def saveColorSheetIntoDB(self,colorSheetNameToDelete):
 		from tester.models import ColorSheetExternal,SwatchExternal,LightingConditionsExternal
 		ColorSheetExternal.objects.filter(colorSheetName=colorSheetNameToDelete).delete()
 		cse=ColorSheetExternal()
 		cs=self.colorSheetList[colorSheetNameToDelete]
+		cs.markContentsChanged()
 		cse.colorSheetName=cs.colorSheetName
 		cse.itemBeingMeasured=cs.itemBeingMeasured
 		cse.minPermissableValue=cs.minPermissableValue
@@ -475,6 +563,8 @@ class Tester:
 			sw.swatchLRRow=swatchExternal.swatchLRRow
 			sw.swatchLRCol=swatchExternal.swatchLRCol
 			cs.swatchList[str(sw.swatchRow) + '/' + sw.lightingConditions]=sw
+		cs.markContentsChanged()
+		cs.compileMatchCandidates(self)
 
 		self.currentColorSheet=cs
 	
@@ -484,11 +574,13 @@ class Tester:
 		else:
 			os.mkdir(self.basePath + '/tester/static/tester/resultstrips') 
 			   
+	@traced('save results','database')
 	def saveTestResults(self,results,swatchResultList=None):
 		try:
 			from tester.models import TestResultsExternal
 			tre=TestResultsExternal()
 			tre.testPerformed=self.currentTest
+			tre.simulated=self.simulation
 			if results is None:
 				tre.results=None
 				tre.status='Failed'
@@ -500,6 +592,7 @@ class Tester:
 			if not swatchResultList is None:
 				tre.swatchFile='Strip-' + whenPerformed.strftime("%Y-%m-%d %H-%M-%S") + '.jpg'
 			tre.save()
+			self.lastResultID=tre.pk
 			if swatchResultList is None:
 				return True
 			sw=swatchResultList[0]
@@ -540,11 +633,13 @@ class Tester:
 		cv2.putText(listStruct,text,(10,20), font, .7,(255,255,255),2,cv2.LINE_AA)
 		return listStruct
 	
+	@traced('save results','database')
 	def saveTestSaveBadResults(self):
 		try:
 			from tester.models import TestResultsExternal
 			tre=TestResultsExternal()
 			tre.testPerformed=self.currentTest
+			tre.simulated=self.simulation
 			whenPerformed=timezone.now()
 			tre.datetimePerformed=whenPerformed
 			if self.abortJob:
@@ -554,6 +649,7 @@ class Tester:
 			tre.results=None
 			tre.swatchFile='Strip-' + whenPerformed.strftime("%Y-%m-%d %H-%M-%S") + '.jpg'
 			tre.save()
+			self.lastResultID=tre.pk
 			errorStrip=self.failureList('Failure')
 			self.makeResultStripDirectory()
 			saveName=self.basePath + '/tester/static/tester/resultstrips/Strip-' + whenPerformed.strftime("%Y-%m-%d %H-%M-%S") + '.jpg'
@@ -577,20 +673,79 @@ class Tester:
 			traceback.print_exc()
 			return False
 		
+	def refreshReagents(self,slotNames):
+		#One query for all the slots, since the reagents page can change them while the tester runs
+		from tester.models import ReagentSetup
+		for rs in ReagentSetup.objects.filter(slotName__in=slotNames):
+			rg=self.reagentList.get(rs.slotName)
+			if rg is None:
+				rg=reagent(name=rs.slotName)
+				self.reagentList[rg.name]=rg
+			rg.hasAgitator=rs.hasAgitator
+			rg.fluidRemainingInML=rs.fluidRemainingInML
+			
+	def getReagent(self,slotName):
+		if not slotName in self.reagentList:
+			self.refreshReagents([slotName])
+		return self.reagentList[slotName]
+	
+	def getReagentSlotsForTest(self,ts):
+		if ts.KHtestwithPHProbe:
+			slotsUsed=[('KH Reagent',ts.titrationSlot)]
+		else:
+			slotsUsed=[('Reagent 1',ts.reagent1Slot),('Reagent 2',ts.reagent2Slot),('Reagent 3',ts.reagent3Slot),('Titration',ts.titrationSlot)]
+		return [(slotLabel,slotName) for slotLabel,slotName in slotsUsed if not slotName is None]
+		
+	def findShortReagents(self,ts,thresholdML):
+		#Returns (label,slot,ML remaining) for every slot the test uses that is below the threshold
+		slotsUsed=self.getReagentSlotsForTest(ts)
+		self.refreshReagents([slotName for slotLabel,slotName in slotsUsed])
+		shortReagents=[]
+		for slotLabel,slotName in slotsUsed:
+			remainingML=self.getReagent(slotName).fluidRemainingInML
+			if remainingML<thresholdML:
+				shortReagents.append((slotLabel,slotName,remainingML))
+		return shortReagents
+
+	def startTestTrace(self,testName):
+		self.phaseTrace=PhaseTrace(testName)
+		self.lastResultID=None
+
+	def tracePhase(self,name,category):
+		#Times part of the running test, does nothing between tests
+		return tracedPhase(self.phaseTrace,name,category)
+
+	def saveTestTrace(self):
+		#The trace goes with the results row the test saved, for the waterfall on the history page
+		trace=self.phaseTrace
+		self.phaseTrace=None
+		if trace is None:
+			return False
+		self.infoMessage('Time by phase: ' + trace.summary())
+		if self.lastResultID is None:
+			return False
+		try:
+			from tester.models import TestResultsExternal
+			TestResultsExternal.objects.filter(pk=self.lastResultID).update(timingTrace=trace.toJson())
+			return True
+		except:
+			self.debugLog.exception('Unable to save the timing trace')
+			return False
+
+	@traced('save reagent level','database')
 	def saveNewReagentValue(self,reagent,amountToDispense):
 		from tester.models import ReagentSetup
-		remainingML=ReagentSetup.objects.get(slotName=reagent).fluidRemainingInML-amountToDispense
-		reagentObj=ReagentSetup.objects.get(slotName=reagent)
-		self.lastReagentRemainingML=round(remainingML,2)
-		reagentObj.fluidRemainingInML=self.lastReagentRemainingML
-		reagentObj.save()
+		rg=self.getReagent(reagent)
+		self.lastReagentRemainingML=round(rg.fluidRemainingInML-amountToDispense,2)
+		rg.fluidRemainingInML=self.lastReagentRemainingML
+		ReagentSetup.objects.filter(slotName=reagent).update(fluidRemainingInML=self.lastReagentRemainingML)
 
 	def inReagentPosition(self,reagent):
-		from tester.models import ReagentSetup
-		if ReagentSetup.objects.get(slotName=reagent).hasAgitator:
-			self.tosyringetop=round(((self.maxPlungerDepthAgitator-ReagentSetup.objects.get(slotName=reagent).fluidRemainingInML)*int(-self.plungerStepsPerMM))+500,2)
+		rg=self.getReagent(reagent)
+		if rg.hasAgitator:
+			self.tosyringetop=round(((self.maxPlungerDepthAgitator-rg.fluidRemainingInML)*int(-self.plungerStepsPerMM))+500,2)
 		else:
-			self.tosyringetop=round(((self.maxPlungerDepthNoAgitator-ReagentSetup.objects.get(slotName=reagent).fluidRemainingInML)*int(-self.plungerStepsPerMM))+500,2)
+			self.tosyringetop=round(((self.maxPlungerDepthNoAgitator-rg.fluidRemainingInML)*int(-self.plungerStepsPerMM))+500,2)
 
 	def setCameraRotationMatrix(self,compensationDegrees,compensationScale,centerRow,centerCol):
 		self.cameraCompensationTransformationMatrix = cv2.getRotationMatrix2D((centerRow,centerCol),compensationDegrees,compensationScale)                
@@ -688,22 +843,25 @@ class Tester:
 			dst = self.cameraFisheyeModel.undistort(image, undistorted_size=(width, height),R=Rmat)
 			return dst
 
+	@traced('drain mixer','pump')
 	def mainDrainPump(self,sec):
 		self.pca61.motor2.throttle = 1
 		self.MainDrainPumpOn=True
-		time.sleep(sec)
+		self.sleep(sec)
 		self.pca61.motor2.throttle = 0
 		self.MainDrainPumpOn=False
 		return
 
+	@traced('osmose clean pump','pump')
 	def osmoseCleanPump(self,sec):
 		self.pca61.motor3.throttle = 1
 		self.cleanPumpOn=True
-		time.sleep(sec)
+		self.sleep(sec)
 		self.pca61.motor3.throttle = 0
 		self.cleanPumpOn=False
 		return
 
+	@traced('clean drain pump','pump')
 	def cleanDrainPump(self,sec):
 		if sec==0:
 			self.pca61.motor4.throttle = 1
@@ -712,7 +870,7 @@ class Tester:
 		else: 	
 			self.pca61.motor4.throttle = 1
 			self.cleanDrainPumpOn=True
-			time.sleep(sec)
+			self.sleep(sec)
 			self.pca61.motor4.throttle = 0
 			self.cleanDrainPumpOn=False
 			return
@@ -722,19 +880,20 @@ class Tester:
 		self.cleanDrainPumpOn=False
 		return
 
+	@traced('agitate','agitator')
 	def turnAgitator(self,sec):
 		if sec==0:
 			self.pca61.motor1.throttle = 0.3
-			time.sleep(0.1)
+			self.sleep(0.1)
 			self.pca61.motor1.throttle = 0.2
 			self.agitatorOn=True
 			return
 		else: 	
 			self.pca61.motor1.throttle = 0.3
 			self.agitatorOn=True
-			time.sleep(0.1)
+			self.sleep(0.1)
 			self.pca61.motor1.throttle = 0.2
-			time.sleep(sec)
+			self.sleep(sec)
 			self.pca61.motor1.throttle = 0
 			self.agitatorOn=False
 			return
@@ -744,199 +903,66 @@ class Tester:
 		self.agitatorOn=False
 		return
 
-	def calibrateAutoTesterPump(self):
-		RampUpTimeDelay = 0.005
-		self.pca62.motor3.throttle = 0		#Open valve Tank Water
-		self.pca62.motor4.throttle = 1		#Close valve Osmose Water
-		if not self.mainPumpEnabled:
-			GPIO.output(mainPumpEnableGPIO,GPIO.LOW)
-			time.sleep(.0005)
-			self.mainPumpEnabled=True
-
-		GPIO.output(mainPumpDirectionGPIO,GPIO.LOW)
-		stepCountThisPump=0
-		stepDelay=.0001
-		stepsToPump=5*self.pumpStepsAutotester
-		print (stepsToPump)
-
-		while stepCountThisPump<stepsToPump:
-			GPIO.output(mainPumpStepGPIO,GPIO.HIGH)
-			time.sleep(stepDelay)
-			GPIO.output(mainPumpStepGPIO,GPIO.LOW)
-			time.sleep(stepDelay)
-			stepCountThisPump+=1
-
-			if RampUpTimeDelay > 0.0001:
-				RampUpTimeDelay-=0.0001
-				time.sleep(RampUpTimeDelay)
-
-		self.mainPumpEnabled=False     
-		GPIO.output(mainPumpEnableGPIO,GPIO.HIGH)
+	def createPumps(self):
+		#Every dose passes the steps per ML, so a calibration reloaded from the database applies to the next dose
+		self.mainPump=StepperPump('Main',self.pulseBackend,mainPumpEnableGPIO,mainPumpStepGPIO,mainPumpDirectionGPIO,self.pumpStepsAutotester,.000025,.005,self.pumpMaxStepRate)
+		self.KHSamplePump=StepperPump('KH Sample',self.pulseBackend,KHSamplePumpEnableGPIO,KHSamplePumpStepGPIO,KHSamplePumpDirectionGPIO,self.pumpStepsKHSample,.00001,.01,self.pumpMaxStepRate)
+		self.KHReagentPump=StepperPump('KH Reagent',self.pulseBackend,KHReagentPumpEnableGPIO,KHReagentPumpStepGPIO,KHReagentPumpDirectionGPIO,self.pumpStepsKHReagent,.00002,.01,self.pumpMaxStepRate)
+		self.hardware.attachPumps(self.mainPump,self.KHSamplePump,self.KHReagentPump)
+
+	def openMainPumpValve(self,water):
+		if water=='tankwater':
+			self.pca62.motor3.throttle = 0		#Open valve Tank Water
+			self.pca62.motor4.throttle = 1		#Close valve Osmose Water
+		elif water=='osmosewater':
+			self.pca62.motor3.throttle = 1		#Close valve Tank Water
+			self.pca62.motor4.throttle = 0		#Open valve Osmose Water
+
+	def closeMainPumpValves(self):
 		self.pca62.motor3.throttle = 1		#Close valve Tank Water
 		self.pca62.motor4.throttle = 1		#Close valve Osmose Water
+
+	def calibrateAutoTesterPump(self):
+		self.openMainPumpValve('tankwater')
+		try:
+			self.mainPump.pump(5,stepsPerML=self.mainPumpStepsPerML('tankwater'),debugLog=self.debugLog)
+		finally:
+			self.closeMainPumpValves()
 		return True  
 
 	def calibrateKHSamplePump(self):
-		RampUpTimeDelay = 0.01
-		if not self.KHSamplePumpEnabled:
-			GPIO.output(KHSamplePumpEnableGPIO,GPIO.LOW)
-			time.sleep(.0005)
-			self.KHSamplePumpEnabled=True
-
-		GPIO.output(KHSamplePumpDirectionGPIO,GPIO.LOW)
-		stepCountThisPump=0
-		stepDelay=.00001
-		stepsToPump=50*self.pumpStepsKHSample
-		print (stepsToPump)
-
-		while stepCountThisPump<stepsToPump:
-			GPIO.output(KHSamplePumpStepGPIO,GPIO.HIGH)
-			time.sleep(stepDelay)
-			GPIO.output(KHSamplePumpStepGPIO,GPIO.LOW)
-			time.sleep(stepDelay)
-			stepCountThisPump+=1
-
-			if RampUpTimeDelay > 0.0001:
-				RampUpTimeDelay-=0.0001
-				time.sleep(RampUpTimeDelay)
-
-		self.KHSamplePumpEnabled=False     
-		GPIO.output(KHSamplePumpEnableGPIO,GPIO.HIGH)
+		self.KHSamplePump.pump(50,stepsPerML=self.pumpStepsKHSample,debugLog=self.debugLog)
 		return True
 
 	def calibrateKHReagentPump(self):
-		RampUpTimeDelay = 0.01
-		if not self.KHReagentPumpEnabled:
-			GPIO.output(KHReagentPumpEnableGPIO,GPIO.LOW)
-			time.sleep(.0005)
-			self.KHReagentPumpEnabled=True
-
-		GPIO.output(KHReagentPumpDirectionGPIO,GPIO.LOW)
-		stepCountThisPump=0
-		stepDelay=.00001
-		stepsToPump=15*self.pumpStepsKHReagent
-		print (stepsToPump)
-
-		while stepCountThisPump<stepsToPump:
-			GPIO.output(KHReagentPumpStepGPIO,GPIO.HIGH)
-			time.sleep(stepDelay)
-			GPIO.output(KHReagentPumpStepGPIO,GPIO.LOW)
-			time.sleep(stepDelay)
-			stepCountThisPump+=1
-
-			if RampUpTimeDelay > 0.0001:
-				RampUpTimeDelay-=0.0001
-				time.sleep(RampUpTimeDelay)
-
-		self.KHReagentPumpEnabled=False     
-		GPIO.output(KHReagentPumpEnableGPIO,GPIO.HIGH)
-
-
+		self.KHReagentPump.pump(15,stepsPerML=self.pumpStepsKHReagent,debugLog=self.debugLog)
 		return True  
 
+	def mainPumpStepsPerML(self,water):
+		#Osmose water goes through a different valve and needs fewer steps per ML
+		if water=='osmosewater':
+			return int((self.pumpStepsAutotester)/1.5)
+		return int(self.pumpStepsAutotester)
+
+	@traced('pump {0} ML of {1}','pump')
 	def MixerReactorPump(self,ml,water):
-		RampUpTimeDelay = 0.005
-		if water is 'tankwater':
-			self.pca62.motor3.throttle = 0		#Open valve Tank Water
-			self.pca62.motor4.throttle = 1		#Close valve Osmose Water
-			stepsfor1ml=int(self.pumpStepsAutotester)
-		elif water is 'osmosewater':
-			self.pca62.motor3.throttle = 1		#Close valve Tank Water
-			self.pca62.motor4.throttle = 0		#Open valve Osmose Water
-			stepsfor1ml=int((self.pumpStepsAutotester)/1.5)
-		if not self.mainPumpEnabled:
-			GPIO.output(mainPumpEnableGPIO,GPIO.LOW)
-			time.sleep(.0005)
-			self.mainPumpEnabled=True
-		if ml>0:
-			GPIO.output(mainPumpDirectionGPIO,GPIO.LOW)
-			stepIncrement=1
-		else:
-			GPIO.output(mainPumpDirectionGPIO,GPIO.HIGH)
-			stepIncrement=-1
-
-		stepCountThisPump=0
-		stepDelay=.000025
-
-		stepsToPump=ml*stepsfor1ml
-		print (stepsToPump)
-
-		while stepCountThisPump<stepsToPump:
-			GPIO.output(mainPumpStepGPIO,GPIO.HIGH)
-			time.sleep(stepDelay)
-			GPIO.output(mainPumpStepGPIO,GPIO.LOW)
-			time.sleep(stepDelay)
-			stepCountThisPump+=1
-
-			if RampUpTimeDelay > 0.0001:
-				RampUpTimeDelay-=0.0001
-				time.sleep(RampUpTimeDelay)
-  
-		GPIO.output(mainPumpEnableGPIO,GPIO.HIGH)
-		self.mainPumpEnabled=False
-		self.pca62.motor3.throttle = 1		#Close valve Tank Water
-		self.pca62.motor4.throttle = 1		#Close valve Osmose Water
+		self.openMainPumpValve(water)
+		try:
+			self.mainPump.pump(ml,stepsPerML=self.mainPumpStepsPerML(water),debugLog=self.debugLog)
+		finally:
+			self.closeMainPumpValves()
 		return True  
 
+	@traced('pump {0} ML of sample','pump')
 	def sampleWaterPumpCommand(self,ml):
-		RampUpTimeDelay = 0.01
-		if not self.KHSamplePumpEnabled:
-			GPIO.output(KHSamplePumpEnableGPIO,GPIO.LOW)
-			time.sleep(.0005)
-			self.KHSamplePumpEnabled=True
-		if ml>0:
-			GPIO.output(KHSamplePumpDirectionGPIO,GPIO.LOW)
-		else:
-			GPIO.output(KHSamplePumpDirectionGPIO,GPIO.HIGH)
-			ml*=-1
-
-		stepCountThisPump=0
-		stepDelay=.00001
-		stepsToPump=ml*self.pumpStepsKHSample
-		print (stepsToPump)	
-
-		while stepCountThisPump<stepsToPump:
-			GPIO.output(KHSamplePumpStepGPIO,GPIO.HIGH)
-			time.sleep(stepDelay)
-			GPIO.output(KHSamplePumpStepGPIO,GPIO.LOW)
-			time.sleep(stepDelay)
-			stepCountThisPump+=1
-
-			if RampUpTimeDelay > 0.0001:
-				RampUpTimeDelay-=0.0001
-				time.sleep(RampUpTimeDelay)
-
-		GPIO.output(KHSamplePumpEnableGPIO,GPIO.HIGH)
-		self.KHSamplePumpEnabled=False
+		self.KHSamplePump.pump(ml,stepsPerML=self.pumpStepsKHSample,debugLog=self.debugLog)
 		return True  
 
+	@traced('pump {0} ML of KH reagent','pump')
 	def reagentPumpCommand(self,ml):
-		RampUpTimeDelay = 0.01
-		if not self.KHReagentPumpEnabled:
-			GPIO.output(KHReagentPumpEnableGPIO,GPIO.LOW)
-			time.sleep(.0005)
-			self.KHReagentPumpEnabled=True
-		if ml>0:
-			GPIO.output(KHReagentPumpDirectionGPIO,GPIO.LOW)
-
-		stepCountThisPump=0
-		stepDelay=.00002
-		stepsToPump=ml*self.pumpStepsKHReagent
-		print (stepsToPump)
-
-		while stepCountThisPump<stepsToPump:
-			GPIO.output(KHReagentPumpStepGPIO,GPIO.HIGH)
-			time.sleep(stepDelay)
-			GPIO.output(KHReagentPumpStepGPIO,GPIO.LOW)
-			time.sleep(stepDelay)
-			stepCountThisPump+=1
-
-			if RampUpTimeDelay > 0.0001:
-				RampUpTimeDelay-=0.0001
-				time.sleep(RampUpTimeDelay)
-
-		GPIO.output(KHReagentPumpEnableGPIO,GPIO.HIGH)
-		self.KHReagentPumpEnabled=False
+		if ml<=0:
+			return True
+		self.KHReagentPump.pump(ml,stepsPerML=self.pumpStepsKHReagent,debugLog=self.debugLog)
 		return True  
 			                    
 	def getID(self):
@@ -946,42 +972,58 @@ class Tester:
 		print('Detection parameter settings:')
 	
 	def quit(self):
-		if self.simulation:
-			return
-		GPIO.cleanup()
+		self.hardware.close()
 		
 	def addJobToQueue(self,jobToQueue):
 		from tester.models import JobExternal,TestDefinition
 		newJob=JobExternal()
 		newJob.jobToRun=TestDefinition.objects.get(testName=jobToQueue)
 		newJob.save()
+		self.jobDispatcher.addJob(newJob.pk,newJob.timeStamp)
 	
-	def anyMoreJobs(self):
+	def loadJobQueueFromDB(self):
+		#Used at startup and when the web pages have changed the JobExternal table directly
 		from tester.models import JobExternal
-		jobsQueued=JobExternal.objects.filter(jobStatus='Queued')
-		for job in jobsQueued:
-			if job.timeStamp<=timezone.now():
-				return True
-		return False
+		jobsQueued=JobExternal.objects.filter(jobStatus='Queued').order_by('timeStamp').values_list('pk','timeStamp')
+		self.jobDispatcher.replaceJobs(list(jobsQueued))
+	
+	def anyMoreJobs(self):
+		return self.jobDispatcher.anyReadyJobs()
 	
 	def getNextJob(self):
 		from tester.models import JobExternal,TestResultsExternal
-		jobsQueued=JobExternal.objects.filter(jobStatus='Queued')
-		for job in jobsQueued:
-			if job.timeStamp<=timezone.now():
-				if not job.jobToRun.enableTest:
-					self.infoMessage('Job ' + job.jobToRun.testName + ' skipped since test disabled')
-					skippedTest=TestResultsExternal()
-					skippedTest.testPerformed=job.jobToRun.testName
-					skippedTest.status='Skipped'
-					skippedTest.datetimePerformed=timezone.now()
-					skippedTest.save()
-					job.delete()
-				else:
-					job.jobStatus='Running'
-					job.save()                
-					return job.jobToRun.testName
-		return None
+		while True:
+			jobID=self.jobDispatcher.popReadyJob()
+			if jobID is None:
+				return None
+			#Claimed with one conditional UPDATE, so the web page can not remove or start the job in between
+			if JobExternal.objects.filter(pk=jobID,jobStatus='Queued').update(jobStatus='Running')==0:
+				continue   #Removed from the web page since it was queued
+			try:
+				job=JobExternal.objects.select_related('jobToRun').get(pk=jobID)
+			except JobExternal.DoesNotExist:
+				continue
+			if not job.jobToRun.enableTest:
+				self.infoMessage('Job ' + job.jobToRun.testName + ' skipped since test disabled')
+				skippedTest=TestResultsExternal()
+				skippedTest.testPerformed=job.jobToRun.testName
+				skippedTest.status='Skipped'
+				skippedTest.datetimePerformed=timezone.now()
+				skippedTest.save()
+				job.delete()
+			else:
+				return job.jobToRun.testName
+
+	def peekNextTest(self):
+		#The test getNextJob would start next, without claiming its job
+		from tester.models import JobExternal
+		jobID=self.jobDispatcher.peekReadyJob()
+		if jobID is None:
+			return None
+		job=JobExternal.objects.select_related('jobToRun').filter(pk=jobID,jobStatus='Queued').first()
+		if job is None or not job.jobToRun.enableTest:
+			return None
+		return job.jobToRun
 
 	def clearRunningJobs(self):
 		from tester.models import JobExternal
@@ -1008,213 +1050,120 @@ class Tester:
 		return hourList
 
 	def connectArduinoStepper(self):
-		self.arduinostepper=serial.Serial('/dev/ttyUSB0', 9600, timeout=.1)
-		time.sleep(2)
+		self.arduinostepper=self.hardware.openStepperPort()
+		self.sleep(2)
+		self.grbl=GrblController(self.arduinostepper,debugLog=self.debugLog)
+		self.grbl.start()
 		self.ArduinoStepper=True
 		return
 
 	def connectArduinoSensor(self):
-		self.arduinosensor=serial.Serial('/dev/ttyACM0', 9600, timeout=.1)
-		time.sleep(2)
+		self.arduinosensor=self.hardware.openSensorPort(self.sensorBaudRate)
+		self.colorSensor=ColorSensor(self.arduinosensor,batchedMeasurement=self.sensorBatchedMeasurement,responseTimeoutSecs=self.sensorResponseTimeoutSecs,debugLog=self.debugLog)
+		self.sleep(2)
 		self.ArduinoSensor=True
 		self.arduinosensor.write(str.encode("[2, 10]" + '\n'))
-		time.sleep(0.2)
+		self.sleep(0.2)
 		self.arduinosensor.readline() 
-		time.sleep(0.2)
+		self.sleep(0.2)
 		self.arduinosensor.write(str.encode("[13]" + '\n')) # set CMD_SET_MODE_COLOR_SPECIFIC
-		time.sleep(0.2)
+		self.sleep(0.2)
 		self.arduinosensor.readline() 
-		time.sleep(0.2)
+		self.sleep(0.2)
 		return
 
-	def homingArduinoStepper(self):
-		self.arduinostepper.write(str.encode('$H' + '\n'))
-		while True:
-			if "error: Expected command letter" in str(self.arduinostepper.readline()): 
-				self.hommeArduinoStepper=True
-				break
-		else: 
-			print ('homing is calibrating')
-			time.sleep(2)
-		return
-
-	def XtoTargetReagent(self,TargetXas):
-		self.arduinostepper.write(str.encode('X' + str(TargetXas) + '\n'))
-		time.sleep(2)
-		while True: 
-			self.arduinostepper.write(str.encode("?" + '\n'))
-			self.arduinostepper.flushInput() 
-			time.sleep(0.2)
-			grbl_out = str(self.arduinostepper.readline()) 
-
-			grbl_out_strip = grbl_out.strip()
-			grbl_out_split = grbl_out_strip.split (',',4)
-
-			status, xas, yas, zas, unkown = grbl_out_split
-			statuscorrect = status.replace('<', '')
-			xascorrect = xas.replace('MPos:', '')
-
-			#print(statuscorrect)
-			#print(xascorrect)
-			#print(yas)
-			#print(zas)
-
-			if (round(float(xascorrect),2)) == float(TargetXas):
+	@traced('home carriage','motion')
+	def homingArduinoStepper(self,force=False):
+		#Only homes when the position from the last homing can not be trusted.  Returns False and sends an alarm if homing fails.
+		if force:
+			reason='requested'
+		else:
+			reason=self.grbl.homingNeeded(self.rehomeAfterMoves)
+			if reason is None:
+				self.debugMessage('Homing skipped, still homed with ' + str(self.grbl.movesSinceHoming) + ' moves since')
 				return True
+		self.debugMessage('Homing, ' + reason)
+		try:
+			#Done on ok or the stepper firmware's expected command letter reply, any other error such as homing disabled or locked raises GrblError
+			reply=self.grbl.home(self.homingTimeoutSecs)
+		except Exception as e:
+			if isinstance(e,concurrent.futures.TimeoutError):
+				failure='no answer after ' + str(self.homingTimeoutSecs) + ' secs'
+			else:
+				failure=str(e)
+			self.debugLog.error('Homing failed: ' + failure)
+			self.hommeArduinoStepper=False
+			sendHomingAlarm(self,failure)
+			return False
+		self.debugMessage('Homing reply: ' + reply)
+		self.hommeArduinoStepper=True
+		return True
 
-	def lowerSyringesInReagent(self):
-		self.arduinostepper.write(str.encode('Z55' + '\n'))
-		time.sleep(2)
-		while True: 
-			self.arduinostepper.write(str.encode("?" + '\n'))
-			self.arduinostepper.flushInput() 
-			time.sleep(0.2)
-			grbl_out = str(self.arduinostepper.readline()) 
-
-			grbl_out_strip = grbl_out.strip()
-			grbl_out_split = grbl_out_strip.split (',',4)
-
-			status, xas, yas, zas, unkown = grbl_out_split
-			
-			if float(zas) == float(55):
-				return True
+	def parkArduinoStepper(self):
+		#Parking only needs the carriage back at the home position, which plain moves do unless it has to be homed anyway
+		if not self.grbl.homingNeeded(self.rehomeAfterMoves) is None:
+			return self.homingArduinoStepper()
+		try:
+			self.UpperSyringes()
+			self.doseSyringesLiquid()
+			self.XtoTargetReagent(0)
+		except Exception:
+			self.debugLog.exception('Unable to move to the park position')
+			return self.homingArduinoStepper(force=True)
+		return True
 
-	def fillSyringes(self,amountToDispense):
-		self.arduinostepper.write(str.encode('Y' + str(int(amountToDispense*100)) + '\n'))
-		time.sleep(2)
-		while True: 
-			self.arduinostepper.write(str.encode("?" + '\n'))
-			self.arduinostepper.flushInput() 
-			time.sleep(0.2)
-			grbl_out = str(self.arduinostepper.readline()) 
+	@traced('move {0} to {1}','motion')
+	def moveArduinoStepper(self,axis,target):
+		#Blocks until GRBL reports Idle at the target, raises GrblError or TimeoutError if it can not get there
+		return self.grbl.move(axis,target)
 
-			grbl_out_strip = grbl_out.strip()
-			grbl_out_split = grbl_out_strip.split (',',4)
+	def XtoTargetReagent(self,TargetXas):
+		return self.moveArduinoStepper('X',TargetXas)
 
-			status, xas, yas, zas, unkown = grbl_out_split
+	def lowerSyringesInReagent(self):
+		return self.moveArduinoStepper('Z',55)
 
-			if (round(float(yas),1)) == int(amountToDispense*100):
-				return True
+	def fillSyringes(self,amountToDispense):
+		return self.moveArduinoStepper('Y',int(amountToDispense*100))
 
 	def UpperSyringes(self):
-		self.arduinostepper.write(str.encode('Z0' + '\n'))
-		time.sleep(2)
-		while True: 
-			self.arduinostepper.write(str.encode("?" + '\n'))
-			self.arduinostepper.flushInput() 
-			time.sleep(0.2)
-			grbl_out = str(self.arduinostepper.readline()) 
-
-			grbl_out_strip = grbl_out.strip()
-			grbl_out_split = grbl_out_strip.split (',',4)
-
-			status, xas, yas, zas, unkown = grbl_out_split
-			
-			if float(zas) == float(0):
-				return True      
+		return self.moveArduinoStepper('Z',0)
 
 	def doseSyringesLiquid(self):
-		self.arduinostepper.write(str.encode('Y0' + '\n'))
-		time.sleep(2)
-		while True: 
-			self.arduinostepper.write(str.encode("?" + '\n'))
-			self.arduinostepper.flushInput() 
-			time.sleep(0.2)
-			grbl_out = str(self.arduinostepper.readline()) 
-
-			grbl_out_strip = grbl_out.strip()
-			grbl_out_split = grbl_out_strip.split (',',4)
-
-			status, xas, yas, zas, unkown = grbl_out_split
-			
-			if float(yas) == float(0):
-				return True
+		return self.moveArduinoStepper('Y',0)
 
 	def lowerSyringesInMixerreactor(self):
-		self.arduinostepper.write(str.encode('Z40' + '\n'))
-		time.sleep(2)
-		while True: 
-			self.arduinostepper.write(str.encode("?" + '\n'))
-			self.arduinostepper.flushInput() 
-			time.sleep(0.2)
-			grbl_out = str(self.arduinostepper.readline()) 
-
-			grbl_out_strip = grbl_out.strip()
-			grbl_out_split = grbl_out_strip.split (',',4)
-
-			status, xas, yas, zas, unkown = grbl_out_split
-			
-			if float(zas) == float(40):
-				return True
+		return self.moveArduinoStepper('Z',40)
 
 	def lowerSyringesInReagentForReturnLiquid(self):
-		self.arduinostepper.write(str.encode('Z15' + '\n'))
-		time.sleep(2)
-		while True: 
-			self.arduinostepper.write(str.encode("?" + '\n'))
-			self.arduinostepper.flushInput() 
-			time.sleep(0.2)
-			grbl_out = str(self.arduinostepper.readline()) 
-
-			grbl_out_strip = grbl_out.strip()
-			grbl_out_split = grbl_out_strip.split (',',4)
-
-			status, xas, yas, zas, unkown = grbl_out_split
-			
-			if float(zas) == float(15):
-				return True
+		return self.moveArduinoStepper('Z',15)
 
 	def lowerSyringesInCleanreactor(self):
-		self.arduinostepper.write(str.encode('Z45' + '\n'))
-		time.sleep(2)
-		while True: 
-			self.arduinostepper.write(str.encode("?" + '\n'))
-			self.arduinostepper.flushInput() 
-			time.sleep(0.2)
-			grbl_out = str(self.arduinostepper.readline()) 
-
-			grbl_out_strip = grbl_out.strip()
-			grbl_out_split = grbl_out_strip.split (',',4)
-
-			status, xas, yas, zas, unkown = grbl_out_split
-			
-			if float(zas) == float(45):
-				return True
+		return self.moveArduinoStepper('Z',45)
 
+	@traced('calibrate color sensor','sensor')
 	def calibrateArduinoSensor(self):
 		self.arduinosensor.write(str.encode("[5]" + '\n')) # Calibrate Red
-		time.sleep(0.1)
+		self.sleep(0.1)
 		self.arduinosensor.readline()
-		time.sleep(0.2)
+		self.sleep(0.2)
 		self.arduinosensor.write(str.encode("[6]" + '\n')) # Calibrate Green
-		time.sleep(0.1)
+		self.sleep(0.1)
 		self.arduinosensor.readline()
-		time.sleep(0.2)
+		self.sleep(0.2)
 		self.arduinosensor.write(str.encode("[7]" + '\n')) # Calibrate Blue
-		time.sleep(0.1)
+		self.sleep(0.1)
 		self.arduinosensor.readline()
-		time.sleep(0.2)
+		self.sleep(0.2)
 		self.arduinosensor.write(str.encode("[8]" + '\n')) # Calibrate White
-		time.sleep(0.1)
+		self.sleep(0.1)
 		self.arduinosensor.readline()
 		return
 
+	@traced('read color sensor','sensor')
 	def measureArduinoSensor(self):
-		self.arduinosensor.write(str.encode("[9]" + '\n')) #Measure Red
-		time.sleep(0.1)
-		Rarduinovalue=self.arduinosensor.readline()
-		time.sleep(0.2)
-		self.arduinosensor.write(str.encode("[10]" + '\n')) #Measure Green
-		time.sleep(0.1)
-		Garduinovalue=self.arduinosensor.readline()
-		time.sleep(0.2)
-		self.arduinosensor.write(str.encode("[11]" + '\n')) #Measure Blue
-		time.sleep(0.1)
-		Barduinovalue=self.arduinosensor.readline()
-
-		Rvalue = float(Rarduinovalue[-16:-3])
-		Gvalue = float(Garduinovalue[-16:-3])
-		Bvalue = float(Barduinovalue[-16:-3])
+		with self.sensorReadSeconds.time(sensor='color'):
+			Rvalue,Gvalue,Bvalue=self.colorSensor.measureRGB()
 
 		if (Rvalue > 1):
 			Rvalue=1
@@ -1240,21 +1189,24 @@ class Tester:
 		rgb=sRGBColor(Rvalue1,Gvalue1,Bvalue1)
 		lab = convert_color(rgb, LabColor)
 
-		from tester.models import MeasuredParameters
-		MeasureInfoFromDB=MeasuredParameters.objects.get(pk=1)
-		MeasureInfoFromDB.R=R255
-		MeasureInfoFromDB.G=G255
-		MeasureInfoFromDB.B=B255
-		MeasureInfoFromDB.abR=Rvalue
-		MeasureInfoFromDB.abG=Gvalue
-		MeasureInfoFromDB.abB=Bvalue
-		MeasureInfoFromDB.labL=lab.lab_l
-		MeasureInfoFromDB.labA=lab.lab_a
-		MeasureInfoFromDB.labB=lab.lab_b
-		MeasureInfoFromDB.save()
+		self.latestMeasurement={'R':int(R255),'G':int(G255),'B':int(B255),'abR':Rvalue,'abG':Gvalue,'abB':Bvalue,'labL':lab.lab_l,'labA':lab.lab_a,'labB':lab.lab_b}
+		self.latestMeasurementSaved=False
+		self.saveMeasurementIfDue()
 
 		return lab.lab_l,lab.lab_a,lab.lab_b,bgr255,Rvalue,Gvalue,Bvalue
 
+	def saveMeasurementIfDue(self,force=False):
+		#The control page reads latestMeasurement over rpyc, so the database copy only needs to be written now and then
+		if self.latestMeasurement is None or self.latestMeasurementSaved:
+			return
+		if not force and time.time()-self.latestMeasurementSaveTime<self.measurementSaveIntervalSecs:
+			return
+		from tester.models import MeasuredParameters
+		with tracedPhase(self.phaseTrace,'save measurement','database'):
+			MeasuredParameters.objects.filter(pk=1).update(**self.latestMeasurement)
+		self.latestMeasurementSaved=True
+		self.latestMeasurementSaveTime=time.time()
+
 	def calculateLastTest(self):
 		from tester.models import TestResultsExternal
 		lastTestResult=TestResultsExternal.objects.last()
@@ -1273,12 +1225,12 @@ class Tester:
 
 	def drainPumpCommand(self,sec):
 		self.pca60.motor1.throttle = 1
-		time.sleep(sec)
+		self.sleep(sec)
 		self.pca60.motor1.throttle = 0
 
 	def mixerJarMotorCommand(self,sec):
 		self.pca60.motor4.throttle = 0.5
-		time.sleep(sec)
+		self.sleep(sec)
 		self.pca60.motor4.throttle = 0
 
 	def mixerJarMotorCommandManual(self,speed):
@@ -1286,31 +1238,30 @@ class Tester:
 
 	def mixerReagentBottleMotorCommand(self,sec):
 		self.pca60.motor2.throttle = 0.5
-		time.sleep(sec)
+		self.sleep(sec)
 		self.pca60.motor2.throttle = 0
 
+	@traced('read pH','sensor')
 	def read_ph(self):
 		temperature=25
-		ads1115.setAddr_ADS1115(0x4A)
-		ads1115.setGain(0x00)
-		ph.begin()
-		PHTOTAL = 0
-		stepx=0
-		while stepx < PHsamplesBetweenTest:
-			time.sleep(1)
-			adc0 = ads1115.readVoltage(0)
-			PHTOTAL+=ph.readPH(adc0['r'],temperature)
-			stepx+=1
-		phresult=round(PHTOTAL/PHsamplesBetweenTest,2)
-		return phresult
+		probe=self.hardware.phProbe
+		probe.begin()
+		sampler=PHSampler(lambda: probe.readPH(temperature),samplesPerSec=self.phSamplesPerSec,maxSampleSecs=self.phMaxSampleSecs,earlyStop=self.phEarlyStop,
+				minSamples=self.phMinSamples,stableTolerance=self.phStableTolerance,sleep=self.sleep)
+		with self.sensorReadSeconds.time(sensor='ph'):
+			reading=sampler.sample()
+		self.lastPHReading=reading
+		if not reading['stable']:
+			message='PH reading ' + str(reading['ph']) + ' is not stable, spread ' + str(round(reading['spread'],3)) + ' over ' + str(reading['samples']) + ' samples'
+			#Without early stop every read runs to the cap, so only a sampler that gave up waiting for the probe to settle is worth an info line
+			if self.phEarlyStop:
+				self.infoMessage(message)
+			else:
+				self.debugMessage(message)
+		return reading['ph']
 
 	def calibratePH(self):
-		ph.begin()
-		ads1115.setAddr_ADS1115(0x4A)
-		ads1115.setGain(0x00)
-		adc0 = ads1115.readVoltage(0)
-		print ("A0:%dmV "%(adc0['r']))
-		ph.calibration(adc0['r'])
+		self.hardware.phProbe.calibrate()
 
 
 	def calculateCalibrationValues(self):
@@ -0,0 +1,268 @@
+'''
+AutoTester is the controlling software to automatically run water tests
+Further info can be found at: https://robogardens.com/?p=928
+This software is free for DIY, Nonprofit, and educational uses.
+Copyright (C) 2017 - RoboGardens.com
+
+Created on Oct 18, 2026
+
+This module decides how much to dose between color reads during a titration.  The linear mode
+doses the minimum step every time.  The adaptive mode doses large steps while the color is still
+far from the transition and halves the predicted remaining dose on each step as it closes in.
+A dose can not be taken back, so when a step crosses the transition the endpoint is placed
+inside that last step by interpolating the two readings either side of it.
+The KH test titrates on pH instead of color.  Its predictor fits the last two pH readings to the
+bicarbonate buffer curve, pH = C + log10(Veq - volume), to predict the volume at the 4.5 endpoint
+and doses a fraction of what is left, so most of the slow region is covered in a few doses.
+'''
+
+import math
+import random
+
+class titrationStepper:
+    def __init__(self,adaptive=False,minStepML=.01,maxStepML=.05,approachFraction=.5):
+        self.adaptive=adaptive
+        self.minStepML=minStepML
+        self.maxStepML=maxStepML
+        self.approachFraction=approachFraction
+        self.previousDispense=None
+        self.previousProgress=None
+        self.lastDispense=None
+        self.lastProgress=None
+
+    def recordObservation(self,dispenseCount,progress):
+        self.previousDispense=self.lastDispense
+        self.previousProgress=self.lastProgress
+        self.lastDispense=dispenseCount
+        self.lastProgress=progress
+
+    def nextStep(self,targetProgress,remainingML):
+        if not self.adaptive:
+            return self.minStepML
+        remainingProgress=targetProgress-self.lastProgress
+        slope=None
+        if not self.previousDispense is None and self.lastDispense>self.previousDispense:
+            slope=(self.lastProgress-self.previousProgress)/(self.lastDispense-self.previousDispense)
+        if slope is None or slope<=0:
+            #No color change seen yet, so there is nothing to predict from
+            if remainingProgress>.5*targetProgress:
+                step=self.maxStepML
+            else:
+                step=self.minStepML
+        else:
+            step=self.approachFraction*remainingProgress/slope
+        step=min(max(step,self.minStepML),self.maxStepML)
+        if remainingML>self.minStepML:
+            step=min(step,remainingML)
+        return step
+
+    def endpoint(self,targetProgress):
+        #Dose at which the transition was crossed
+        if not self.adaptive or self.previousDispense is None or self.lastProgress<=self.previousProgress:
+            return self.lastDispense
+        fraction=(targetProgress-self.previousProgress)/(self.lastProgress-self.previousProgress)
+        fraction=min(max(fraction,0),1)
+        return self.previousDispense+fraction*(self.lastDispense-self.previousDispense)
+
+class phEndpointPredictor:
+    def __init__(self,endpointPH=4.5,slowStartPH=6,minDoseML=.05,maxDoseML=.5,approachFraction=.5):
+        self.endpointPH=endpointPH
+        self.slowStartPH=slowStartPH
+        self.minDoseML=minDoseML
+        self.maxDoseML=maxDoseML
+        self.approachFraction=approachFraction
+        self.points=[]
+
+    def recordObservation(self,volumeML,ph):
+        self.points.append((volumeML,ph))
+
+    def predictEndpointVolume(self):
+        #Solves the log curve through the last two points for Veq, then steps back to the endpoint pH
+        if len(self.points)<2:
+            return None
+        previousVolume,previousPH=self.points[-2]
+        lastVolume,lastPH=self.points[-1]
+        if lastVolume<=previousVolume or lastPH>=previousPH:
+            return None
+        ratio=10**(previousPH-lastPH)
+        equivalenceVolume=(ratio*lastVolume-previousVolume)/(ratio-1)
+        return equivalenceVolume-(equivalenceVolume-lastVolume)*10**(self.endpointPH-lastPH)
+
+    def nextDose(self,remainingML):
+        lastVolume,lastPH=self.points[-1]
+        if lastPH>self.slowStartPH:
+            #Above the buffer region the curve does not follow the fit, so dose at full speed
+            dose=self.maxDoseML
+        else:
+            predictedVolume=self.predictEndpointVolume()
+            if predictedVolume is None:
+                #pH did not drop over the last dose (probe noise), so there is nothing to predict from
+                dose=self.minDoseML
+            else:
+                dose=self.approachFraction*(predictedVolume-lastVolume)
+        dose=min(max(dose,self.minDoseML),self.maxDoseML)
+        if remainingML>self.minDoseML:
+            dose=min(dose,remainingML)
+        return dose
+
+    def endpoint(self):
+        #Volume at which the endpoint pH was crossed, interpolated within the last dose
+        lastVolume,lastPH=self.points[-1]
+        if len(self.points)<2:
+            return lastVolume
+        previousVolume,previousPH=self.points[-2]
+        if previousPH<=self.endpointPH or previousPH<=lastPH:
+            return lastVolume
+        fraction=(previousPH-self.endpointPH)/(previousPH-lastPH)
+        fraction=min(max(fraction,0),1)
+        return previousVolume+fraction*(lastVolume-previousVolume)
+
+class simulatedTitrationChemistry:
+    #Color progress follows a logistic curve around the true endpoint, plus sensor noise
+    def __init__(self,endpointML,transitionWidthML=.03,noise=.01,seed=None):
+        self.endpointML=endpointML
+        self.transitionWidthML=transitionWidthML
+        self.noise=noise
+        self.rng=random.Random(seed)
+
+    def progressAt(self,dispenseCount):
+        progress=1/(1+math.exp(-(dispenseCount-self.endpointML)/self.transitionWidthML*4))
+        return min(max(progress+self.rng.gauss(0,self.noise),0),1)
+
+def simulateTitration(chemistry,stepper,targetProgress=.5,maxDispenseML=1,secsPerRead=11.2):
+    #Same loop shape as runTitration: read, check for the transition, then dose the next step
+    dispenseCount=0
+    reads=0
+    while dispenseCount<=maxDispenseML:
+        progress=chemistry.progressAt(dispenseCount)
+        reads+=1
+        stepper.recordObservation(dispenseCount,progress)
+        if progress>=targetProgress:
+            return stepper.endpoint(targetProgress),reads,reads*secsPerRead
+        dispenseCount+=stepper.nextStep(targetProgress,maxDispenseML-dispenseCount)
+    return None,reads,reads*secsPerRead
+
+def compareTitrationModes(runs=200,seed=1):
+    #secsPerRead is the default 10 s mixer agitation, the 0.5 s settle and a legacy color read
+    for adaptive in (False,True):
+        totalReads=0
+        totalSecs=0
+        errors=[]
+        failures=0
+        runRng=random.Random(seed)
+        for run in range(runs):
+            endpointML=runRng.uniform(.1,.9)
+            chemistry=simulatedTitrationChemistry(endpointML,transitionWidthML=runRng.uniform(.02,.1),seed=runRng.random())
+            result,reads,secs=simulateTitration(chemistry,titrationStepper(adaptive=adaptive))
+            totalReads+=reads
+            totalSecs+=secs
+            if result is None:
+                failures+=1
+            else:
+                errors.append(abs(result-endpointML))
+        meanError=sum(errors)/max(len(errors),1)
+        print(('Adaptive' if adaptive else 'Linear') + ': %.1f reads/test, %.0f secs/test, mean endpoint error %.4f ML, max %.4f ML, %d missed' % \
+            (totalReads/runs,totalSecs/runs,meanError,max(errors),failures))
+
+class simulatedKHChemistry:
+    #Strong acid into a bicarbonate sample.  pH is solved from the charge balance, ignoring carbonate and hydroxide.
+    def __init__(self,khDegrees,sampleML=50,acidNormality=.05,startPH=8.0,noise=.02,seed=None):
+        self.alkalinity=khDegrees/2.8/1000
+        self.sampleML=sampleML
+        self.acidNormality=acidNormality
+        self.ka1=10**-6.35
+        self.totalCarbon=self.alkalinity*(10**-startPH+self.ka1)/self.ka1
+        self.noise=noise
+        self.rng=random.Random(seed)
+
+    def exactPHAt(self,volumeML):
+        totalML=self.sampleML+volumeML
+        def chargeImbalance(ph):
+            hydrogen=10**-ph
+            bicarbonate=self.totalCarbon*self.ka1/(hydrogen+self.ka1)
+            return (self.alkalinity*self.sampleML-bicarbonate*self.sampleML-self.acidNormality*volumeML)/totalML+hydrogen
+        lowPH=1.0
+        highPH=10.0
+        for i in range(50):
+            midPH=(lowPH+highPH)/2
+            if chargeImbalance(midPH)>0:
+                lowPH=midPH
+            else:
+                highPH=midPH
+        return (lowPH+highPH)/2
+
+    def phAt(self,volumeML):
+        #read_ph rounds to two places
+        return round(self.exactPHAt(volumeML)+self.rng.gauss(0,self.noise),2)
+
+    def volumeAtPH(self,ph):
+        lowML=0
+        highML=100
+        for i in range(50):
+            midML=(lowML+highML)/2
+            if self.exactPHAt(midML)>ph:
+                lowML=midML
+            else:
+                highML=midML
+        return (lowML+highML)/2
+
+def simulateLegacyKHTest(chemistry,firstSkipML=.5,maxAmountML=15,slowStartPH=6,endpointPH=4.5,fastDoseML=.5,slowDoseML=.05):
+    #Same loop as runKHTest without the predictor, including its habit of a fast and a slow dose in one pass
+    ph=chemistry.phAt(0)
+    reads=1
+    doseTotal=firstSkipML
+    while doseTotal<=maxAmountML:
+        if ph>slowStartPH:
+            doseTotal+=fastDoseML
+            ph=chemistry.phAt(doseTotal)
+            reads+=1
+        if ph<=slowStartPH:
+            doseTotal+=slowDoseML
+            ph=chemistry.phAt(doseTotal)
+            reads+=1
+            if ph<=endpointPH:
+                return doseTotal,doseTotal,reads
+    return None,doseTotal,reads
+
+def simulatePredictiveKHTest(chemistry,predictor,firstSkipML=.5,maxAmountML=15):
+    ph=chemistry.phAt(0)
+    reads=1
+    predictor.recordObservation(0,ph)
+    doseTotal=firstSkipML
+    while doseTotal<maxAmountML:
+        doseTotal+=predictor.nextDose(maxAmountML-doseTotal)
+        ph=chemistry.phAt(doseTotal)
+        reads+=1
+        predictor.recordObservation(doseTotal,ph)
+        if ph<=predictor.endpointPH:
+            return predictor.endpoint(),doseTotal,reads
+    return None,doseTotal,reads
+
+def compareKHModes(runs=200,seed=1,secsPerRead=5):
+    #secsPerRead is read_ph sampling for the default phMaxSampleSecs
+    for predictive in (False,True):
+        totalReads=0
+        totalDosed=0
+        errors=[]
+        failures=0
+        runRng=random.Random(seed)
+        for run in range(runs):
+            chemistry=simulatedKHChemistry(runRng.uniform(3,12),startPH=runRng.uniform(7.5,8.4),seed=runRng.random())
+            endpointML=chemistry.volumeAtPH(4.5)
+            if predictive:
+                result,dosed,reads=simulatePredictiveKHTest(chemistry,phEndpointPredictor())
+            else:
+                result,dosed,reads=simulateLegacyKHTest(chemistry)
+            totalReads+=reads
+            totalDosed+=dosed
+            if result is None:
+                failures+=1
+            else:
+                errors.append(abs(result-endpointML))
+        meanError=sum(errors)/max(len(errors),1)
+        print(('Predictive' if predictive else 'Legacy') + ' KH: %.1f pH reads/test, %.0f secs/test, %.3f ML dosed/test, mean endpoint error %.4f ML, max %.4f ML, %d missed' % \
+            (totalReads/runs,totalReads*secsPerRead/runs,totalDosed/runs,meanError,max(errors),failures))
+
+if __name__ == '__main__':
+    compareTitrationModes()
+    compareKHModes()
@@ -63,17 +63,18 @@ def updateSwatch(tester,image,swatchRow,colorSheetName,newValue):
 def saveSwatch(tester,swatchRow,newValue):
     cs=tester.currentColorSheet
     colorSheetName=cs.colorSheetName
-    tester.videoLowResCaptureLock.acquire()
-    tester.videoLowResCaptureLock.wait()
-    imageCopy=tester.latestLowResImage.copy()
-    tester.videoLowResCaptureLock.release()
-    swatch=updateSwatch(tester,imageCopy,swatchRow,colorSheetName,newValue)
+    frameSequence,frame,frameSlot=tester.frameBuffer.acquireFrame()
+    try:
+        swatch=updateSwatch(tester,frame,swatchRow,colorSheetName,newValue)
+    finally:
+        tester.frameBuffer.releaseFrame(frameSlot)
+    cs.markContentsChanged()
     try:
         print(colorSheetName)
         tester.saveColorSheetIntoDB(colorSheetName)
     except:
         tester.debugLog.exception("Unable to Save Swatch to Database")
-    tester.colorTable=tester.currentColorSheet.generateColorTableDisplay(tester)
+    tester.colorTable=tester.currentColorSheet
     print('Database updated with new Swatch')
 
 def saveSet(tester,valueString):
@@ -90,22 +91,23 @@ def saveSet(tester,valueString):
         cs=colorSheet(colorSheetName)
         tester.colorSheetList[colorSheetName]=cs
     cs.itemBeingMeasured=colorSheetItem
-    tester.videoLowResCaptureLock.acquire()
-    tester.videoLowResCaptureLock.wait()
-    imageCopy=tester.latestLowResImage.copy()
-    tester.videoLowResCaptureLock.release()
-    i=1
-    while i<=9:
-        swatch=updateSwatch(tester,imageCopy,i,colorSheetName,colorSheetLighting,csParts)
-        if not swatch is None:
-            cs.swatchList[str(i) + '/' + colorSheetLighting]=swatch
-        i+=1
+    frameSequence,frame,frameSlot=tester.frameBuffer.acquireFrame()
+    try:
+        i=1
+        while i<=9:
+            swatch=updateSwatch(tester,frame,i,colorSheetName,'')
+            if not swatch is None:
+                cs.swatchList[str(i) + '/' + colorSheetLighting]=swatch
+            i+=1
+    finally:
+        tester.frameBuffer.releaseFrame(frameSlot)
+    cs.markContentsChanged()
     try:
 #        print(colorSheetName)
         tester.saveColorSheetIntoDB(colorSheetName)
     except:
         tester.debugLog.exception("Unable to Save Cloned ColorString to Database")
-    tester.colorTable=tester.currentColorSheet.generateColorTableDisplay(tester)
+    tester.colorTable=tester.currentColorSheet
     print('Database updated with cloned swatches')
 
 def parseHome(tester,cmdOperation,cmdObject,cmdValue):
@@ -136,7 +138,7 @@ def parseControl(tester,cmdOperation,cmdObject,cmdValue):
         elif cmdOperation=='Fill5MLOsmoseWater':
             tester.MixerReactorPump(5,'osmosewater')
         elif cmdOperation=='HomeSyringe':
-            tester.homingArduinoStepper()
+            tester.homingArduinoStepper(force=True)
         elif cmdOperation=='UpSyringe':
             tester.UpperSyringes()
         elif cmdOperation=='MainDrainPump':
@@ -178,6 +180,7 @@ def parseCalibrate(tester,cmdOperation,cmdObject,cmdValue):
 def queueDiagnosticTest(tester,cmdOperation,cmdObject):
     tester.diagnosticLock.acquire()
     tester.diagnosticQueue.append([cmdOperation,cmdObject])
+    tester.diagnosticLock.notify()
     tester.diagnosticLock.release()
 
 def parseDiagnostics(tester,cmdOperation,cmdObject,cmdValue):
@@ -255,6 +258,7 @@ def parseSchedule(tester,cmdOperation,cmdObject,cmdValue):
     try:
         if cmdOperation=='reloadSchedules':
             tester.resetJobSchedule=True
+            tester.jobScheduleChanged.set()
         else:
             print('Unknown SCHEDULE operation: ' + cmdOperation)                               
     except:
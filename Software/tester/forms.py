@@ -87,6 +87,32 @@ class TesterForm(forms.ModelForm):
             self.fields['webPort'].widget.attrs['title'] = "Port that the WebServer Listens On, Must be >1000"
             self.fields['videoStreamingPort'].label="Video Streaming Port"
             self.fields['videoStreamingPort'].widget.attrs['title'] = "Port that the Video from the AutoTester is streamed to.  Must be >1000"
+            self.fields['maxStreamViewers'].label="Maximum Video Viewers"
+            self.fields['maxStreamViewers'].widget.attrs['title'] = "How many browsers can watch the video stream at the same time.  Further viewers are turned away"
+            self.fields['streamWriteTimeoutSecs'].label="Video Viewer Timeout (Secs)"
+            self.fields['streamWriteTimeoutSecs'].widget.attrs['title'] = "A viewer that takes longer than this to accept a frame is disconnected so it does not hold a stream thread"
+            self.fields['sensorBaudRate'].label="Color Sensor Baud Rate"
+            self.fields['sensorBaudRate'].widget.attrs['title'] = "Serial speed of the color sensor Arduino.  Must match the speed set in its firmware"
+            self.fields['sensorBatchedMeasurement'].label="Batched Color Measurement"
+            self.fields['sensorBatchedMeasurement'].widget.attrs['title'] = "Read all colors with one sensor command.  Turn off for firmware that only supports the single color commands"
+            self.fields['sensorResponseTimeoutSecs'].label="Color Sensor Timeout (secs)"
+            self.fields['sensorResponseTimeoutSecs'].widget.attrs['title'] = "How long to wait for the color sensor to answer before giving up"
+            self.fields['pumpPulseBackend'].label="Pump Step Pulses"
+            self.fields['pumpPulseBackend'].widget.attrs['title'] = "How the pump step pulses are timed.  pigpio needs the pigpiod daemon running, GPIO times them in Python and Auto picks pigpio when it is available"
+            self.fields['pumpMaxStepRate'].label="Pump Max Steps/sec"
+            self.fields['pumpMaxStepRate'].widget.attrs['title'] = "Top step rate of the pump steppers once they have ramped up"
+            self.fields['homingTimeoutSecs'].label="Homing Timeout (secs)"
+            self.fields['homingTimeoutSecs'].widget.attrs['title'] = "How long homing the syringe carriage may take before it is stopped and an alarm is sent"
+            self.fields['rehomeAfterMoves'].label="Re-home After Moves"
+            self.fields['rehomeAfterMoves'].widget.attrs['title'] = "Home the syringe carriage again after this many moves, even if it has not lost its position"
+            self.fields['logMaxKB'].label="Log File Size (KB)"
+            self.fields['logMaxKB'].widget.attrs['title'] = "Size a log file can grow to before it is rotated.  Takes effect when the tester is restarted"
+            self.fields['logBackupCount'].label="Old Log Files Kept"
+            self.fields['logBackupCount'].widget.attrs['title'] = "How many rotated log files are kept for each log.  Takes effect when the tester is restarted"
+            self.fields['hardwareBackend'].label="Hardware"
+            self.fields['hardwareBackend'].widget.attrs['title'] = "Simulated runs the tests without any boards attached, on a simulated mixer, syringe and KH jar.  Auto uses the Raspberry Pi boards on a Pi and simulates on any other computer.  Simulated results are marked and not reported.  Takes effect when the tester is restarted"
+            self.fields['simulationSpeedup'].label="Simulation Speedup"
+            self.fields['simulationSpeedup'].widget.attrs['title'] = "How many times faster than real time the simulated hardware runs"
             self.fields['mixerCleanML'].label="ML to Clean the Mixer"
             self.fields['mixerCleanML'].widget.attrs['title'] = "How many ML to clean the mixer for each flush cycle"
             self.fields['mixerCleanCycles'].label="Mixer Cleaning Cycles"
@@ -31,6 +31,22 @@ class TesterExternal(models.Model):
     tooDarkThreshold = models.IntegerField(default=30)
     webPort = models.IntegerField(default=8000,validators=[MinValueValidator(1001),MaxValueValidator(65535),])
     videoStreamingPort = models.IntegerField(default=8080,validators=[MinValueValidator(1001),MaxValueValidator(65535),])
+    maxStreamViewers = models.IntegerField(default=4,validators=[MinValueValidator(1),MaxValueValidator(20),])
+    streamWriteTimeoutSecs = models.FloatField(default=10,validators=[MinValueValidator(1),MaxValueValidator(120)])
+    SENSOR_BAUD_RATES=((9600,'9600'),(19200,'19200'),(38400,'38400'),(57600,'57600'),(115200,'115200'))
+    sensorBaudRate = models.IntegerField(default=9600,choices=SENSOR_BAUD_RATES)
+    sensorBatchedMeasurement = models.BooleanField(default=True)
+    sensorResponseTimeoutSecs = models.FloatField(default=2,validators=[MinValueValidator(.1),MaxValueValidator(30)])
+    PUMP_PULSE_BACKENDS=(('auto','Auto'),('pigpio','pigpio'),('gpio','GPIO'),('simulated','Simulated'))
+    pumpPulseBackend = models.CharField(max_length=20, default='auto',choices=PUMP_PULSE_BACKENDS)
+    pumpMaxStepRate = models.IntegerField(default=4000,validators=[MinValueValidator(100),MaxValueValidator(50000)])
+    homingTimeoutSecs = models.IntegerField(default=60,validators=[MinValueValidator(5),MaxValueValidator(600)])
+    rehomeAfterMoves = models.IntegerField(default=500,validators=[MinValueValidator(1),MaxValueValidator(100000)])
+    logMaxKB = models.IntegerField(default=1024,validators=[MinValueValidator(16),MaxValueValidator(102400)])
+    logBackupCount = models.IntegerField(default=4,validators=[MinValueValidator(1),MaxValueValidator(20)])
+    HARDWARE_BACKENDS=(('auto','Auto'),('pi','Raspberry Pi'),('simulated','Simulated'))
+    hardwareBackend = models.CharField(max_length=20, default='auto',choices=HARDWARE_BACKENDS)
+    simulationSpeedup = models.IntegerField(default=20,validators=[MinValueValidator(1),MaxValueValidator(1000)])
     measurementUnits = models.CharField(max_length=40, default='US Imperial')
     pumpPurgeTimeSeconds = models.IntegerField(default=4,validators=[MinValueValidator(1),MaxValueValidator(60),])
     mixerCleanML = models.IntegerField(default=8,validators=[MinValueValidator(1),MaxValueValidator(10),])
@@ -84,6 +100,22 @@ class TesterProcessingParameters(models.Model):
     minImageRotationWithoutAdjustment=models.FloatField(default=-2)
     defaultFisheyeExpansionFactor=models.FloatField(default=1.2)
     gapTolerance=models.FloatField(default=5.0)
+    binaryMatchUseProjection=models.BooleanField(default=True, help_text="Titration color matching projects onto the swatch 1 - swatch 2 line instead of building a candidate list")
+    binaryMatchIncrements=models.IntegerField(default=100,validators=[MinValueValidator(1),MaxValueValidator(10000)], help_text="Number of interpolation steps between swatch 1 and swatch 2 for titration color matching")
+    titrationAdaptive=models.BooleanField(default=False, help_text="Titrations dose larger steps while far from the transition instead of always dosing the minimum step")
+    titrationMinStepML=models.FloatField(default=.01,validators=[MinValueValidator(.001),MaxValueValidator(1)], help_text="Smallest titration dose in ML, and the dose used every time when titration is not adaptive")
+    titrationMaxStepML=models.FloatField(default=.05,validators=[MinValueValidator(.001),MaxValueValidator(1)], help_text="Largest titration dose in ML when titration is adaptive")
+    khPredictiveEndpoint=models.BooleanField(default=False, help_text="KH tests predict the 4.5 pH endpoint from the pH curve to size each dose, and interpolate the endpoint within the last dose")
+    khMinDoseML=models.FloatField(default=.05,validators=[MinValueValidator(.001),MaxValueValidator(1)], help_text="Smallest KH reagent dose in ML when the endpoint is predicted")
+    khMaxDoseML=models.FloatField(default=.5,validators=[MinValueValidator(.001),MaxValueValidator(2)], help_text="Largest KH reagent dose in ML when the endpoint is predicted")
+    phSamplesPerSec=models.FloatField(default=1,validators=[MinValueValidator(.1),MaxValueValidator(50)], help_text="Rate the pH probe is sampled at for each pH reading")
+    phMaxSampleSecs=models.FloatField(default=5,validators=[MinValueValidator(.1),MaxValueValidator(60)], help_text="Longest time spent sampling for one pH reading")
+    phEarlyStop=models.BooleanField(default=False, help_text="Finish a pH reading as soon as it is stable instead of always sampling for the full time")
+    phMinSamples=models.IntegerField(default=3,validators=[MinValueValidator(2),MaxValueValidator(100)], help_text="Fewest samples a pH reading is averaged over before it can be called stable")
+    phStableTolerance=models.FloatField(default=.01,validators=[MinValueValidator(.001),MaxValueValidator(1)], help_text="A pH reading is stable once the standard error of its mean is within this many pH units")
+    pipelineTestSteps=models.BooleanField(default=True, help_text="Clean and fill the mixer while the reagent is drawn instead of one after the other.  Operations that need the same actuator still take turns")
+    batchQueuedTests=models.BooleanField(default=True, help_text="When another test is due straight after a test, leave the mixer for it to clean and park the tester once at the end of the batch instead of after every test")
+    measurementSaveIntervalSecs=models.IntegerField(default=60,validators=[MinValueValidator(0),MaxValueValidator(3600)], help_text="Minimum seconds between saves of the latest color sensor reading to the database.  It is always saved at the end of a test")
 
 class TestResultsExternal(models.Model):
     testPerformed = models.CharField(max_length=200, default=None, help_text="This was the test that was run")
@@ -91,6 +123,8 @@ class TestResultsExternal(models.Model):
     status = models.CharField(max_length=200,default='Completed', help_text="Completion status of the test")
     datetimePerformed = models.DateTimeField(default=datetime.now, help_text="When the test was run")
     swatchFile=models.CharField(max_length=200, default=None, null=True,blank=True,help_text="This was the test that was run")
+    timingTrace=models.TextField(default=None, null=True, blank=True, help_text="When each phase of the test started and how long it took, as JSON")
+    simulated=models.BooleanField(default=False, help_text="The test ran on the simulated hardware, not on a real sample")
 
     def __str__(self):
         return self.testPerformed
@@ -291,6 +325,7 @@ class JobExternal(models.Model):
 
     class Meta:
         ordering = ['timeStamp']
+        indexes = [models.Index(fields=['jobStatus','timeStamp'],name='job_status_time_idx')]
         
 class JobEntry(models.Model):  #This field is used for display and no instances exist in the db
     jobName = models.CharField(max_length=40)
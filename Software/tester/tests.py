@@ -1,3 +1,1434 @@
-from django.test import TestCase
+from django.test import TestCase,SimpleTestCase
 
 # Create your tests here.
+import contextlib
+import datetime
+import json
+import logging
+import logging.handlers
+import random
+import socket
+import tempfile
+import threading
+import time
+import types
+import numpy as np
+import serial
+
+from ImageCheck import swatch,benchmarkTester,findClosestBinarySwatchMatch,findClosestSwatchMatch,findClosestSwatchMatchUncached,getMatchCandidateMatrix,prepareMatchCandidateList
+from JobDispatcher import JobDispatcher
+from ColorSensor import ColorSensor,fakeColorSensor,CMD_GET_MEASUREMENT
+from FrameBuffer import FrameRingBuffer,EncodedFrameFanout
+import concurrent.futures
+from GrblController import GrblController,GrblError,fakeGrbl,parseStatusReport,HOMING_DONE_REPLY
+from Hardware import createHardware,isRaspberryPi,simulatedHardware,developingColorModel,titrationColorModel,TANK_VALVE,OSMOSE_VALVE
+from LogPipeline import LogPipeline,LogContext,JsonFormatter
+from LogReader import tailRecords,readNewRecords
+from Metrics import MetricsRegistry,countQueries
+from MotionPlanner import planReagentStep,runMotionPlan,estimateTestDefinition,estimateMoveSecs
+from PhaseTrace import PhaseTrace,traced,waterfallRows
+from PHSampler import PHSampler,runningStatistics
+from StepExecutor import StepExecutor,simulatedTestStep
+from StepPulses import StepperPump,rampTable,trapezoidalProfile,profileSteps,profileDurationSecs,simulatedPulseBackend,gpioPulseBackend,edgeRecordingGPIO
+from Titration import titrationStepper,simulatedTitrationChemistry,simulateTitration,phEndpointPredictor,simulatedKHChemistry,simulatePredictiveKHTest
+
+class BinarySwatchMatchTests(SimpleTestCase):
+    def setUp(self):
+        self.tester=benchmarkTester(numSwatches=2)
+        self.rng=random.Random(1234)
+
+    def compareModes(self,samples):
+        for l,a,b in samples:
+            self.tester.binaryMatchUseProjection=False
+            listValue=findClosestBinarySwatchMatch(self.tester,'Benchmark',l,a,b)
+            self.tester.binaryMatchUseProjection=True
+            projectedValue=findClosestBinarySwatchMatch(self.tester,'Benchmark',l,a,b)
+            self.assertEqual(listValue,projectedValue,'Mismatch at Lab ' + str((l,a,b)))
+
+    def test_projection_matches_candidate_list(self):
+        samples=[(self.rng.uniform(0,100),self.rng.uniform(-60,60),self.rng.uniform(-60,60)) for i in range(5000)]
+        self.compareModes(samples)
+
+    def test_projection_matches_on_segment_and_beyond_ends(self):
+        start=self.tester.colorSheetList['Benchmark'].swatchList['1/LED']
+        end=self.tester.colorSheetList['Benchmark'].swatchList['2/LED']
+        samples=[]
+        for step in range(-50,251):
+            t=step/200
+            samples.append((start.channel1+t*(end.channel1-start.channel1),start.channel2+t*(end.channel2-start.channel2),start.channel3+t*(end.channel3-start.channel3)))
+        self.compareModes(samples)
+
+    def test_projection_with_identical_swatches(self):
+        end=self.tester.colorSheetList['Benchmark'].swatchList['2/LED']
+        start=self.tester.colorSheetList['Benchmark'].swatchList['1/LED']
+        end.channel1,end.channel2,end.channel3=start.channel1,start.channel2,start.channel3
+        self.compareModes([(50,0,0),(start.channel1,start.channel2,start.channel3)])
+
+    def test_projection_with_other_resolutions(self):
+        samples=[(self.rng.uniform(0,100),self.rng.uniform(-60,60),self.rng.uniform(-60,60)) for i in range(500)]
+        for increments in (1,7,25,1000):
+            self.tester.binaryMatchIncrements=increments
+            self.compareModes(samples)
+
+class ColorTableCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tester=benchmarkTester(numSwatches=3)
+        self.colorSheet=self.tester.colorSheetList['Benchmark']
+        for row in (1,2):
+            sw=swatch('Benchmark')
+            sw.swatchRow=row
+            sw.lightingConditions='Daylight'
+            sw.channel1=50
+            self.colorSheet.swatchList[str(row) + '/Daylight']=sw
+
+    def test_same_key_hits_and_result_is_read_only(self):
+        colorTable=self.colorSheet.generateColorTableDisplay(self.tester)
+        self.assertIs(self.colorSheet.generateColorTableDisplay(self.tester),colorTable)
+        self.assertFalse(colorTable.flags.writeable)
+
+    def test_size_and_lighting_are_part_of_the_key(self):
+        colorTable=self.colorSheet.generateColorTableDisplay(self.tester)
+        self.assertEqual(colorTable.shape,(120,80,3))
+        self.assertEqual(self.colorSheet.generateColorTableDisplay(self.tester,width=60,height=20).shape,(60,60,3))
+        self.tester.lightingConditionToDisplay='Daylight'
+        self.assertEqual(self.colorSheet.generateColorTableDisplay(self.tester).shape,(80,80,3))
+        self.tester.lightingConditionToDisplay='LED'
+        self.assertIs(self.colorSheet.generateColorTableDisplay(self.tester),colorTable)
+
+    def test_changed_contents_miss_the_cache(self):
+        colorTable=self.colorSheet.generateColorTableDisplay(self.tester)
+        self.colorSheet.swatchList['1/LED'].channel1=20
+        self.assertIs(self.colorSheet.generateColorTableDisplay(self.tester),colorTable)
+        self.colorSheet.markContentsChanged()
+        newTable=self.colorSheet.generateColorTableDisplay(self.tester)
+        self.assertIsNot(newTable,colorTable)
+        self.assertFalse(np.array_equal(newTable[:40],colorTable[:40]))
+        self.assertTrue(np.array_equal(newTable[40:],colorTable[40:]))
+
+class ReagentPrecheckTests(TestCase):
+    def setUp(self):
+        from tester.models import ReagentSetup
+        from TesterCore import Tester
+        for slotName,remainingML in (('A',10),('B',2),('C',5),('D',0)):
+            ReagentSetup.objects.create(slotName=slotName,used=True,fluidRemainingInML=remainingML)
+        self.tester=object.__new__(Tester)
+        self.tester.reagentList={}
+
+    def reagentTest(self,**slots):
+        ts=types.SimpleNamespace(KHtestwithPHProbe=False,reagent1Slot=None,reagent2Slot=None,reagent3Slot=None,titrationSlot=None)
+        ts.__dict__.update(slots)
+        return ts
+
+    def test_only_reagents_below_the_threshold_are_short(self):
+        ts=self.reagentTest(reagent1Slot='A',reagent2Slot='B',titrationSlot='C')
+        with self.assertNumQueries(1):
+            shortReagents=self.tester.findShortReagents(ts,5)
+        self.assertEqual(shortReagents,[('Reagent 2','B',2)])
+        self.assertEqual(self.tester.findShortReagents(ts,5.5),[('Reagent 2','B',2),('Titration','C',5)])
+        self.assertEqual(self.tester.findShortReagents(ts,1),[])
+
+    def test_empty_slots_are_skipped(self):
+        ts=self.reagentTest(reagent3Slot='D')
+        self.assertEqual(self.tester.getReagentSlotsForTest(ts),[('Reagent 3','D')])
+        self.assertEqual(self.tester.findShortReagents(ts,1),[('Reagent 3','D',0)])
+        self.assertEqual(self.tester.findShortReagents(self.reagentTest(),1),[])
+
+    def test_kh_test_only_checks_its_titration_slot(self):
+        ts=self.reagentTest(KHtestwithPHProbe=True,reagent1Slot='B',titrationSlot='A')
+        self.assertEqual(self.tester.getReagentSlotsForTest(ts),[('KH Reagent','A')])
+        self.assertEqual(self.tester.findShortReagents(ts,5),[])
+
+    def test_reagent_levels_are_read_again_for_each_check(self):
+        from tester.models import ReagentSetup
+        ts=self.reagentTest(reagent1Slot='A')
+        self.assertEqual(self.tester.findShortReagents(ts,5),[])
+        ReagentSetup.objects.filter(slotName='A').update(fluidRemainingInML=1)
+        self.assertEqual(self.tester.findShortReagents(ts,5),[('Reagent 1','A',1)])
+
+class SwatchMatchCacheTests(TestCase):
+    def setUp(self):
+        self.tester=benchmarkTester(numSwatches=9)
+        self.colorSheet=self.tester.colorSheetList['Benchmark']
+        self.colorSheet.itemBeingMeasured='Benchmark'
+        self.colorSheet.minPermissableValue=0
+        self.colorSheet.maxPermissableValue=10
+        self.tester.currentColorSheet=self.colorSheet
+        self.tester.referenceCenterRow=240
+        self.tester.referenceCenterCol=320
+        frame=np.full((480,640,3),(40,120,200),dtype=np.uint8)
+        self.tester.frameBuffer=types.SimpleNamespace(acquireFrame=lambda:(1,frame,0),releaseFrame=lambda slot:None)
+        self.tester.saveColorSheetIntoDB=lambda colorSheetName:None
+
+    def candidateValues(self):
+        return set(getMatchCandidateMatrix(self.tester,'Benchmark')[:,3])
+
+    def test_cached_matrix_matches_candidate_loop(self):
+        self.colorSheet.compileMatchCandidates(self.tester)
+        candidateMatrix=getMatchCandidateMatrix(self.tester,'Benchmark')
+        self.assertEqual(candidateMatrix.tolist(),prepareMatchCandidateList(self.tester,'Benchmark'))
+        rng=random.Random(1234)
+        for i in range(2000):
+            l,a,b=rng.uniform(0,100),rng.uniform(-60,60),rng.uniform(-60,60)
+            self.assertEqual(findClosestSwatchMatch(self.tester,'Benchmark',l,a,b),findClosestSwatchMatchUncached(self.tester,'Benchmark',l,a,b))
+
+    def test_saving_a_swatch_invalidates_the_matrix(self):
+        from WebCmdHandler import saveSwatch
+        self.colorSheet.compileMatchCandidates(self.tester)
+        self.assertNotIn(9.5,self.candidateValues())
+        saveSwatch(self.tester,8,'9.5')
+        self.assertEqual(self.colorSheet.matchCandidateMatrixList,{})
+        self.assertIn(9.5,self.candidateValues())
+
+    def test_saving_a_set_invalidates_the_matrix(self):
+        from WebCmdHandler import saveSet
+        self.colorSheet.compileMatchCandidates(self.tester)
+        oldMatrix=getMatchCandidateMatrix(self.tester,'Benchmark')
+        saveSet(self.tester,'CNBenchmark:CIBenchmark:CLLED')
+        newMatrix=getMatchCandidateMatrix(self.tester,'Benchmark')
+        self.assertIsNot(newMatrix,oldMatrix)
+        #Every swatch was read from the same flat frame, so all of the candidates have its color
+        self.assertTrue(np.allclose(newMatrix[:,:3],newMatrix[0,:3]))
+
+    def test_saving_the_sheet_to_the_database_invalidates_the_matrix(self):
+        from tester.models import LightingConditionsExternal
+        from TesterCore import Tester
+        LightingConditionsExternal.objects.create(lightingConditionName='LED')
+        self.colorSheet.compileMatchCandidates(self.tester)
+        self.colorSheet.swatchList['8/LED'].valueAtSwatch=6
+        self.assertNotIn(6,self.candidateValues())
+        Tester.saveColorSheetIntoDB(self.tester,'Benchmark')
+        self.assertIn(6,self.candidateValues())
+
+class ColorSensorTests(SimpleTestCase):
+    def openSensor(self,**fakeArgs):
+        self.fake=fakeColorSensor(**fakeArgs)
+        self.sensorPort=serial.Serial(self.fake.portName,9600,timeout=.1)
+        self.addCleanup(self.fake.close)
+        self.addCleanup(self.sensorPort.close)
+
+    def test_batched_measurement_uses_one_command(self):
+        self.openSensor()
+        sensor=ColorSensor(self.sensorPort,batchedMeasurement=True)
+        self.assertEqual(sensor.measureRGB(),(.25,.5,.75))
+        self.assertEqual(self.fake.commandsReceived,[CMD_GET_MEASUREMENT])
+
+    def test_legacy_measurement_matches_batched(self):
+        self.openSensor()
+        sensor=ColorSensor(self.sensorPort,batchedMeasurement=False)
+        self.assertEqual(sensor.measureRGB(),(.25,.5,.75))
+        self.assertEqual(self.fake.commandsReceived,[9,10,11])
+
+    def test_falls_back_to_legacy_when_batched_unsupported(self):
+        self.openSensor(supportsBatched=False)
+        sensor=ColorSensor(self.sensorPort,batchedMeasurement=True)
+        self.assertEqual(sensor.measureRGB(),(.25,.5,.75))
+        self.assertFalse(sensor.batchedMeasurement)
+        self.assertEqual(self.fake.commandsReceived,[CMD_GET_MEASUREMENT,9,10,11])
+        self.assertEqual(sensor.retries,1)
+        sensor.measureRGB()
+        self.assertEqual(sensor.retries,1)
+
+    def test_waits_for_slow_response(self):
+        self.openSensor(measurementSecs=.5)
+        sensor=ColorSensor(self.sensorPort,batchedMeasurement=True,responseTimeoutSecs=2)
+        self.assertEqual(sensor.measureBatched(),(.25,.5,.75))
+        self.assertEqual(sensor.retries,0)
+
+    def test_times_out_without_response(self):
+        self.openSensor(measurementSecs=1)
+        sensor=ColorSensor(self.sensorPort,batchedMeasurement=True,responseTimeoutSecs=.3)
+        with self.assertRaises(serial.SerialTimeoutException):
+            sensor.measureBatched()
+
+class FrameRingBufferTests(SimpleTestCase):
+    def frame(self,value):
+        return np.full((4,6,3),value,dtype=np.uint8)
+
+    def test_reader_gets_a_read_only_view_of_the_latest_frame(self):
+        frameBuffer=FrameRingBuffer()
+        self.assertTrue(frameBuffer.publishFrame(self.frame(1)))
+        self.assertTrue(frameBuffer.publishFrame(self.frame(2)))
+        sequence,frameView,slot=frameBuffer.acquireFrame(afterSequence=0)
+        self.assertEqual(sequence,2)
+        self.assertTrue((frameView==2).all())
+        with self.assertRaises(ValueError):
+            frameView[0,0,0]=9
+        frameBuffer.releaseFrame(slot)
+        copy=frameBuffer.copyLatestFrame(afterSequence=0)
+        copy[0,0,0]=9
+        self.assertEqual(frameBuffer.getStatistics()['readersHoldingFrames'],0)
+
+    def test_waiting_reader_times_out_without_a_new_frame(self):
+        frameBuffer=FrameRingBuffer()
+        frameBuffer.publishFrame(self.frame(1))
+        self.assertEqual(frameBuffer.acquireFrame(timeout=.05),(None,None,None))
+
+    def test_held_slot_is_not_overwritten(self):
+        frameBuffer=FrameRingBuffer(numSlots=3)
+        frameBuffer.publishFrame(self.frame(1))
+        sequence,frameView,slot=frameBuffer.acquireFrame(afterSequence=0)
+        for value in range(2,10):
+            self.assertTrue(frameBuffer.publishFrame(self.frame(value)))
+        self.assertTrue((frameView==1).all())
+        self.assertEqual(frameBuffer.frameAllocations,3)
+        frameBuffer.releaseFrame(slot)
+
+    def test_frame_is_dropped_when_every_slot_is_busy(self):
+        frameBuffer=FrameRingBuffer(numSlots=2)
+        frameBuffer.publishFrame(self.frame(1))
+        firstFrame=frameBuffer.acquireFrame(afterSequence=0)
+        frameBuffer.publishFrame(self.frame(2))
+        #One slot is held by the reader and the other has the latest frame, so there is nowhere to put the next one
+        self.assertFalse(frameBuffer.publishFrame(self.frame(3)))
+        self.assertEqual(frameBuffer.framesDropped,1)
+        self.assertEqual(frameBuffer.getStatistics()['readersHoldingFrames'],1)
+        self.assertTrue((firstFrame[1]==1).all())
+        frameBuffer.releaseFrame(firstFrame[2])
+        self.assertEqual(frameBuffer.getStatistics()['readersHoldingFrames'],0)
+        self.assertTrue(frameBuffer.publishFrame(self.frame(3)))
+        self.assertEqual(frameBuffer.latestSequence,3)
+
+    def test_releasing_counts_each_reader_of_a_slot(self):
+        frameBuffer=FrameRingBuffer(numSlots=2)
+        frameBuffer.publishFrame(self.frame(1))
+        readers=[frameBuffer.acquireFrame(afterSequence=0) for i in range(2)]
+        frameBuffer.publishFrame(self.frame(2))
+        frameBuffer.releaseFrame(readers[0][2])
+        self.assertFalse(frameBuffer.publishFrame(self.frame(3)))
+        frameBuffer.releaseFrame(readers[1][2])
+        frameBuffer.releaseFrame(None)
+        self.assertTrue(frameBuffer.publishFrame(self.frame(3)))
+
+class StreamFanoutTests(SimpleTestCase):
+    def setUp(self):
+        import AutoTester
+        self.autoTester=AutoTester
+        self.savedTester=AutoTester.tester
+        self.fanout=EncodedFrameFanout(maxViewers=1)
+        AutoTester.tester=types.SimpleNamespace(streamFanout=self.fanout,streamVideo=True,suppressProcessing=False,streamWriteTimeoutSecs=.2,debugMessage=lambda message:None)
+        class quietViewer(AutoTester.TesterViewer):
+            def log_message(self,format,*args):
+                pass
+        self.server=AutoTester.ThreadedHTTPServer(('127.0.0.1',0),quietViewer)
+        self.server.daemon_threads=True
+        threading.Thread(target=self.server.serve_forever,daemon=True).start()
+
+    def tearDown(self):
+        self.autoTester.tester.streamVideo=False
+        self.server.shutdown()
+        self.server.server_close()
+        self.autoTester.tester=self.savedTester
+
+    def openStream(self):
+        connection=socket.create_connection(self.server.server_address,timeout=5)
+        connection.sendall(b'GET /tester.mjpg HTTP/1.0\r\n\r\n')
+        return connection
+
+    def waitForViewers(self,count):
+        endTime=time.time()+5
+        while self.fanout.activeViewers!=count and time.time()<endTime:
+            time.sleep(.01)
+        self.assertEqual(self.fanout.activeViewers,count)
+
+    def test_viewers_beyond_the_cap_are_turned_away(self):
+        self.assertTrue(self.fanout.addViewer())
+        self.assertFalse(self.fanout.addViewer())
+        self.assertEqual(self.fanout.viewersRejected,1)
+        self.fanout.removeViewer()
+        self.assertTrue(self.fanout.addViewer())
+        self.fanout.removeViewer()
+        self.assertEqual(self.fanout.activeViewers,0)
+
+    def test_every_viewer_gets_the_newest_part(self):
+        self.fanout.publishPart(b'one')
+        sequence,part=self.fanout.waitForPart(afterSequence=0,timeout=1)
+        self.assertTrue(part.endswith(b'\r\n\r\none\r\n'))
+        self.fanout.publishPart(b'two')
+        self.fanout.publishPart(b'three')
+        sequence,part=self.fanout.waitForPart(sequence,timeout=1)
+        self.assertEqual(sequence,3)
+        self.assertIn(b'three',part)
+        self.assertEqual(self.fanout.partsSkipped,1)
+        self.assertEqual(self.fanout.waitForPart(sequence,timeout=.05),(3,None))
+
+    def test_second_stream_gets_503_while_the_first_is_open(self):
+        first=self.openStream()
+        self.waitForViewers(1)
+        self.fanout.publishPart(b'frame')
+        self.assertIn(b'200',first.recv(64))
+        second=self.openStream()
+        with second.makefile('rb') as response:
+            self.assertIn(b'503',response.readline())
+            response.read()
+        second.close()
+        self.assertEqual(self.fanout.viewersRejected,1)
+        first.close()
+        self.fanout.publishPart(b'frame')
+        self.waitForViewers(0)
+
+    def test_viewer_that_stops_reading_is_dropped(self):
+        connection=self.openStream()
+        connection.setsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF,4096)
+        self.waitForViewers(1)
+        #Parts much larger than the socket buffers fill them, so the write times out
+        endTime=time.time()+10
+        while self.fanout.activeViewers>0 and time.time()<endTime:
+            self.fanout.publishPart(bytes(1000000))
+            time.sleep(.05)
+        self.assertEqual(self.fanout.activeViewers,0)
+        connection.close()
+
+class TestBatchingTests(SimpleTestCase):
+    def setUp(self):
+        from unittest import mock
+        import AutoTester
+        self.autoTester=AutoTester
+        self.parks=[]
+        patcher=mock.patch.object(AutoTester,'osmoseCleanMixerReactor',lambda tester:self.parks.append(tester.currentTest))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.nextTest=None
+        self.tester=types.SimpleNamespace(batchQueuedTests=True,abortJob=False,batchInProgress=False,batchParkingsSkipped=0,batchResults=[],batchStartTime=0,
+            currentTest=None,phaseTrace=None,mixerCleanCycles=2,mixerCleanML=10,peekNextTest=lambda:self.nextTest,infoMessage=lambda message:None,parkArduinoStepper=lambda:True,sleep=lambda secs:None)
+
+    def queuedTest(self,name,waterVolInML=5,reagent1Amount=.5,kh=False):
+        return types.SimpleNamespace(testName=name,KHtestwithPHProbe=kh,waterVolInML=waterVolInML,reagent1Slot=None if kh else 'A',reagent1Amount=reagent1Amount)
+
+    def test_mixer_is_left_only_for_a_test_that_cleans_it(self):
+        self.nextTest=self.queuedTest('Nitrate')
+        self.autoTester.leaveMixerForNextTest(self.tester)
+        self.assertTrue(self.tester.batchInProgress)
+        self.assertEqual((self.parks,self.tester.batchParkingsSkipped),([],1))
+        for nextTest in (None,self.queuedTest('KH',kh=True),self.queuedTest('Dry',waterVolInML=0),self.queuedTest('Blank',reagent1Amount=0)):
+            self.nextTest=nextTest
+            self.tester.batchInProgress=True
+            self.autoTester.leaveMixerForNextTest(self.tester)
+            self.assertFalse(self.tester.batchInProgress)
+        self.assertEqual(len(self.parks),4)
+
+    def test_batching_can_be_turned_off_and_aborted(self):
+        self.nextTest=self.queuedTest('Nitrate')
+        self.tester.batchQueuedTests=False
+        self.autoTester.leaveMixerForNextTest(self.tester)
+        self.tester.batchQueuedTests=True
+        self.tester.abortJob=True
+        self.autoTester.leaveMixerForNextTest(self.tester)
+        self.assertEqual(len(self.parks),2)
+        self.assertFalse(self.tester.batchInProgress)
+
+    def test_test_that_does_not_clean_the_mixer_parks_first(self):
+        #The job the mixer was left for was removed and a KH test became due instead
+        self.tester.batchInProgress=True
+        self.tester.batchResults=[('Nitrate',5),('Phosphate',.1)]
+        self.autoTester.parkBeforeTest(self.tester,self.queuedTest('KH',kh=True))
+        self.assertEqual(len(self.parks),1)
+        self.assertFalse(self.tester.batchInProgress)
+        self.assertEqual(self.tester.batchResults,[])
+        self.autoTester.parkBeforeTest(self.tester,self.queuedTest('KH',kh=True))
+        self.tester.batchInProgress=True
+        self.autoTester.parkBeforeTest(self.tester,self.queuedTest('Calcium'))
+        self.assertTrue(self.tester.batchInProgress)
+        self.assertEqual(len(self.parks),1)
+
+    def test_failed_test_ends_the_batch(self):
+        def failSample(tester,ts):
+            raise RuntimeError('Sampling failed')
+        counter=types.SimpleNamespace(observe=lambda *args,**kwargs:None,inc=lambda *args,**kwargs:None)
+        self.tester.__dict__.update(batchInProgress=True,testSequenceList={'Calcium':self.queuedTest('Calcium')},hardware=types.SimpleNamespace(sampleForTest=failSample),
+            debugLog=logging.getLogger('TestBatchingTests'),startTestTrace=lambda testName:None,saveTestTrace=lambda:None,saveMeasurementIfDue=lambda force:None,
+            KHTester=False,testDurationSeconds=counter,testsRun=counter)
+        self.tester.debugLog.disabled=True
+        self.autoTester.runTestSequence(self.tester,'Calcium')
+        self.assertFalse(self.tester.batchInProgress)
+        self.assertEqual(self.parks,[])
+
+    def test_failed_step_homes_and_parks_instead_of_leaving_the_mixer(self):
+        from unittest import mock
+        #runTestStep catches a GRBL error part way through a dose and returns False
+        patcher=mock.patch.object(self.autoTester,'runTestStep',lambda *args,**kwargs:False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        homings=[]
+        counter=types.SimpleNamespace(observe=lambda *args,**kwargs:None,inc=lambda *args,**kwargs:None)
+        calcium=self.queuedTest('Calcium')
+        calcium.__dict__.update(reagent1AgitateSecs=0,reagent1AgitateMixerSecs=0,reagent1AgitateSecsBetweenDrips=0,reagent1ThickLiquid=False)
+        self.nextTest=self.queuedTest('Nitrate')
+        self.tester.__dict__.update(batchInProgress=True,testSequenceList={'Calcium':calcium},hardware=types.SimpleNamespace(sampleForTest=lambda tester,ts:None),
+            debugLog=logging.getLogger('TestBatchingTests'),startTestTrace=lambda testName:None,saveTestTrace=lambda:None,saveMeasurementIfDue=lambda force:None,
+            KHTester=False,testDurationSeconds=counter,testsRun=counter,getReagentSlotsForTest=lambda ts:['A'],findShortReagents=lambda ts,threshold:[],
+            reagentRemainingMLAlarmThresholdAutoTester=5,homingArduinoStepper=lambda force=False:homings.append(force) or True,saveTestSaveBadResults=lambda:True,
+            anyMoreJobs=lambda:True)
+        self.assertFalse(self.autoTester.runTestSequence(self.tester,'Calcium'))
+        #The start of test check runs inside a batch too, and the failure forces a home before the mixer is cleaned
+        self.assertEqual(homings,[False,True])
+        self.assertEqual(self.parks,['Calcium'])
+        self.assertFalse(self.tester.batchInProgress)
+        self.assertEqual(self.tester.batchParkingsSkipped,0)
+
+class JobDispatcherTests(SimpleTestCase):
+    def test_peek_leaves_the_ready_job_queued(self):
+        dispatcher=JobDispatcher()
+        now=datetime.datetime.now()
+        dispatcher.addJob(2,now-datetime.timedelta(seconds=5))
+        dispatcher.addJob(1,now-datetime.timedelta(seconds=10))
+        dispatcher.addJob(3,now+datetime.timedelta(hours=1))
+        self.assertEqual(dispatcher.peekReadyJob(),1)
+        self.assertEqual(dispatcher.popReadyJob(),1)
+        dispatcher.removeJob(2)
+        self.assertIsNone(dispatcher.peekReadyJob())
+        self.assertEqual(dispatcher.queuedJobCount(),1)
+
+    def waitInThread(self,dispatcher,**waitArgs):
+        waiter=types.SimpleNamespace(result=None,returnedAt=None)
+        def wait():
+            waiter.result=dispatcher.waitForReadyJob(**waitArgs)
+            waiter.returnedAt=time.time()
+        waiter.thread=threading.Thread(target=wait,daemon=True)
+        waiter.thread.start()
+        time.sleep(.1)
+        self.assertTrue(waiter.thread.is_alive())
+        return waiter
+
+    def test_queueing_a_job_wakes_the_waiting_runner(self):
+        #The recheck is an hour, so only the notify can wake the runner in time
+        dispatcher=JobDispatcher(busyRecheckSecs=3600)
+        waiter=self.waitInThread(dispatcher,timeout=5)
+        queuedAt=time.time()
+        dispatcher.addJob(1,datetime.datetime.now())
+        waiter.thread.join(2)
+        self.assertTrue(waiter.result)
+        self.assertLess(waiter.returnedAt-queuedAt,.5)
+        self.assertEqual(dispatcher.popReadyJob(),1)
+        waiter=self.waitInThread(dispatcher,timeout=5)
+        queuedAt=time.time()
+        dispatcher.replaceJobs([(2,datetime.datetime.now())])
+        waiter.thread.join(2)
+        self.assertTrue(waiter.result)
+        self.assertLess(waiter.returnedAt-queuedAt,.5)
+
+    def test_future_job_is_waited_for_until_due(self):
+        dispatcher=JobDispatcher(busyRecheckSecs=3600)
+        dispatcher.addJob(1,datetime.datetime.now()+datetime.timedelta(seconds=.4))
+        self.assertFalse(dispatcher.anyReadyJobs())
+        self.assertIsNone(dispatcher.popReadyJob())
+        startTime=time.time()
+        self.assertTrue(dispatcher.waitForReadyJob(timeout=5))
+        self.assertGreaterEqual(time.time()-startTime,.3)
+        self.assertLess(time.time()-startTime,2)
+        self.assertEqual(dispatcher.popReadyJob(),1)
+        self.assertFalse(dispatcher.waitForReadyJob(timeout=.1))
+
+    def test_removed_jobs_are_dropped_lazily(self):
+        dispatcher=JobDispatcher()
+        now=datetime.datetime.now()
+        for jobID in (1,2,3):
+            dispatcher.addJob(jobID,now-datetime.timedelta(seconds=10-jobID))
+        dispatcher.removeJob(1)
+        self.assertEqual(dispatcher.queuedJobCount(),2)
+        self.assertEqual(len(dispatcher.jobHeap),3)
+        #Queued again for later, so its old heap entry is stale too
+        dispatcher.removeJob(2)
+        dispatcher.addJob(2,now+datetime.timedelta(hours=1))
+        with dispatcher.jobLock:
+            dispatcher.discardRemovedJobs()
+        self.assertEqual(dispatcher.jobHeap[0][1],3)
+        self.assertEqual(dispatcher.popReadyJob(),3)
+        self.assertIsNone(dispatcher.popReadyJob())
+        self.assertEqual(dispatcher.queuedJobCount(),1)
+
+    def test_busy_tester_is_rechecked_every_recheck_interval(self):
+        dispatcher=JobDispatcher(busyRecheckSecs=.05)
+        dispatcher.addJob(1,datetime.datetime.now())
+        checks=[]
+        def canStart():
+            checks.append(time.time())
+            return len(checks)==4
+        self.assertTrue(dispatcher.waitForReadyJob(canStart,timeout=5))
+        self.assertEqual(len(checks),4)
+        intervals=[later-earlier for earlier,later in zip(checks,checks[1:])]
+        self.assertTrue(all(.04<=interval<.5 for interval in intervals),intervals)
+        self.assertFalse(dispatcher.waitForReadyJob(lambda:False,timeout=.2))
+
+    def test_queued_diagnostic_wakes_the_diagnostics_thread(self):
+        from unittest import mock
+        import AutoTester
+        from WebCmdHandler import queueDiagnosticTest
+        diagnosticsRun=[]
+        ran=threading.Event()
+        def runDiagnosticTest(diagnosticTest):
+            diagnosticsRun.append((diagnosticTest,time.time()))
+            ran.set()
+            #Ends the diagnostics thread
+            raise SystemExit
+        fakeTester=types.SimpleNamespace(diagnosticLock=threading.Condition(),diagnosticQueue=[],systemStatus='Idle')
+        with mock.patch.object(AutoTester,'tester',fakeTester,create=True),mock.patch.object(AutoTester,'runDiagnosticTest',runDiagnosticTest):
+            diagnostics=threading.Thread(target=AutoTester.testerDiagnostics,daemon=True)
+            diagnostics.start()
+            time.sleep(.1)
+            queuedAt=time.time()
+            queueDiagnosticTest(fakeTester,'Carousel Diagnostic',5)
+            self.assertTrue(ran.wait(2))
+            diagnostics.join(2)
+        self.assertEqual([diagnostic for diagnostic,ranAt in diagnosticsRun],[['Carousel Diagnostic',5]])
+        self.assertLess(diagnosticsRun[0][1]-queuedAt,.5)
+        self.assertEqual(fakeTester.diagnosticQueue,[])
+
+class JobClaimTests(TestCase):
+    def setUp(self):
+        from tester.models import TestDefinition
+        from TesterCore import Tester
+        self.nitrate=TestDefinition.objects.create(testName='Nitrate')
+        self.phosphate=TestDefinition.objects.create(testName='Phosphate',enableTest=False)
+        self.tester=object.__new__(Tester)
+        self.tester.jobDispatcher=JobDispatcher()
+        self.tester.infoMessage=lambda message:None
+        self.now=datetime.datetime.now()
+
+    def queueJob(self,testDefinition,secondsAgo):
+        from tester.models import JobExternal
+        job=JobExternal.objects.create(jobToRun=testDefinition,timeStamp=self.now-datetime.timedelta(seconds=secondsAgo))
+        self.tester.jobDispatcher.addJob(job.pk,job.timeStamp)
+        return job
+
+    def changeRowOnPop(self,change):
+        #Stands in for the web page acting between popReadyJob and the claiming UPDATE
+        popReadyJob=self.tester.jobDispatcher.popReadyJob
+        def popAndChange():
+            jobID=popReadyJob()
+            if not jobID is None:
+                change(jobID)
+            return jobID
+        self.tester.jobDispatcher.popReadyJob=popAndChange
+
+    def test_job_claimed_or_removed_before_the_update_is_skipped(self):
+        from tester.models import JobExternal
+        claimed=self.queueJob(self.nitrate,30)
+        removed=self.queueJob(self.nitrate,20)
+        waiting=self.queueJob(self.nitrate,10)
+        changes={claimed.pk:lambda jobID:JobExternal.objects.filter(pk=jobID).update(jobStatus='Running'),removed.pk:lambda jobID:JobExternal.objects.filter(pk=jobID).delete()}
+        self.changeRowOnPop(lambda jobID:changes.get(jobID,lambda jobID:None)(jobID))
+        self.assertEqual(self.tester.getNextJob(),'Nitrate')
+        self.assertEqual(dict(JobExternal.objects.values_list('pk','jobStatus')),{claimed.pk:'Running',waiting.pk:'Running'})
+        self.assertIsNone(self.tester.getNextJob())
+
+    def test_claimed_job_is_never_returned_twice(self):
+        job=self.queueJob(self.nitrate,10)
+        self.assertEqual(self.tester.getNextJob(),'Nitrate')
+        #A reload of the queue that raced the claim still had it as queued
+        self.tester.jobDispatcher.addJob(job.pk,job.timeStamp)
+        self.assertIsNone(self.tester.getNextJob())
+        self.tester.loadJobQueueFromDB()
+        self.assertEqual(self.tester.jobDispatcher.queuedJobCount(),0)
+
+    def test_job_of_a_disabled_test_is_claimed_and_deleted(self):
+        from tester.models import JobExternal,TestResultsExternal
+        self.queueJob(self.phosphate,20)
+        self.queueJob(self.nitrate,10)
+        self.assertEqual(self.tester.getNextJob(),'Nitrate')
+        self.assertEqual(list(JobExternal.objects.values_list('jobToRun__testName',flat=True)),['Nitrate'])
+        self.assertEqual(list(TestResultsExternal.objects.values_list('testPerformed','status')),[('Phosphate','Skipped')])
+        self.assertIsNone(self.tester.getNextJob())
+
+    def test_home_page_removes_only_queued_jobs(self):
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from tester import views
+        from tester.models import JobExternal,TesterExternal
+        TesterExternal.objects.create(pk=1)
+        self.client.force_login(User.objects.create_user('operator'))
+        queued=self.queueJob(self.nitrate,20)
+        running=self.queueJob(self.nitrate,10)
+        self.assertEqual(self.tester.getNextJob(),'Nitrate')
+        queued.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual((queued.jobStatus,running.jobStatus),('Running','Queued'))
+        with mock.patch.object(views,'notifyTesterJobQueueChanged') as notify,mock.patch('builtins.print'):
+            for job in (queued,running):
+                self.assertEqual(self.client.post('/tester/home/',{'jobAction':'REMOVE-' + str(job.pk)}).status_code,200)
+        self.assertEqual(list(JobExternal.objects.values_list('pk',flat=True)),[queued.pk])
+        notify.assert_called_once()
+
+class TitrationStepperTests(SimpleTestCase):
+    def stepAfter(self,observations,targetProgress=.5,remainingML=1):
+        stepper=titrationStepper(adaptive=True,minStepML=.01,maxStepML=.05)
+        for dispenseCount,progress in observations:
+            stepper.recordObservation(dispenseCount,progress)
+        return stepper.nextStep(targetProgress,remainingML)
+
+    def test_linear_mode_always_takes_the_smallest_step(self):
+        stepper=titrationStepper(adaptive=False,minStepML=.01,maxStepML=.05)
+        stepper.recordObservation(0,0)
+        self.assertEqual(stepper.nextStep(.5,1),.01)
+        stepper.recordObservation(.01,.45)
+        self.assertEqual(stepper.nextStep(.5,1),.01)
+        self.assertEqual(stepper.endpoint(.5),.01)
+
+    def test_steps_grow_while_the_color_is_far_from_the_transition(self):
+        self.assertEqual(self.stepAfter([(0,0)]),.05)
+        self.assertEqual(self.stepAfter([(0,0),(.05,0)]),.05)
+        #The slower the color moves, the further ahead the transition is predicted and the larger the step
+        self.assertAlmostEqual(self.stepAfter([(.1,.1),(.11,.12)],targetProgress=.2),.02)
+        self.assertEqual(self.stepAfter([(.11,.12),(.13,.125)],targetProgress=.2),.05)
+
+    def test_steps_back_off_near_the_transition(self):
+        self.assertAlmostEqual(self.stepAfter([(.3,.1),(.35,.35)]),.015)
+        self.assertEqual(self.stepAfter([(.3,.2),(.31,.45)]),.01)
+        #Without a color change to predict from, it slows down once past half way
+        self.assertEqual(self.stepAfter([(0,.3)]),.01)
+
+    def test_step_stops_at_the_dispense_limit(self):
+        self.assertAlmostEqual(self.stepAfter([(0,0)],remainingML=.03),.03)
+        self.assertEqual(self.stepAfter([(0,0)],remainingML=.005),.05)
+        for seed in range(20):
+            chemistry=simulatedTitrationChemistry(endpointML=2,seed=seed)
+            stepper=titrationStepper(adaptive=True)
+            result,reads,secs=simulateTitration(chemistry,stepper,maxDispenseML=.5)
+            self.assertIsNone(result)
+            self.assertLessEqual(stepper.lastDispense,.5+1e-9)
+            self.assertAlmostEqual(stepper.lastDispense,.5)
+
+    def test_endpoint_is_interpolated_between_the_last_reads(self):
+        stepper=titrationStepper(adaptive=True)
+        stepper.recordObservation(.4,.2)
+        stepper.recordObservation(.45,.7)
+        self.assertAlmostEqual(stepper.endpoint(.5),.43)
+
+class KHEndpointPredictorTests(SimpleTestCase):
+    def test_endpoint_is_interpolated_within_last_dose(self):
+        predictor=phEndpointPredictor()
+        predictor.recordObservation(2.0,5.0)
+        predictor.recordObservation(2.1,4.0)
+        self.assertAlmostEqual(predictor.endpoint(),2.05)
+
+    def test_doses_stay_within_limits(self):
+        predictor=phEndpointPredictor(minDoseML=.05,maxDoseML=.5)
+        predictor.recordObservation(0,8.0)
+        self.assertEqual(predictor.nextDose(10),.5)
+        predictor.recordObservation(1.0,5.9)
+        predictor.recordObservation(1.5,5.85)
+        self.assertEqual(predictor.nextDose(10),.5)
+        predictor.recordObservation(2.0,5.9)
+        self.assertEqual(predictor.nextDose(10),.05)
+        self.assertEqual(predictor.nextDose(.3),.05)
+
+    def test_predicted_endpoint_matches_simulated_chemistry(self):
+        for kh in (4,7,11):
+            chemistry=simulatedKHChemistry(kh,noise=0)
+            result,dosed,reads=simulatePredictiveKHTest(chemistry,phEndpointPredictor())
+            self.assertAlmostEqual(result,chemistry.volumeAtPH(4.5),delta=.02)
+            self.assertLess(dosed-result,.5)
+
+class PHSamplerTests(SimpleTestCase):
+    def test_running_statistics_match_batch(self):
+        values=[6.21,6.25,6.19,6.3,6.22]
+        statistics=runningStatistics()
+        for value in values:
+            statistics.add(value)
+        mean=sum(values)/len(values)
+        self.assertAlmostEqual(statistics.mean,mean)
+        self.assertAlmostEqual(statistics.variance(),sum((value-mean)**2 for value in values)/(len(values)-1))
+
+    def test_stops_early_when_stable(self):
+        sampler=PHSampler(lambda: 7.0,samplesPerSec=100,maxSampleSecs=1,earlyStop=True,minSamples=3)
+        reading=sampler.sample()
+        self.assertEqual(reading['ph'],7.0)
+        self.assertEqual(reading['samples'],3)
+        self.assertTrue(reading['stable'])
+
+    def test_noisy_probe_runs_to_cap_and_is_flagged(self):
+        rng=random.Random(1)
+        sampler=PHSampler(lambda: 7+rng.gauss(0,.5),samplesPerSec=100,maxSampleSecs=.2,earlyStop=True)
+        reading=sampler.sample()
+        self.assertEqual(reading['samples'],20)
+        self.assertFalse(reading['stable'])
+        self.assertGreater(reading['spread'],.2)
+
+class GrblControllerTests(SimpleTestCase):
+    def openController(self,**fakeArgs):
+        self.fake=fakeGrbl(**fakeArgs)
+        self.grblPort=serial.Serial(self.fake.portName,115200,timeout=.1)
+        self.controller=GrblController(self.grblPort,moveTimeoutSecs=10)
+        self.controller.start()
+        self.addCleanup(self.fake.close)
+        self.addCleanup(self.grblPort.close)
+        self.addCleanup(self.controller.stop)
+
+    def test_parses_both_status_formats(self):
+        self.assertEqual(parseStatusReport('<Run,MPos:1.000,2.500,-3.000,WPos:0.000,0.000,0.000>'),{'state':'Run','position':(1.0,2.5,-3.0)})
+        self.assertEqual(parseStatusReport(b'<Idle|MPos:1.000,2.500,-3.000|FS:0,0>\r\n'),{'state':'Idle','position':(1.0,2.5,-3.0)})
+        self.assertEqual(parseStatusReport('<Hold:0|WPos:4.000,5.000,6.000>')['state'],'Hold')
+        self.assertIsNone(parseStatusReport('ok'))
+
+    def test_move_resolves_at_target(self):
+        self.openController()
+        self.assertTrue(self.controller.move('X',12.5))
+        self.assertEqual(self.controller.lastStatus,{'state':'Idle','position':(12.5,0.0,0.0)})
+
+    def test_chained_moves_resolve_in_order(self):
+        self.openController()
+        moves=[('X',10),('Y',5),('X',20),('Z',3)]
+        futures=[self.controller.queueMove(axis,target) for axis,target in moves]
+        done,notDone=concurrent.futures.wait(futures,timeout=10)
+        self.assertEqual(len(notDone),0)
+        self.assertEqual(self.controller.lastStatus['position'],(20.0,5.0,3.0))
+        self.assertEqual(self.fake.linesReceived,['X10','Y5','X20','Z3'])
+
+    def test_x_move_refused_while_syringe_lowered(self):
+        self.openController()
+        self.controller.queueMove('Z',40)
+        with self.assertRaises(GrblError):
+            self.controller.move('X',10)
+        self.assertTrue(self.controller.move('Z',0))
+        self.assertTrue(self.controller.move('X',10))
+        self.assertEqual(self.fake.linesReceived,['Z40','Z0','X10'])
+
+    def test_homing_repeated_only_when_position_is_lost(self):
+        self.openController()
+        self.assertEqual(self.controller.homingNeeded(3),'not homed since the last alarm or reset')
+        self.assertEqual(self.controller.home(5),'ok')
+        self.assertIsNone(self.controller.homingNeeded(3))
+        for target in (1,2,3):
+            self.controller.move('X',target)
+        self.assertEqual(self.controller.homingNeeded(3),'3 moves since homing')
+        self.controller.home(5)
+        self.fake.alarm=True
+        self.assertEqual(self.controller.homingNeeded(3),'GRBL is Alarm')
+        self.assertFalse(self.controller.homed)
+
+    def test_only_the_firmware_homing_reply_counts_as_homed(self):
+        self.openController(homingReply=HOMING_DONE_REPLY)
+        self.assertEqual(self.controller.home(5),HOMING_DONE_REPLY)
+        self.assertIsNone(self.controller.homingNeeded(3))
+        for refusal in ('error:5','error:9'):
+            #Homing disabled, or the machine locked
+            self.fake.rejectLines=('$H',)
+            self.fake.rejectReply=refusal
+            with self.assertRaises(GrblError):
+                self.controller.home(5)
+            self.assertFalse(self.controller.homed)
+            self.assertEqual(self.controller.homingNeeded(3),'not homed since the last alarm or reset')
+            self.assertEqual(self.controller.commandedPosition,[None,None,None])
+            self.fake.rejectLines=()
+            self.controller.home(5)
+            self.assertTrue(self.controller.homed)
+
+    def test_homing_timeout_resets_grbl(self):
+        self.openController(homingSecs=1)
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            self.controller.home(.2)
+        time.sleep(1.5)
+        self.assertFalse(self.controller.homed)
+        self.assertEqual(self.controller.commandedPosition,[None,None,None])
+        self.assertEqual(self.controller.home(5),'ok')
+        self.assertTrue(self.controller.homed)
+
+    def test_rejected_line_fails_its_future(self):
+        self.openController(rejectLines=('X-1',))
+        with self.assertRaises(GrblError):
+            self.controller.move('X',-1)
+        self.assertTrue(self.controller.move('X',1))
+
+class SimulatedHardwareTests(SimpleTestCase):
+    def createHardware(self):
+        hardware=simulatedHardware(timeScale=.001,seed=1)
+        self.addCleanup(hardware.close)
+        backend=hardware.createPulseBackend('auto')
+        self.mainPump=StepperPump('Main',backend,6,5,11,100,.000025,.005,4000)
+        self.khSamplePump=StepperPump('KH Sample',backend,27,17,23,100,.00001,.01,4000)
+        self.khReagentPump=StepperPump('KH Reagent',backend,9,10,22,100,.00002,.01,4000)
+        hardware.attachPumps(self.mainPump,self.khSamplePump,self.khReagentPump)
+        self.pca61=hardware.motorKit(0x61)
+        self.pca62=hardware.motorKit(0x62)
+        self.pca62.motor3.throttle=1
+        self.pca62.motor4.throttle=1
+        return hardware
+
+    def test_auto_simulates_only_off_a_pi(self):
+        from unittest import mock
+        debugLog=mock.Mock()
+        with mock.patch('Hardware.isRaspberryPi',return_value=False):
+            hardware=createHardware('auto',.01,debugLog)
+        self.addCleanup(hardware.close)
+        self.assertTrue(hardware.simulated)
+        debugLog.warning.assert_called_once()
+        hardware=createHardware('simulated')
+        self.addCleanup(hardware.close)
+        self.assertEqual(hardware.name,'simulated')
+
+    def test_pi_without_its_libraries_raises(self):
+        from unittest import mock
+        with self.assertRaises(ImportError):
+            createHardware('pi',.01)
+        with mock.patch('Hardware.isRaspberryPi',return_value=True):
+            with self.assertRaises(ImportError):
+                createHardware('auto',.01)
+
+    def test_raspberry_pi_is_read_from_the_device_tree(self):
+        with tempfile.TemporaryDirectory() as directory:
+            piModel=directory + '/pi'
+            otherModel=directory + '/other'
+            with open(piModel,'wb') as model:
+                model.write(b'Raspberry Pi 4 Model B Rev 1.4\x00')
+            with open(otherModel,'wb') as model:
+                model.write(b'QEMU Virtual Machine\x00')
+            self.assertTrue(isRaspberryPi((directory + '/missing',piModel)))
+            self.assertFalse(isRaspberryPi((otherModel,)))
+            self.assertFalse(isRaspberryPi((directory + '/missing',)))
+
+    def test_pumps_fill_through_the_open_valve_and_drain(self):
+        hardware=self.createHardware()
+        world=hardware.world
+        self.mainPump.pump(5)
+        self.assertEqual(world.mixerVolumeML(),0)
+        self.pca62.motor3.throttle=0
+        self.mainPump.pump(5)
+        self.pca62.motor3.throttle=1
+        self.pca62.motor4.throttle=0
+        self.mainPump.pump(2,stepsPerML=66)
+        self.assertAlmostEqual(world.mixer['tankML'],5,places=2)
+        self.assertAlmostEqual(world.mixer['osmoseML'],2,places=1)
+        self.pca61.motor2.throttle=1
+        self.assertEqual(world.mixerVolumeML(),0)
+        self.khSamplePump.pump(50)
+        self.khSamplePump.pump(-20)
+        self.assertAlmostEqual(world.khJar['sampleML'],30,places=2)
+
+    def test_syringe_carries_reagent_into_the_mixer(self):
+        hardware=self.createHardware()
+        world=hardware.world
+        world.mixer['tankML']=5
+        world.model=developingColorModel((.5,.5,.5),developSecs=60)
+        port=hardware.openStepperPort()
+        controller=GrblController(port,moveTimeoutSecs=10)
+        controller.start()
+        self.addCleanup(port.close)
+        self.addCleanup(controller.stop)
+        for axis,target in (('X',3.7),('Y',10),('Z',55),('Y',70),('Y',60),('Z',0),('X',51.1),('Z',40),('Y',0),('Z',0)):
+            controller.move(axis,target)
+        self.assertEqual(world.mixer['reagents'],{'B':.5})
+        self.assertEqual(world.syringe,{'slot':None,'liquidML':0})
+        first=world.absorbance()
+        time.sleep(.05)
+        self.assertGreater(world.absorbance()[0],first[0])
+        world.developedSecs=600
+        self.assertAlmostEqual(world.absorbance()[0],.5,places=3)
+
+    def test_moves_take_the_time_of_the_board(self):
+        hardware=simulatedHardware(timeScale=.05)
+        self.addCleanup(hardware.close)
+        port=hardware.openStepperPort()
+        controller=GrblController(port,moveTimeoutSecs=10)
+        controller.start()
+        self.addCleanup(port.close)
+        self.addCleanup(controller.stop)
+        startTime=time.time()
+        controller.move('X',51.1)
+        #Plus up to a status poll or two before the driver sees it finish
+        moveSecs=time.time()-startTime
+        self.assertGreaterEqual(moveSecs,estimateMoveSecs(51.1,500,10)*.05)
+        self.assertLess(moveSecs,estimateMoveSecs(51.1,500,10)*.05+.25)
+
+    def test_titration_color_flips_at_the_endpoint(self):
+        hardware=self.createHardware()
+        world=hardware.world
+        world.mixer['tankML']=5
+        world.model=titrationColorModel('C',.4,(.1,.6,.3),(.5,.2,.1))
+        world.mixer['reagents']['C']=.3
+        self.assertAlmostEqual(world.absorbance()[0],.1,places=2)
+        world.mixer['reagents']['C']=.5
+        self.assertAlmostEqual(world.absorbance()[0],.5,places=2)
+
+    def test_ph_probe_reaches_the_endpoint_at_the_tank_kh(self):
+        hardware=self.createHardware()
+        world=hardware.world
+        world.setKHChemistry(8.0,50*1/2800)
+        self.khSamplePump.pump(50)
+        probe=hardware.phProbe
+        self.assertGreater(probe.readPH(25),7.5)
+        self.khReagentPump.pump(7.8)
+        self.assertGreater(probe.readPH(25),4.5)
+        self.khReagentPump.pump(.4)
+        self.assertLess(probe.readPH(25),4.5)
+
+class LatestMeasurementTests(TestCase):
+    def setUp(self):
+        from tester.models import MeasuredParameters
+        from TesterCore import Tester
+        MeasuredParameters.objects.create(pk=1)
+        self.tester=object.__new__(Tester)
+        self.tester.__dict__.update(latestMeasurement=None,latestMeasurementSaved=True,latestMeasurementSaveTime=0,measurementSaveIntervalSecs=60,phaseTrace=None)
+        self.tester.sensorReadSeconds=types.SimpleNamespace(time=lambda **labels:contextlib.nullcontext())
+        self.absorbance=(.2,.4,.6)
+        self.tester.colorSensor=types.SimpleNamespace(measureRGB=lambda:self.absorbance)
+        from unittest import mock
+        #measureArduinoSensor and the view print each reading and each failed connection
+        patcher=mock.patch('builtins.print')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def savedMeasurement(self):
+        from tester.models import MeasuredParameters
+        saved=MeasuredParameters.objects.get(pk=1)
+        return saved.abR,saved.abG,saved.abB
+
+    def test_first_reading_is_saved_and_later_ones_wait_for_the_interval(self):
+        with self.assertNumQueries(1):
+            self.tester.measureArduinoSensor()
+        self.assertEqual(self.savedMeasurement(),(.2,.4,.6))
+        self.absorbance=(.3,.5,.7)
+        with self.assertNumQueries(0):
+            self.tester.measureArduinoSensor()
+            self.tester.measureArduinoSensor()
+        self.assertEqual(self.savedMeasurement(),(.2,.4,.6))
+        self.tester.latestMeasurementSaveTime-=60
+        with self.assertNumQueries(1):
+            self.tester.measureArduinoSensor()
+        self.assertEqual(self.savedMeasurement(),(.3,.5,.7))
+
+    def test_forced_save_writes_only_a_pending_reading(self):
+        self.tester.measureArduinoSensor()
+        self.absorbance=(.3,.5,.7)
+        self.tester.measureArduinoSensor()
+        #The end of a test
+        with self.assertNumQueries(1):
+            self.tester.saveMeasurementIfDue(force=True)
+        self.assertEqual(self.savedMeasurement(),(.3,.5,.7))
+        with self.assertNumQueries(0):
+            self.tester.saveMeasurementIfDue(force=True)
+
+    def test_control_page_reads_the_tester_and_falls_back_to_the_database(self):
+        from unittest import mock
+        import AutoTester
+        from tester import views
+        self.tester.measureArduinoSensor()
+        self.absorbance=(.3,.5,.7)
+        self.tester.measureArduinoSensor()
+        with mock.patch.object(AutoTester,'tester',self.tester,create=True):
+            remoteMeasurement=AutoTester.TesterRemoteControl().exposed_getLatestMeasurement()
+        connection=types.SimpleNamespace(root=types.SimpleNamespace(getLatestMeasurement=lambda:remoteMeasurement))
+        with mock.patch.object(views.rpyc,'connect',return_value=connection):
+            measurement=views.getLatestMeasurement()
+        self.assertEqual((measurement.abR,measurement.abG,measurement.abB),(.3,.5,.7))
+        with mock.patch.object(views.rpyc,'connect',side_effect=ConnectionRefusedError):
+            measurement=views.getLatestMeasurement()
+        self.assertEqual((measurement.abR,measurement.abG,measurement.abB),(.2,.4,.6))
+
+class SimulatedResultTests(TestCase):
+    def setUp(self):
+        from TesterCore import Tester
+        self.tester=object.__new__(Tester)
+        self.tester.currentTest='Nitrate'
+        self.tester.phaseTrace=None
+        self.tester.testerName='Tester'
+
+    def test_results_say_whether_they_were_simulated(self):
+        from tester.models import TestResultsExternal
+        for simulation in (True,False):
+            self.tester.simulation=simulation
+            self.assertTrue(self.tester.saveTestResults(5.0))
+            self.assertEqual(TestResultsExternal.objects.get(pk=self.tester.lastResultID).simulated,simulation)
+
+    def test_simulated_results_are_not_reported(self):
+        from unittest import mock
+        import Alarms
+        with mock.patch.object(Alarms,'telegram_bot_sendtext') as sendText:
+            self.tester.simulation=True
+            Alarms.sendMeasurementReport(self.tester,'Nitrate',5.0)
+            sendText.assert_not_called()
+            self.tester.simulation=False
+            Alarms.sendMeasurementReport(self.tester,'Nitrate',5.0)
+            sendText.assert_called_once()
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.registry=MetricsRegistry()
+
+    def test_counters_and_gauges_render_in_prometheus_format(self):
+        tests=self.registry.counter('autotester_tests_total','Tests run by outcome',labelNames=('test','result'))
+        tests.inc(test='Alkalinity',result='succeeded')
+        tests.inc(2,test='Alkalinity',result='succeeded')
+        tests.inc(test='Nitrate "low"',result='failed')
+        viewers={'count':3}
+        self.registry.gauge('autotester_stream_viewers','Stream viewers',function=lambda: viewers['count'])
+        self.registry.gauge('autotester_job_queue_depth','Queued jobs',function=lambda: self.missingAttribute)
+        self.assertEqual(self.registry.render().splitlines(),[
+            '# HELP autotester_tests_total Tests run by outcome',
+            '# TYPE autotester_tests_total counter',
+            'autotester_tests_total{test="Alkalinity",result="succeeded"} 3',
+            'autotester_tests_total{test="Nitrate \\"low\\"",result="failed"} 1',
+            '# HELP autotester_stream_viewers Stream viewers',
+            '# TYPE autotester_stream_viewers gauge',
+            'autotester_stream_viewers 3',
+            '# HELP autotester_job_queue_depth Queued jobs',
+            '# TYPE autotester_job_queue_depth gauge'])
+        with self.assertRaises(ValueError):
+            tests.inc(test='Alkalinity')
+        with self.assertRaises(ValueError):
+            tests.inc(-1,test='Alkalinity',result='failed')
+        with self.assertRaises(ValueError):
+            self.registry.counter('autotester_tests_total','Again')
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram=self.registry.histogram('autotester_sensor_read_seconds','Sensor reads',labelNames=('sensor',),buckets=(.1,1))
+        for value in (.05,.1,.5,3):
+            histogram.observe(value,sensor='color')
+        with histogram.time(sensor='ph'):
+            pass
+        lines=self.registry.render().splitlines()
+        self.assertEqual(lines[2:7],[
+            'autotester_sensor_read_seconds_bucket{sensor="color",le="0.1"} 2',
+            'autotester_sensor_read_seconds_bucket{sensor="color",le="1"} 3',
+            'autotester_sensor_read_seconds_bucket{sensor="color",le="+Inf"} 4',
+            'autotester_sensor_read_seconds_sum{sensor="color"} 3.65',
+            'autotester_sensor_read_seconds_count{sensor="color"} 4'])
+        self.assertEqual(histogram.count(sensor='ph'),1)
+
+    def test_query_counter_wraps_execute(self):
+        queries=self.registry.counter('autotester_db_queries_total','Queries',labelNames=('operation',))
+        wrapper=countQueries(queries)
+        self.assertEqual(wrapper(lambda sql,params,many,context: 'rows','  select * from tester_jobexternal',None,False,{}),'rows')
+        wrapper(lambda sql,params,many,context: None,'UPDATE tester_jobexternal SET jobStatus=%s',('Running',),False,{})
+        self.assertEqual((queries.value(operation='SELECT'),queries.value(operation='UPDATE')),(1,1))
+
+class MotionPlannerTests(SimpleTestCase):
+    def test_plan_streams_moves_and_stops_at_checkpoints(self):
+        fake=fakeGrbl(unitsPerSec=1000)
+        grblPort=serial.Serial(fake.portName,115200,timeout=.1)
+        controller=GrblController(grblPort,moveTimeoutSecs=10)
+        controller.start()
+        self.addCleanup(fake.close)
+        self.addCleanup(grblPort.close)
+        self.addCleanup(controller.stop)
+        agitations=[]
+        def agitate(secs):
+            agitations.append((secs,list(fake.linesReceived),controller.lastStatus['position']))
+        plan=planReagentStep(10,50,.5,0,.03,5,0,False,agitate=agitate)
+        self.assertEqual(len(plan.segments),2)
+        self.assertIsNone(runMotionPlan(controller,plan))
+        self.assertEqual(agitations,[(5,['X10'],(10.0,0.0,0.0))])
+        self.assertEqual(fake.linesReceived,['X10','Y50','Z55','Y0','Y53','Y50','Z0','X50','Z40','Y0','Z0'])
+
+    def test_failed_move_is_returned(self):
+        fake=fakeGrbl(unitsPerSec=1000,rejectLines=('Z55',))
+        grblPort=serial.Serial(fake.portName,115200,timeout=.1)
+        controller=GrblController(grblPort,moveTimeoutSecs=10)
+        controller.start()
+        self.addCleanup(fake.close)
+        self.addCleanup(grblPort.close)
+        self.addCleanup(controller.stop)
+        trace=PhaseTrace('Test')
+        failedMove=runMotionPlan(controller,planReagentStep(10,50,.5,0,.03,0,0,False),trace=trace)
+        self.assertEqual((failedMove['axis'],failedMove['target']),('Z',55))
+        self.assertEqual([phase['failed'] for phase in trace.phases],[False,False,True])
+        self.assertEqual(trace.phases[-1]['name'],failedMove['description'])
+
+    def test_dry_run_estimate(self):
+        self.assertAlmostEqual(estimateMoveSecs(1,600,10),2*(.1**.5))
+        self.assertAlmostEqual(estimateMoveSecs(100,600,10),11)
+        ts=types.SimpleNamespace(reagent1Slot='A',reagent1Amount=.5,reagent1AgitateSecs=5,reagent1AgitateSecsBetweenDrips=0,reagent1ThickLiquid=False,reagent1AgitateMixerSecs=10,
+            reagent2Slot=None,reagent2Amount=0)
+        estimate=estimateTestDefinition(ts)
+        self.assertEqual(estimate['moves'],11)
+        self.assertEqual(estimate['checkpointSecs'],15)
+        self.assertGreater(estimate['motionSecs'],0)
+
+class TestDefinitionEstimateTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from tester.models import ReagentSetup,TestDefinition
+        slotA=ReagentSetup.objects.create(slotName='A',used=True)
+        TestDefinition.objects.create(testName='Nitrate',reagent1Slot=slotA,reagent1Amount=.5)
+        TestDefinition.objects.create(testName='KH',KHtestwithPHProbe=True,titrationSlot=slotA)
+        self.client.force_login(User.objects.create_user('operator'))
+
+    def test_test_list_shows_the_dry_run_of_each_test(self):
+        response=self.client.get('/tester/testdef/')
+        self.assertEqual(response.status_code,200)
+        estimates={test.testName:test.motionEstimate for test in response.context['testDefList']}
+        self.assertIsNone(estimates['KH'])
+        self.assertGreater(estimates['Nitrate']['moves'],0)
+        self.assertContains(response,str(estimates['Nitrate']['moves']) + ' moves,',count=1)
+
+    def test_edit_page_shows_the_dry_run(self):
+        response=self.client.post('/tester/testdef/',{'testListAction':'EDIT Nitrate'})
+        self.assertEqual(response.status_code,200)
+        self.assertContains(response,'Syringe dry run as saved: ' + str(response.context['motionEstimate']['moves']) + ' moves')
+
+class StepPulsesTests(SimpleTestCase):
+    def test_trapezoidal_profile(self):
+        profile=trapezoidalProfile(1000,5000,250)
+        periods=[periodUs for periodUs,count in profile]
+        self.assertEqual(profileSteps(profile),1000)
+        self.assertEqual(periods,list(reversed(periods)))
+        self.assertEqual(min(periods),250)
+        self.assertEqual(periods[:3],[5000,4900,4800])
+        self.assertEqual(profileSteps(trapezoidalProfile(10.2,5000,250)),11)
+        self.assertEqual(trapezoidalProfile(-5,5000,250),[])
+
+    def test_simulated_backend_records_trains(self):
+        backend=simulatedPulseBackend()
+        profile=trapezoidalProfile(100,1000,200)
+        self.assertAlmostEqual(backend.sendPulses(5,profile),profileDurationSecs(profile))
+        edges=backend.risingEdgesUs(backend.pulseTrains[0])
+        self.assertEqual(len(edges),100)
+        self.assertEqual(edges[1]-edges[0],1000)
+        self.assertEqual(edges[50]-edges[49],200)
+
+    def test_gpio_backend_keeps_to_the_schedule(self):
+        gpio=edgeRecordingGPIO()
+        profile=[(500,400)]
+        gpioPulseBackend(gpio).sendPulses(5,profile)
+        self.assertEqual(len(gpio.risingEdges),400)
+        #The process can be descheduled now and then, which delays the rest of the train, but most edges keep to the schedule
+        periodsUs=sorted((later-earlier)*1000000 for earlier,later in zip(gpio.risingEdges,gpio.risingEdges[1:]))
+        self.assertAlmostEqual(periodsUs[len(periodsUs)//2],500,delta=50)
+        self.assertGreaterEqual(gpio.risingEdges[-1]-gpio.risingEdges[0],399*500/1000000*.95)
+
+class StepperPumpTests(SimpleTestCase):
+    def test_pump_drives_pins_and_reports_duration(self):
+        backend=simulatedPulseBackend()
+        pump=StepperPump('Test',backend,6,5,11,13000,.000025,.005,4000)
+        self.assertIs(pump.rampPeriodsUs,rampTable(5000,250))
+        expectedSecs=pump.dispenseSecs(2)
+        self.assertAlmostEqual(pump.pump(2),expectedSecs)
+        self.assertEqual(backend.pulseTrains[0]['steps'],26000)
+        self.assertEqual(backend.pinWrites,[(6,0),(11,0),(6,1)])
+        pump.pump(-1,stepsPerML=100)
+        self.assertEqual(backend.pulseTrains[1]['steps'],100)
+        self.assertEqual(backend.pinWrites[3:],[(6,0),(11,1),(6,1)])
+        self.assertFalse(pump.enabled)
+
+class PumpCalibrationTests(TestCase):
+    def setUp(self):
+        from tester.models import CalibrationValues
+        from TesterCore import Tester
+        CalibrationValues.objects.create(pk=1)
+        self.tester=object.__new__(Tester)
+        self.tester.debugLog=logging.getLogger('PumpCalibrationTests')
+        self.tester.pulseBackend=simulatedPulseBackend()
+        self.tester.pumpMaxStepRate=4000
+        self.tester.hardware=types.SimpleNamespace(attachPumps=lambda *pumps:None)
+        motor=types.SimpleNamespace(throttle=None)
+        self.tester.pca62=types.SimpleNamespace(motor3=motor,motor4=motor)
+        self.tester.loadCalibrationValuesFromDB()
+        self.tester.createPumps()
+
+    def stepsOfLastTrain(self):
+        return self.tester.pulseBackend.pulseTrains[-1]['steps']
+
+    def test_reloaded_calibration_changes_the_steps_sent(self):
+        from tester.models import CalibrationValues
+        from WebCmdHandler import parseCalibrate
+        parseCalibrate(self.tester,'DoseKHSample',None,None)
+        self.assertEqual(self.stepsOfLastTrain(),50*22000)
+        #The operator measured 55 ML from the 50 ML dose
+        CalibrationValues.objects.filter(pk=1).update(calibrationMLAutotester=4,calibrationMLKHSample=55,calibraitonMLKHReagent=15)
+        parseCalibrate(self.tester,'UPDATE',None,None)
+        parseCalibrate(self.tester,'DoseKHSample',None,None)
+        self.assertEqual(self.stepsOfLastTrain(),50*20000)
+        parseCalibrate(self.tester,'DoseAutoTester',None,None)
+        self.assertEqual(self.stepsOfLastTrain(),5*16250)
+        self.tester.sampleWaterPumpCommand(2)
+        self.assertEqual(self.stepsOfLastTrain(),2*20000)
+
+    def test_osmose_water_uses_the_reloaded_calibration(self):
+        from tester.models import CalibrationValues
+        CalibrationValues.objects.filter(pk=1).update(pumpStepsAutotester=15000)
+        self.tester.loadCalibrationValuesFromDB()
+        self.tester.phaseTrace=None
+        self.tester.MixerReactorPump(1,'osmosewater')
+        self.assertEqual(self.stepsOfLastTrain(),10000)
+
+class StepExecutorTests(SimpleTestCase):
+    def test_operations_on_separate_resources_overlap(self):
+        executor=StepExecutor()
+        simulatedTestStep(executor,timeScale=.005,cleanSyringe=False)
+        report=executor.run()
+        self.assertIsNone(report['failed'])
+        self.assertAlmostEqual(report['serialSecs'],133*.005,delta=.1)
+        self.assertLess(report['wallSecs'],report['serialSecs']-15*.005)
+        self.assertGreater(report['savedSecs'],0)
+
+    def test_shared_resource_and_dependencies_are_respected(self):
+        executor=StepExecutor()
+        events=[]
+        def operation(name):
+            def action():
+                events.append(name + ' start')
+                time.sleep(.02)
+                events.append(name + ' end')
+            return action
+        executor.add('clean',operation('clean'),resources=('agitator',))
+        executor.add('agitate',operation('agitate'),resources=('agitator',))
+        executor.add('dose',operation('dose'),resources=('carriage',),after=('clean',))
+        executor.run()
+        for first,second in (('clean','agitate'),('agitate','clean')):
+            if events.index(first + ' start')<events.index(second + ' start'):
+                self.assertLess(events.index(first + ' end'),events.index(second + ' start'))
+        self.assertLess(events.index('clean end'),events.index('dose start'))
+
+    def test_failure_skips_later_operations(self):
+        executor=StepExecutor(parallel=False)
+        ran=[]
+        executor.add('fill',lambda: False,resources=('mainPump',))
+        executor.add('dose',lambda: ran.append('dose'),after=('fill',))
+        report=executor.run()
+        self.assertEqual(report['failed'],'fill')
+        self.assertEqual([operation['status'] for operation in report['operations']],['Failed','Skipped'])
+        self.assertEqual(ran,[])
+        with self.assertRaises(ValueError):
+            executor.add('agitate',lambda: None,after=('missing',))
+
+    def test_resources_taken_part_way_through_are_declared_and_checked(self):
+        executor=StepExecutor()
+        executor.add('draw',lambda: None,resources=('carriage',),laterResources=('agitator',))
+        executor.add('clean',lambda: None,resources=('carriage','agitator'))
+        #Each could hold what the other waits for part way through
+        with self.assertRaises(ValueError):
+            executor.add('agitate',lambda: None,resources=('agitator',),laterResources=('carriage',))
+        def undeclared():
+            with executor.holding('mainPump'):
+                pass
+        def nested():
+            with executor.holding('agitator'):
+                with executor.holding('sensor'):
+                    pass
+        def reentrant():
+            with executor.holding('agitator'):
+                with executor.holding('mainDrain'):
+                    pass
+        executor=StepExecutor(parallel=False)
+        executor.add('undeclared',undeclared,resources=('carriage',),laterResources=('agitator',))
+        executor.add('nested',nested,laterResources=('agitator','sensor'))
+        executor.add('reentrant',reentrant,resources=('mainDrain',),laterResources=('agitator',))
+        report=executor.run()
+        self.assertEqual([operation['status'] for operation in report['operations']],['Failed','Failed','Done'])
+        self.assertEqual(executor.resourceOwners,{})
+
+class LogReaderTests(SimpleTestCase):
+    def setUp(self):
+        self.logPath=tempfile.mkdtemp()
+        self.logger=logging.getLogger('LogReaderTests' + str(id(self)))
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate=False
+        handler=logging.handlers.RotatingFileHandler(self.logPath + '/debug.log',maxBytes=3000,backupCount=4)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(threadName)s - %(levelname)s - %(message)s'))
+        self.logger.addHandler(handler)
+        self.addCleanup(handler.close)
+
+    def test_tail_keeps_tracebacks_with_their_record(self):
+        for i in range(40):
+            self.logger.info('line %d',i)
+        try:
+            1/0
+        except ZeroDivisionError:
+            self.logger.exception('Division failed')
+        records,cursor=tailRecords(self.logPath,'debug.log',3)
+        self.assertEqual([record['text'].split(' - ')[3].split('\n')[0] for record in records],['line 38','line 39','Division failed'])
+        self.assertTrue(records[-1]['text'].endswith('ZeroDivisionError: division by zero'))
+        self.assertEqual((records[-1]['thread'],records[-1]['level']),('MainThread','ERROR'))
+        records,cursor=tailRecords(self.logPath,'debug.log',5,minLevel='ERROR')
+        self.assertEqual(len(records),1)
+
+    def test_polling_reads_only_new_records_across_rotation(self):
+        self.logger.info('before')
+        records,cursor=tailRecords(self.logPath,'debug.log',10)
+        for i in range(60):
+            self.logger.warning('warning %d',i)
+            self.logger.debug('debug %d',i)
+        records,cursor=readNewRecords(self.logPath,'debug.log',cursor,minLevel='WARNING')
+        self.assertEqual([record['text'].split(' - ')[3] for record in records],['warning %d' % i for i in range(60)])
+        records,cursor=readNewRecords(self.logPath,'debug.log',cursor)
+        self.assertEqual(records,[])
+        records,cursor=readNewRecords(self.logPath,'debug.log',cursor,threadName='Other Thread')
+        self.logger.info('after')
+        records,cursor=readNewRecords(self.logPath,'debug.log',cursor,threadName='MainThread')
+        self.assertEqual(len(records),1)
+
+class LogPipelineTests(SimpleTestCase):
+    def setUp(self):
+        self.logPath=tempfile.mkdtemp()
+        self.context=LogContext()
+        self.pipeline=LogPipeline(queueSize=50,context=self.context)
+        self.logger=logging.getLogger('LogPipelineTests' + str(id(self)))
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate=False
+        self.handler=logging.handlers.RotatingFileHandler(self.logPath + '/debug.log',maxBytes=4000,backupCount=4)
+        self.handler.setFormatter(JsonFormatter())
+        self.handler.setLevel(logging.INFO)
+        self.pipeline.attach(self.logger,[self.handler])
+        self.addCleanup(self.handler.close)
+
+    def test_records_carry_the_test_context_and_read_back(self):
+        self.pipeline.start()
+        self.context.set(test='Alkalinity',step=1,phase='reagent')
+        self.logger.info('Dispensing')
+        self.logger.debug('Not written')
+        self.context.set(step=None,phase='titration')
+        try:
+            1/0
+        except ZeroDivisionError:
+            self.logger.exception('Titration failed')
+        self.context.clear()
+        self.logger.info('Idle')
+        self.pipeline.stop()
+        records,cursor=tailRecords(self.logPath,'debug.log',10)
+        self.assertEqual([(record['test'],record['step'],record['phase'],record['level']) for record in records],
+            [('Alkalinity',1,'reagent','INFO'),('Alkalinity',None,'titration','ERROR'),(None,None,None,'INFO')])
+        self.assertTrue(records[0]['text'].endswith('MainThread - INFO - [Alkalinity, step 1, reagent] Dispensing'))
+        self.assertTrue(records[1]['text'].endswith('ZeroDivisionError: division by zero'))
+        records,cursor=tailRecords(self.logPath,'debug.log',10,minLevel='ERROR',threadName='MainThread')
+        self.assertEqual(len(records),1)
+
+    def test_full_queue_drops_records_instead_of_waiting(self):
+        #The listener is not started, so nothing takes records off the queue
+        startTime=time.perf_counter()
+        for i in range(80):
+            self.logger.info('record %d',i)
+        self.assertLess(time.perf_counter()-startTime,1)
+        self.assertEqual(self.pipeline.droppedRecords(),30)
+        self.pipeline.start()
+        self.pipeline.stop()
+        records,cursor=tailRecords(self.logPath,'debug.log',100)
+        self.assertEqual(len(records),50)
+
+class PhaseTraceTests(SimpleTestCase):
+    def setUp(self):
+        self.now=100.0
+        self.trace=PhaseTrace('Alkalinity',clock=lambda: self.now)
+        class fakeTester:
+            phaseTrace=None
+            @traced('move {0} to {1}','motion')
+            def move(innerSelf,axis,target):
+                self.now+=2
+            @traced('read color sensor','sensor')
+            def read(innerSelf):
+                self.now+=.5
+                if self.now>200:
+                    raise ValueError('sensor gone')
+        self.tester=fakeTester()
+
+    def test_phases_are_only_timed_during_a_test(self):
+        self.tester.move('X',10)
+        self.assertEqual(self.trace.phases,[])
+        self.tester.phaseTrace=self.trace
+        self.tester.move('X',10)
+        self.tester.move(axis='Z',target=0)
+        self.tester.move('Y',target=5)
+        self.assertEqual([(phase['name'],phase['start'],phase['secs']) for phase in self.trace.phases],[('move X to 10',2,2),('move Z to 0',4,2),('move Y to 5',6,2)])
+        self.now=250
+        with self.assertRaises(ValueError):
+            self.tester.read()
+        self.assertTrue(self.trace.phases[-1]['failed'])
+        self.assertEqual(self.trace.categorySecs,{'motion':6,'sensor':.5})
+
+    def test_waterfall_merges_repeated_phases(self):
+        self.tester.phaseTrace=self.trace
+        with self.trace.phase('titration','test step'):
+            for i in range(10):
+                self.tester.read()
+            self.tester.move('Y',50)
+        trace=json.loads(self.trace.toJson())
+        rows=waterfallRows(trace)
+        self.assertEqual([row['label'] for row in rows],['titration','read color sensor x10','move Y to 50'])
+        self.assertEqual([(row['left'],row['width']) for row in rows],[(0,100),(0,71.43),(71.43,28.57)])
@@ -17,6 +17,8 @@ from . import views
 
 app_name='tester'
 urlpatterns = [
+    #ex: /tester/logdata?radioLogDisplay=Debug&cursor=1234-5678, ahead of index which would take any single word
+    url(r'^logdata$',views.logData,name='logdata'),
     #ex: /tester
     url(r'^(?P<formResult>[\w-]*)$',views.index,name='index'),
     #ex: /tester/home
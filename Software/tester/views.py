@@ -18,6 +18,9 @@ from django.contrib import messages
 from django.forms import formset_factory
 from django.forms.models import modelformset_factory
 from TesterCore import getBasePath
+from LogReader import LOG_LEVELS,tailRecords,readNewRecords
+from PhaseTrace import loadTrace,waterfallRows
+from MotionPlanner import estimateTestDefinition
 from django.contrib.auth.decorators import login_required
 #from django.utils.timezone import activate
 import time
@@ -26,7 +29,7 @@ import os
 import rpyc
 import traceback
 # Create your views here.
-from django.http import HttpResponse,Http404,HttpResponseRedirect
+from django.http import HttpResponse,Http404,HttpResponseRedirect,JsonResponse
 from .models import TestDefinition,TestResultsExternal,JobExternal,TestResultsExternal, \
     TesterFeatureExternal,SwatchExternal,ColorSheetExternal,TesterExternal,JobEntry,TestSchedule, \
     ReagentSetup,TesterExternal,CalibrationValues,MeasuredParameters
@@ -42,6 +45,25 @@ def sendCmdToTester(cmd):
     except:
         print('Cmd: ' + cmd + 'failure reported') 
         
+def getLatestMeasurement():
+    #The tester holds the newest color reading in memory, the database row is only written periodically
+    try:
+        c=rpyc.connect("localhost",18861)
+        measurement=c.root.getLatestMeasurement()
+        if not measurement is None:
+            return MeasuredParameters(pk=1,**dict(measurement))
+    except:
+        print('Latest measurement not available from tester') 
+    return MeasuredParameters.objects.get(pk=1)
+        
+def notifyTesterJobQueueChanged():
+    #The tester keeps the queue in memory, so tell it to reread the JobExternal table
+    try:
+        c=rpyc.connect("localhost",18861)
+        c.root.jobQueueChanged()
+    except:
+        print('Job queue change notification failed') 
+        
     
 def getDisplayInfo(request):
     requestHost=request.get_host()
@@ -101,12 +123,14 @@ def home(request,formResult):
                     newJob=JobExternal()
                     newJob.jobToRun=tests
                     newJob.save()
+                notifyTesterJobQueueChanged()
             else: 
                 try:
                     te=TesterExternal.objects.get(pk=1)
                     newJob=JobExternal()
                     newJob.jobToRun=TestDefinition.objects.get(testName=testSequenceNameToRun)
                     newJob.save()
+                    notifyTesterJobQueueChanged()
                     #return HttpResponseRedirect('run')
                 except: 
                     traceback.print_exc()
@@ -117,7 +141,9 @@ def home(request,formResult):
             updateID=int(updateIndex[1])
             if updateIndex[0]=='REMOVE':
                 try:
-                    JobExternal.objects.get(pk=updateID).delete()
+                    #Only while still queued, a job the tester has already claimed is cancelled instead
+                    if JobExternal.objects.filter(pk=updateID,jobStatus='Queued').delete()[0]>0:
+                        notifyTesterJobQueueChanged()
                 except:
                     pass
             elif updateIndex[0]=='DELETE':
@@ -129,7 +155,7 @@ def home(request,formResult):
                 #return HttpResponse("")
 
     testList=TestDefinition.objects.all()
-    jobQueue=JobExternal.objects.all()
+    jobQueue=JobExternal.objects.select_related('jobToRun')
     jobList=[]
     for job in reversed(jobQueue):
         newJob=JobEntry()
@@ -154,6 +180,8 @@ def home(request,formResult):
                 newJob.jobText ='Failed'
             else:
                 newJob.jobText='Completed (' + str(round(result.results,2)) + ')'
+            if result.simulated:
+                newJob.jobText+=' Simulated'
         elif result.status=='Failed':
             newJob.jobText='Failed'
         else:
@@ -183,11 +211,26 @@ def history(request,formResult):
         test="All"
     testList=TestDefinition.objects.all()
     currentlySelected=test
+    #The traces are only read for the one result whose timing is shown
     if currentlySelected is None or currentlySelected=="All":
-        resultsList=TestResultsExternal.objects.all()
+        resultsList=TestResultsExternal.objects.defer('timingTrace')
     else:
-        resultsList=TestResultsExternal.objects.filter(testPerformed=currentlySelected)
-    context={'pageName':pageName,'currentlySelected':currentlySelected,'testList':testList,'resultsList':resultsList}
+        resultsList=TestResultsExternal.objects.filter(testPerformed=currentlySelected).defer('timingTrace')
+    tracedResults=set(TestResultsExternal.objects.exclude(timingTrace=None).values_list('pk',flat=True))
+    tracedResult=None
+    trace=None
+    waterfall=[]
+    try:
+        tracedResult=TestResultsExternal.objects.get(pk=int(request.GET['trace']))
+        trace=loadTrace(tracedResult.timingTrace)
+        waterfall=waterfallRows(trace)
+    except (KeyError,ValueError,TestResultsExternal.DoesNotExist):
+        pass
+    categorySecs=[]
+    if not trace is None:
+        categorySecs=sorted(trace['categorySecs'].items(),key=lambda item:-item[1])
+    context={'pageName':pageName,'currentlySelected':currentlySelected,'testList':testList,'resultsList':resultsList,
+        'tracedResults':tracedResults,'tracedResult':tracedResult,'trace':trace,'waterfall':waterfall,'categorySecs':categorySecs}
     return render(request,'tester/history.html',context)
    
 @login_required
@@ -211,7 +254,7 @@ def control(request,formResult):
         except:
             pass
 
-    MeasureInfo=MeasuredParameters.objects.get(pk=1)
+    MeasureInfo=getLatestMeasurement()
     MeasuredParametersData=MeasuredParametersForm(instance=MeasureInfo)
     context={'pageName':pageName,'streamingURL':streamingURL,'MeasuredParametersData':MeasuredParametersData}
     return render(request,'tester/control.html',context)
@@ -452,6 +495,22 @@ def schedule(request,formResult):
     return render(request,'tester/schedule.html',context)
     
 
+def getMotionEstimate(test):
+    #Dry run of the syringe moves, so the operator can see what a test definition costs before it is run
+    if test.KHtestwithPHProbe:
+        return None
+    try:
+        return estimateTestDefinition(test)
+    except:
+        traceback.print_exc()
+        return None
+
+def withMotionEstimates(testDefList):
+    testDefs=list(testDefList.select_related('reagent1Slot','reagent2Slot','reagent3Slot'))
+    for test in testDefs:
+        test.motionEstimate=getMotionEstimate(test)
+    return testDefs
+
 @login_required
 def testdef(request,formResult):
     pageName='Define Test Sequences'
@@ -479,10 +538,10 @@ def testdef(request,formResult):
             testBeingEdited=TestDefinition.objects.get(testName=testToChange)
             testDef=TestDefinitionForm(instance=testBeingEdited)
             originalTestName=testToChange
-            context={'originalTestName':originalTestName,'testToChange':testToChange,'testDef':testDef}
+            context={'originalTestName':originalTestName,'testToChange':testToChange,'testDef':testDef,'motionEstimate':getMotionEstimate(testBeingEdited)}
         elif testAction=='DELETE':
             testBeingEdited=TestDefinition.objects.get(testName=testToChange).delete()
-            testDefList=TestDefinition.objects.all()
+            testDefList=withMotionEstimates(TestDefinition.objects.all())
             try:
                 TestSchedule.objects.get(testToSchedule=testToChange).delete()
                 sendCmdToTester('RELOAD/TestDefs')           
@@ -540,7 +599,7 @@ def testdef(request,formResult):
                                 oldTestSched=TestSchedule()
                             oldTestSched.testToSchedule=newTestName
                             oldTestSched.save()                    
-                testDefList=TestDefinition.objects.all()
+                testDefList=withMotionEstimates(TestDefinition.objects.all())
                 if retryTestSetup:
                     context={'originalTestName':newTestName,'testToChange':newTestName,'testDef':testDef}
                 else:    
@@ -551,7 +610,7 @@ def testdef(request,formResult):
         elif testButtonStr=='Cancel':
             return redirect('/tester/testdef/')
     else:
-        testDefList=TestDefinition.objects.all()
+        testDefList=withMotionEstimates(TestDefinition.objects.all())
         context={'pageName':pageName,'testDefList':testDefList}
     return render(request,'tester/testdef.html',context)
 
@@ -585,6 +644,19 @@ def reagent(request,formResult):
     context={'pageName':pageName,'reagFormSet':reagFormSet}
     return render(request,'tester/reagent.html',context)
     
+LOG_FILES={'Info':'tester.log','Debug':'debug.log'}
+LOG_RECORDS_SHOWN=500
+
+def getLogSelection(params):
+    logToDisplay=params.get('radioLogDisplay','Info')
+    if not logToDisplay in LOG_FILES:
+        logToDisplay='Info'
+    logLevel=params.get('logLevel','')
+    if not logLevel in LOG_LEVELS:
+        logLevel=''
+    logThread=params.get('logThread','').strip()
+    return logToDisplay,logLevel,logThread
+
 @login_required
 def logs(request,formResult):
     pageName='Display Logs'
@@ -592,37 +664,21 @@ def logs(request,formResult):
         jumpLoc=navigate(request) 
         if not jumpLoc is None:
             return redirect(jumpLoc)    
-    logToDisplay="Info"
     logPath=getBasePath() + 'Logs'
-    if request.method=='POST':
-        try:
-            logToDisplay=request.POST["radioLogDisplay"]
-        except:
-            pass
-    print(logToDisplay)
-    scrollLog=""
-    if logToDisplay=='Info':
-        try:
-            f=open(logPath + '/' + 'tester.log.1','r')
-            scrollLog=f.read()
-            f.close()
-            f=open(logPath + '/' + 'tester.log','r')
-            scrollLog=scrollLog + f.read()
-            f.close()
-        except:
-            traceback.print_exc()
-    else:
-        try:
-            f=open(logPath + '/' + 'debug.log.1','r')
-            scrollLog=f.read()
-            f.close()
-            f=open(logPath + '/' + 'debug.log','r')
-            scrollLog=scrollLog + f.read()
-            f.close()
-        except:
-            traceback.print_exc()
-    context={'pageName':pageName,'logToDisplay':logToDisplay,'scrollLog':scrollLog}
+    logToDisplay,logLevel,logThread=getLogSelection(request.POST if request.method=='POST' else {})
+    #Only the end of the log is read, the page then asks logdata for what is written after it
+    records,logCursor=tailRecords(logPath,LOG_FILES[logToDisplay],LOG_RECORDS_SHOWN,logLevel or None,logThread or None)
+    scrollLog='\n'.join(record['text'] for record in records)
+    threadNames=sorted(set(record['thread'] for record in records if not record['thread'] is None))
+    context={'pageName':pageName,'logToDisplay':logToDisplay,'scrollLog':scrollLog,'logCursor':logCursor,
+        'logLevel':logLevel,'logLevels':sorted(LOG_LEVELS,key=LOG_LEVELS.get),'logThread':logThread,'threadNames':threadNames}
     return render(request,'tester/logs.html',context)
+
+@login_required
+def logData(request):
+    logToDisplay,logLevel,logThread=getLogSelection(request.GET)
+    records,logCursor=readNewRecords(getBasePath() + 'Logs',LOG_FILES[logToDisplay],request.GET.get('cursor',''),logLevel or None,logThread or None)
+    return JsonResponse({'text':'\n'.join(record['text'] for record in records),'cursor':logCursor})
     
 @login_required
 def admin(request,formResult):